@@ -1,36 +1,199 @@
 import numpy as np
 import torch
-from .monotonic_align.core import maximum_path_c, maximum_path_gradtts_c
+from .monotonic_align.core import (
+    maximum_path_c,
+    maximum_path_gradtts_c,
+    maximum_path_banded_c,
+)
 
 
-def maximum_path(neg_cent, mask):
+# NOTE: MAS runs on every training step, so keep its CPU buffers between calls
+# rather than allocating new ones each time.
+_buffers = {}
+
+
+def _buffer(name, shape, dtype):
+  """A C-contiguous array of shape, backed by a buffer that is reused across
+  calls and grows when a larger one is needed."""
+  size = int(np.prod(shape))
+  buffer = _buffers.get(name)
+  if buffer is None or buffer.size < size:
+    buffer = _buffers[name] = np.empty(size, dtype=dtype)
+  return buffer[:size].reshape(shape)
+
+
+def _num_threads(num_threads):
+  """Default to the number of threads torch uses, which the trainers set from
+  the num_threads hparam."""
+  return num_threads or torch.get_num_threads()
+
+
+def maximum_path(neg_cent, mask, num_threads=None):
   """ Cython optimized version.
   neg_cent: [b, t_t, t_s]
   mask: [b, t_t, t_s]
+  num_threads: OpenMP threads to solve the batch items on.
   """
   device = neg_cent.device
   dtype = neg_cent.dtype
-  neg_cent = neg_cent.data.cpu().numpy().astype(np.float32)
-  path = np.zeros(neg_cent.shape, dtype=np.int32)
+  value = _buffer("value", neg_cent.shape, np.float32)
+  torch.from_numpy(value).copy_(neg_cent.detach())
+  path = _buffer("path", neg_cent.shape, np.int32)
+  path.fill(0)
 
-  t_t_max = mask.sum(1)[:, 0].data.cpu().numpy().astype(np.int32)
-  t_s_max = mask.sum(2)[:, 0].data.cpu().numpy().astype(np.int32)
-  maximum_path_c(path, neg_cent, t_t_max, t_s_max)
-  return torch.from_numpy(path).to(device=device, dtype=dtype)
+  t_t_max = mask[:, :, 0].sum(1).data.cpu().numpy().astype(np.int32)
+  t_s_max = mask[:, 0, :].sum(1).data.cpu().numpy().astype(np.int32)
+  maximum_path_c(path, value, t_t_max, t_s_max, _num_threads(num_threads))
+  # NOTE: copy, since the next call overwrites the path buffer.
+  return torch.from_numpy(path).to(device=device, dtype=dtype, copy=True)
 
-def maximum_path_gradtts(value, mask):  
+def maximum_path_gradtts(value, mask, num_threads=None):  
     """ Cython optimised version.
     value: [b, t_x, t_y]
     mask: [b, t_x, t_y]
+    num_threads: OpenMP threads to solve the batch items on.
     """
-    value = value * mask
     device = value.device
     dtype = value.dtype
-    value = value.data.cpu().numpy().astype(np.float32)
-    path = np.zeros_like(value).astype(np.int32)
-    mask = mask.data.cpu().numpy()
-
-    t_x_max = mask.sum(1)[:, 0].astype(np.int32)
-    t_y_max = mask.sum(2)[:, 0].astype(np.int32)
-    maximum_path_gradtts_c(path, value, t_x_max, t_y_max)
-    return torch.from_numpy(path).to(device=device, dtype=dtype)
+    masked_value = _buffer("value", value.shape, np.float32)
+    torch.from_numpy(masked_value).copy_((value * mask).detach())
+    path = _buffer("path", value.shape, np.int32)
+    path.fill(0)
+
+    t_x_max = mask[:, :, 0].sum(1).data.cpu().numpy().astype(np.int32)
+    t_y_max = mask[:, 0, :].sum(1).data.cpu().numpy().astype(np.int32)
+    maximum_path_gradtts_c(
+        path, masked_value, t_x_max, t_y_max, num_threads=_num_threads(num_threads)
+    )
+    # NOTE: copy, since the next call overwrites the path buffer.
+    return torch.from_numpy(path).to(device=device, dtype=dtype, copy=True)
+
+
+def _band(t_xs, t_ys, t_y_max, band_width, centers=None):
+    """The first token of the band of each frame, and the first and one past the
+    last token each frame may align to: band_width tokens either side of centers,
+    or of the diagonal, within the region a monotonic path can reach."""
+    y = np.arange(t_y_max, dtype=np.int32)[None]
+    t_xs = t_xs[:, None]
+    t_ys = t_ys[:, None]
+    if centers is None:
+        centers = (2 * y + 1) * t_xs // (2 * t_ys)
+    else:
+        centers = centers.data.cpu().numpy()
+    start = centers - band_width
+    lo = np.maximum(np.maximum(start, t_xs + y - t_ys), 0)
+    hi = np.minimum(np.minimum(centers + band_width + 1, t_xs), y + 1)
+    return tuple(np.ascontiguousarray(a, dtype=np.int32) for a in (start, lo, hi))
+
+
+def maximum_path_gradtts_banded(value, mask, band_width, centers=None, num_threads=None):
+    """ Banded version of maximum_path_gradtts, which only searches band_width
+    tokens either side of the diagonal, or of centers.
+    value: [b, t_x, t_y]
+    mask: [b, t_x, t_y]
+    band_width: tokens either side of the center to search.
+    centers: [b, t_y] token each frame is expected to align to, e.g. path.argmax(1)
+      of a previous alignment. Defaults to the diagonal.
+    num_threads: OpenMP threads to solve the batch items on.
+
+    Only the band of value is copied to the CPU, and only the token of each frame
+    comes back. Items with no monotonic path inside the band fall back to the full
+    search.
+    """
+    b, t_x, t_y = value.shape
+    band_width = min(band_width, t_x)
+    t_x_max = mask[:, :, 0].sum(1).data.cpu().numpy().astype(np.int32)
+    t_y_max = mask[:, 0, :].sum(1).data.cpu().numpy().astype(np.int32)
+    start, lo, hi = _band(t_x_max, t_y_max, t_y, band_width, centers)
+    offsets = torch.arange(2 * band_width + 1, device=value.device)
+    index = torch.from_numpy(start).to(value.device).long()[:, None] + offsets[:, None]
+    band = _buffer("band", index.shape, np.float32)
+    torch.from_numpy(band).copy_(value.detach().gather(1, index.clamp(0, t_x - 1)))
+    tokens = np.zeros((b, t_y), dtype=np.int32)
+    feasible = np.empty(b, dtype=np.int32)
+
+    maximum_path_banded_c(
+        tokens,
+        band,
+        start,
+        lo,
+        hi,
+        t_x_max,
+        t_y_max,
+        feasible,
+        num_threads=_num_threads(num_threads),
+    )
+    tokens = torch.from_numpy(tokens).to(value.device).long()
+    y_mask = mask[:, 0].to(value.dtype)
+    path = torch.zeros_like(value).scatter_(1, tokens[:, None], y_mask[:, None])
+    infeasible = torch.from_numpy(np.flatnonzero(feasible == 0)).to(value.device)
+    if len(infeasible):
+        path[infeasible] = maximum_path_gradtts(
+            value[infeasible], mask[infeasible], num_threads
+        )
+    return path
+
+
+def maximum_path_banded(neg_cent, mask, band_width, centers=None, num_threads=None):
+  """ Banded version of maximum_path.
+  neg_cent: [b, t_t, t_s]
+  mask: [b, t_t, t_s]
+  See maximum_path_gradtts_banded for the other arguments.
+  """
+  return maximum_path_gradtts_banded(
+    neg_cent.transpose(1, 2), mask.transpose(1, 2), band_width, centers, num_threads
+  ).transpose(1, 2)
+
+
+def maximum_path_gradtts_torch(value, mask, max_neg_val=-1e9):
+    """ Torch version of maximum_path_gradtts, which runs on the device value is on.
+    value: [b, t_x, t_y]
+    mask: [b, t_x, t_y]
+
+    Every cell of a frame depends only on the previous frame, so the search sweeps
+    the frames one at a time, each one vectorized over tokens and batch. The
+    arithmetic matches the Cython version, so the paths are identical.
+    """
+    b, t_x, t_y = value.shape
+    dtype = value.dtype
+    value = (value * mask).detach().float()
+    t_xs = mask[:, :, 0].sum(1).long()
+    t_ys = mask[:, 0, :].sum(1).long()
+    x = torch.arange(t_x, device=value.device)
+    # NOTE: cells out of a path's reach are never read, so only the diagonal, which
+    # the previous frame cannot reach, needs masking.
+    values = torch.empty_like(value)
+    column = torch.full_like(value[:, :, 0], max_neg_val)
+    for y in range(t_y):
+        if y < t_x:
+            column[:, y] = max_neg_val
+        v_prev = torch.nn.functional.pad(
+            column[:, :-1], (1, 0), value=0.0 if y == 0 else max_neg_val
+        )
+        column = torch.maximum(column, v_prev) + value[:, :, y]
+        values[:, :, y] = column
+
+    # Step down a token where the Cython version would: on the diagonal, or where
+    # the previous frame scored higher one token down.
+    down = torch.zeros_like(value, dtype=torch.bool)
+    down[:, 1:, 1:] = (x[1:, None] == torch.arange(1, t_y, device=value.device)) | (
+        values[:, 1:, :-1] < values[:, :-1, :-1]
+    )
+    batch = torch.arange(b, device=value.device)
+    index = t_xs - 1
+    tokens = torch.zeros(b, t_y, dtype=torch.long, device=value.device)
+    for y in range(t_y - 1, -1, -1):
+        tokens[:, y] = index
+        index = index - (down[batch, index, y] & (y < t_ys)).long()
+    path = torch.zeros_like(value, dtype=dtype)
+    return path.scatter_(1, tokens[:, None], mask[:, :1].to(dtype))
+
+
+def maximum_path_torch(neg_cent, mask, max_neg_val=-1e9):
+  """ Torch version of maximum_path, which runs on the device neg_cent is on.
+  neg_cent: [b, t_t, t_s]
+  mask: [b, t_t, t_s]
+  """
+  return maximum_path_gradtts_torch(
+    neg_cent.transpose(1, 2), mask.transpose(1, 2), max_neg_val
+  ).transpose(1, 2)
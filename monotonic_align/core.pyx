@@ -64,17 +64,71 @@ cdef void maximum_path_each_gradtts(int[:,::1] path, float[:,::1] value, int t_x
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cpdef void maximum_path_c(int[:,:,::1] paths, float[:,:,::1] values, int[::1] t_ys, int[::1] t_xs) nogil:
+cpdef void maximum_path_c(int[:,:,::1] paths, float[:,:,::1] values, int[::1] t_ys, int[::1] t_xs, int num_threads=1) nogil:
   cdef int b = paths.shape[0]
+  cdef int n_threads = num_threads
   cdef int i
-  for i in prange(b, nogil=True):
+  # NOTE: items differ in length, so hand them out to threads one at a time.
+  for i in prange(b, nogil=True, num_threads=n_threads, schedule="dynamic", chunksize=1):
     maximum_path_each(paths[i], values[i], t_ys[i], t_xs[i])
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cpdef void maximum_path_gradtts_c(int[:,:,::1] paths, float[:,:,::1] values, int[::1] t_xs, int[::1] t_ys, float max_neg_val=-1e9) nogil:
+cpdef void maximum_path_gradtts_c(int[:,:,::1] paths, float[:,:,::1] values, int[::1] t_xs, int[::1] t_ys, float max_neg_val=-1e9, int num_threads=1) nogil:
     cdef int b = values.shape[0]
+    cdef int n_threads = num_threads
 
     cdef int i
-    for i in prange(b, nogil=True):
+    for i in prange(b, nogil=True, num_threads=n_threads, schedule="dynamic", chunksize=1):
         maximum_path_each_gradtts(paths[i], values[i], t_xs[i], t_ys[i], max_neg_val)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef int maximum_path_each_banded(int[::1] tokens, float[:,::1] value, int[::1] start, int[::1] lo, int[::1] hi, int t_x, int t_y, float max_neg_val) nogil:
+    # value[k, y] is the score of token start[y] + k for frame y, and only tokens
+    # lo[y] <= x < hi[y] are searched. Writes the token of each frame to tokens and
+    # returns 1, or returns 0 if no monotonic path fits in the band.
+    cdef int x
+    cdef int y
+    cdef float v_prev
+    cdef float v_cur
+    cdef int index = t_x - 1
+
+    for y in range(t_y):
+        for x in range(lo[y], hi[y]):
+            if y > 0 and lo[y-1] <= x < hi[y-1]:
+                v_cur = value[x - start[y-1], y-1]
+            else:
+                v_cur = max_neg_val
+            if x == 0:
+                if y == 0:
+                    v_prev = 0.
+                else:
+                    v_prev = max_neg_val
+            elif y > 0 and lo[y-1] <= x-1 < hi[y-1]:
+                v_prev = value[x-1 - start[y-1], y-1]
+            else:
+                v_prev = max_neg_val
+            value[x - start[y], y] = max(v_cur, v_prev) + value[x - start[y], y]
+
+    if not (lo[t_y-1] <= index < hi[t_y-1]) or value[index - start[t_y-1], t_y-1] < max_neg_val / 2:
+        return 0
+
+    for y in range(t_y - 1, -1, -1):
+        tokens[y] = index
+        if index != 0 and (
+            not (lo[y-1] <= index < hi[y-1])
+            or (lo[y-1] <= index-1 and value[index - start[y-1], y-1] < value[index-1 - start[y-1], y-1])
+        ):
+            index = index - 1
+    return 1
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef void maximum_path_banded_c(int[:,::1] tokens, float[:,:,::1] values, int[:,::1] starts, int[:,::1] los, int[:,::1] his, int[::1] t_xs, int[::1] t_ys, int[::1] feasible, float max_neg_val=-1e9, int num_threads=1) nogil:
+    cdef int b = values.shape[0]
+    cdef int n_threads = num_threads
+
+    cdef int i
+    for i in prange(b, nogil=True, num_threads=n_threads, schedule="dynamic", chunksize=1):
+        feasible[i] = maximum_path_each_banded(tokens[i], values[i], starts[i], los[i], his[i], t_xs[i], t_ys[i], max_neg_val)
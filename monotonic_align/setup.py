@@ -1,9 +1,22 @@
+import sys
 from distutils.core import setup
+from distutils.extension import Extension
 from Cython.Build import cythonize
 import numpy
 
+# NOTE: OpenMP runs the items of a batch in parallel. Apple clang has no -fopenmp,
+# so macOS builds solve them one after another.
+openmp = [] if sys.platform == "darwin" else ["-fopenmp"]
+
 setup(
   name = 'monotonic_align',
-  ext_modules = cythonize("core.pyx"),
+  ext_modules = cythonize([
+    Extension(
+      "monotonic_align.core",
+      ["core.pyx"],
+      extra_compile_args=openmp,
+      extra_link_args=openmp,
+    )
+  ]),
   include_dirs=[numpy.get_include()]
 )
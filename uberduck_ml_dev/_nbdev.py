@@ -20,9 +20,29 @@ index = {"ensure_speaker_table": "data.cache.ipynb",
          "TextMelCollate": "data_loader.ipynb",
          "TextAudioSpeakerLoader": "data_loader.ipynb",
          "TextAudioSpeakerCollate": "data_loader.ipynb",
+         "load_spectrogram": "data_loader.ipynb",
+         "load_cached_spectrogram": "data_loader.ipynb",
+         "load_spectrogram_segment": "data_loader.ipynb",
+         "VoiceConversionLoader": "data_loader.ipynb",
+         "VoiceConversionCollate": "data_loader.ipynb",
          "DistributedBucketSampler": "data_loader.ipynb",
+         "DynamicBatchSampler": "data_loader.ipynb",
          "tts": "e2e.ipynb",
          "rhythm_transfer": "e2e.ipynb",
+         "SyntheticMelDataset": "exec.benchmark_distributed.ipynb",
+         "benchmark": "exec.benchmark_distributed.ipynb",
+         "synthetic_batch": "exec.benchmark_gradtts.ipynb",
+         "benchmark_precision": "exec.benchmark_gradtts.ipynb",
+         "benchmark_solvers": "exec.benchmark_gradtts.ipynb",
+         "benchmark_estimator": "exec.benchmark_gradtts.ipynb",
+         "build_encoder": "exec.benchmark_encoders.ipynb",
+         "benchmark_encoders": "exec.benchmark_encoders.ipynb",
+         "synthetic_scores": "exec.benchmark_mas.ipynb",
+         "benchmark_banded": "exec.benchmark_mas.ipynb",
+         "length_sorted_batches": "exec.convert_vits.ipynb",
+         "load_generator": "exec.convert_vits.ipynb",
+         "output_path": "exec.convert_vits.ipynb",
+         "convert": "exec.convert_vits.ipynb",
          "get_summary_statistics": "exec.dataset_statistics.ipynb",
          "calculate_statistics": "exec.dataset_statistics.ipynb",
          "generate_markdown": "exec.dataset_statistics.ipynb",
@@ -65,6 +85,7 @@ index = {"ensure_speaker_table": "data.cache.ipynb",
          "Upsample": "models.gradtts.ipynb",
          "Downsample": "models.gradtts.ipynb",
          "Rezero": "models.gradtts.ipynb",
+         "masked_group_norm": "models.gradtts.ipynb",
          "Block": "models.gradtts.ipynb",
          "ResnetBlock": "models.gradtts.ipynb",
          "LinearAttention": "models.gradtts.ipynb",
@@ -72,6 +93,7 @@ index = {"ensure_speaker_table": "data.cache.ipynb",
          "SinusoidalPosEmb": "models.gradtts.ipynb",
          "GradLogPEstimator2d": "models.gradtts.ipynb",
          "get_noise": "models.gradtts.ipynb",
+         "DiffusionODESolver": "models.gradtts.ipynb",
          "Diffusion": "models.gradtts.ipynb",
          "sequence_mask": "utils.utils.ipynb",
          "fix_len_compatibility": "models.gradtts.ipynb",
@@ -263,7 +285,12 @@ index = {"ensure_speaker_table": "data.cache.ipynb",
          "text_to_sequence_for_editts": "text.util.ipynb",
          "random_utterance": "text.util.ipynb",
          "utterances": "text.util.ipynb",
+         "StepTimer": "trainer.base.ipynb",
+         "AsyncLogger": "trainer.base.ipynb",
+         "MetricAccumulator": "trainer.base.ipynb",
+         "CheckpointWriter": "trainer.base.ipynb",
          "TTSTrainer": "trainer.base.ipynb",
+         "launch": "trainer.base.ipynb",
          "GradTTSTrainer": "trainer.gradtts.ipynb",
          "MellotronTrainer": "trainer.mellotron.ipynb",
          "Tacotron2Loss": "trainer.tacotron2.ipynb",
@@ -286,6 +313,7 @@ index = {"ensure_speaker_table": "data.cache.ipynb",
          "trim_audio": "utils.audio.ipynb",
          "MAX_WAV_INT16": "utils.audio.ipynb",
          "load_wav_to_torch": "utils.audio.ipynb",
+         "load_wav_segment_to_torch": "utils.audio.ipynb",
          "overlay_mono": "utils.audio.ipynb",
          "overlay_stereo": "utils.audio.ipynb",
          "mono_to_stereo": "utils.audio.ipynb",
@@ -330,6 +358,11 @@ modules = ["data/cache.py",
            "data/statistics.py",
            "data_loader.py",
            "e2e.py",
+           "exec/benchmark_distributed.py",
+           "exec/benchmark_encoders.py",
+           "exec/benchmark_gradtts.py",
+           "exec/benchmark_mas.py",
+           "exec/convert_vits.py",
            "exec/dataset_statistics.py",
            "exec/gather_dataset.py",
            "exec/generate_filelist.py",
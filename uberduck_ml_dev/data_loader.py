@@ -1,9 +1,12 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/data_loader.ipynb (unless otherwise specified).
 
 __all__ = ['pad_sequences', 'prepare_input_sequence', 'oversample', 'TextMelDataset', 'TextMelCollate',
-           'TextAudioSpeakerLoader', 'TextAudioSpeakerCollate', 'DistributedBucketSampler']
+           'load_spectrogram', 'load_cached_spectrogram', 'load_spectrogram_segment', 'TextAudioSpeakerLoader',
+           'TextAudioSpeakerCollate', 'VoiceConversionLoader', 'VoiceConversionCollate', 'DistributedBucketSampler',
+           'DynamicBatchSampler']
 
 # Cell
+from itertools import islice
 import os
 import random
 import re
@@ -13,7 +16,7 @@ from typing import List
 import numpy as np
 from scipy.io.wavfile import read
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 from torch.utils.data.distributed import DistributedSampler
 
 from .models.common import STFT, MelSTFT
@@ -24,7 +27,7 @@ from .text.symbols import (
     GRAD_TTS_SYMBOLS,
 )
 from .text.util import cleaned_text_to_sequence, text_to_sequence
-from .utils.audio import compute_yin, load_wav_to_torch
+from .utils.audio import compute_yin, load_wav_to_torch, load_wav_segment_to_torch
 from .utils.utils import (
     load_filepaths_and_text,
     intersperse,
@@ -122,6 +125,7 @@ class TextMelDataset(Dataset):
         intersperse_text: bool = False,
         intersperse_token: int = 0,
         compute_gst=None,
+        cache_mels: bool = False,
     ):
         super().__init__()
         path = audiopaths_and_text
@@ -161,6 +165,7 @@ class TextMelDataset(Dataset):
         self.intersperse_text = intersperse_text
         self.intersperse_token = intersperse_token
         self.compute_gst = compute_gst
+        self.cache_mels = cache_mels
 
     def _get_f0(self, audio):
         f0, harmonic_rates, argmins, times = compute_yin(
@@ -183,7 +188,6 @@ class TextMelDataset(Dataset):
     def _get_data(self, audiopath_and_text):
         path, transcription, speaker_id = audiopath_and_text
         speaker_id = self._speaker_id_map[speaker_id]
-        sampling_rate, wav_data = read(path)
         text_sequence = torch.LongTensor(
             text_to_sequence(
                 transcription,
@@ -197,11 +201,22 @@ class TextMelDataset(Dataset):
                 intersperse(text_sequence.numpy(), self.intersperse_token)
             )  # add a blank token, whose id number is len(symbols)
 
-        audio = torch.FloatTensor(wav_data)
-        audio_norm = audio / self.max_wav_value
-        audio_norm = audio_norm.unsqueeze(0)
-        melspec = self.stft.mel_spectrogram(audio_norm)
-        melspec = torch.squeeze(melspec, 0)
+        # NOTE: with cache_mels, mels are cached next to the wavs as
+        # <name>.uberduck.mel.pt, so that the wav is only read again for f0.
+        mel_filename = path.replace(".wav", ".uberduck.mel.pt")
+        cached = self.cache_mels and os.path.exists(mel_filename)
+        if not cached or self.include_f0:
+            sampling_rate, wav_data = read(path)
+            audio = torch.FloatTensor(wav_data)
+        if cached:
+            melspec = torch.load(mel_filename)
+        else:
+            audio_norm = audio / self.max_wav_value
+            audio_norm = audio_norm.unsqueeze(0)
+            melspec = self.stft.mel_spectrogram(audio_norm)
+            melspec = torch.squeeze(melspec, 0)
+            if self.cache_mels:
+                torch.save(melspec, mel_filename)
         data = {
             "text_sequence": text_sequence,
             "mel": melspec,
@@ -237,6 +252,15 @@ class TextMelDataset(Dataset):
             return min(self.debug_dataset_size, len(self.audiopaths_and_text))
         return len(self.audiopaths_and_text)
 
+    @property
+    def lengths(self):
+        """Approximate mel lengths, in frames, estimated from the size of each (16 bit)
+        wav file so that no audio has to be read, e.g. for DistributedBucketSampler."""
+        return [
+            os.path.getsize(path) // (2 * self.hop_length)
+            for path, _, _ in self.audiopaths_and_text[: len(self)]
+        ]
+
     def sample_test_batch(self, size):
         idx = np.random.choice(range(len(self)), size=size, replace=False)
         test_batch = []
@@ -249,9 +273,16 @@ class TextMelDataset(Dataset):
 
 class TextMelCollate:
     def __init__(self, n_frames_per_step: int = 1, include_f0: bool = False):
-        self.n_frames_per_step = n_frames_per_step
+        # NOTE: n_frames_per_step is kept in shared memory so that
+        # set_frames_per_step also reaches the copies of this object held by
+        # (persistent) DataLoader worker processes.
+        self._n_frames_per_step = torch.LongTensor([n_frames_per_step]).share_memory_()
         self.include_f0 = include_f0
 
+    @property
+    def n_frames_per_step(self):
+        return int(self._n_frames_per_step[0])
+
     def set_frames_per_step(self, n_frames_per_step):
         """Set n_frames_step.
 
@@ -261,7 +292,7 @@ class TextMelCollate:
         reference:
         https://erogol.com/gradual-training-with-tacotron-for-faster-convergence/
         """
-        self.n_frames_per_step = n_frames_per_step
+        self._n_frames_per_step[0] = n_frames_per_step
 
     def __call__(self, batch):
         """Collate's training batch from normalized text and mel-spectrogram
@@ -284,13 +315,12 @@ class TextMelCollate:
             text_padded[i, : text.size(0)] = text
 
         # Right zero-pad mel-spec
+        n_frames_per_step = self.n_frames_per_step
         num_mels = batch[0]["mel"].size(0)
         max_target_len = max([x["mel"].size(1) for x in batch])
-        if max_target_len % self.n_frames_per_step != 0:
-            max_target_len += (
-                self.n_frames_per_step - max_target_len % self.n_frames_per_step
-            )
-            assert max_target_len % self.n_frames_per_step == 0
+        if max_target_len % n_frames_per_step != 0:
+            max_target_len += n_frames_per_step - max_target_len % n_frames_per_step
+            assert max_target_len % n_frames_per_step == 0
 
         # include mel padded, gate padded and speaker ids
         mel_padded = torch.FloatTensor(len(batch), num_mels, max_target_len)
@@ -331,15 +361,81 @@ class TextMelCollate:
 # Cell
 
 
+def load_spectrogram(filename, stft, sampling_rate, max_wav_value):
+    """Load a wav file and its linear spectrogram, which is cached next to it as
+    <name>.uberduck.spec.pt."""
+    audio, file_sampling_rate = load_wav_to_torch(filename)
+    if file_sampling_rate != sampling_rate:
+        raise ValueError(
+            "{} {} SR doesn't match target {} SR".format(
+                filename, file_sampling_rate, sampling_rate
+            )
+        )
+
+    audio_norm = audio / max_wav_value
+    audio_norm = audio_norm.unsqueeze(0)
+    spec_filename = filename.replace(".wav", ".uberduck.spec.pt")
+    if os.path.exists(spec_filename):
+        spec = torch.load(spec_filename)
+    else:
+        spec = stft.spectrogram(audio_norm)
+        spec = torch.squeeze(spec, 0)
+        torch.save(spec, spec_filename)
+    return spec, audio_norm
+
+
+def load_cached_spectrogram(filename, stft, sampling_rate, max_wav_value):
+    """Load the cached spectrogram of a wav file, reading the wav only when it has
+    to be computed."""
+    spec_filename = filename.replace(".wav", ".uberduck.spec.pt")
+    if os.path.exists(spec_filename):
+        return torch.load(spec_filename)
+    spec, _ = load_spectrogram(filename, stft, sampling_rate, max_wav_value)
+    return spec
+
+
+def load_spectrogram_segment(
+    filename, stft, sampling_rate, max_wav_value, segment_size, hop_length
+):
+    """Load the cached spectrogram of a wav file, but only a random segment_size
+    samples of its audio, starting on a spectrogram frame. Returns the spectrogram,
+    the audio segment and the index of the frame it starts on.
+
+    The segment is chosen from the length of the spectrogram, so only that part of
+    the wav is read from disk. Files without a cached spectrogram are read in full
+    once, to compute it.
+    """
+    spec = load_cached_spectrogram(filename, stft, sampling_rate, max_wav_value)
+    ids_slice = random.randint(0, max(spec.size(1) - segment_size // hop_length, 0))
+    audio, file_sampling_rate = load_wav_segment_to_torch(
+        filename, ids_slice * hop_length, segment_size
+    )
+    if file_sampling_rate != sampling_rate:
+        raise ValueError(
+            "{} {} SR doesn't match target {} SR".format(
+                filename, file_sampling_rate, sampling_rate
+            )
+        )
+    return spec, (audio / max_wav_value).unsqueeze(0), ids_slice
+
+
 class TextAudioSpeakerLoader(Dataset):
     """
     1) loads audio, speaker_id, text pairs
     2) normalizes text and converts them to sequences of integers
     3) computes spectrograms from audio files.
+
+    With segment_size, only a random segment_size samples of each wav are read,
+    and the index of the spectrogram frame they start on is returned too.
     """
 
     def __init__(
-        self, audiopaths_sid_text, hparams, debug=False, debug_dataset_size=None
+        self,
+        audiopaths_sid_text,
+        hparams,
+        debug=False,
+        debug_dataset_size=None,
+        segment_size=None,
     ):
         oversample_weights = hparams.oversample_weights or {}
         self.audiopaths_sid_text = oversample(
@@ -352,6 +448,7 @@ class TextAudioSpeakerLoader(Dataset):
         self.hop_length = hparams.hop_length
         self.win_length = hparams.win_length
         self.sampling_rate = hparams.sampling_rate
+        self.segment_size = segment_size
 
         self.debug = debug
         self.debug_dataset_size = debug_dataset_size
@@ -404,29 +501,27 @@ class TextAudioSpeakerLoader(Dataset):
             audiopath_sid_text[2],
         )
         text = self.get_text(text)
-        spec, wav = self.get_audio(audiopath)
         sid = self.get_sid(sid)
+        if self.segment_size:
+            spec, wav, ids_slice = self.get_audio_segment(audiopath)
+            return (text, spec, wav, sid, ids_slice)
+        spec, wav = self.get_audio(audiopath)
         return (text, spec, wav, sid)
 
     def get_audio(self, filename):
-        audio, sampling_rate = load_wav_to_torch(filename)
-        if sampling_rate != self.sampling_rate:
-            raise ValueError(
-                "{} {} SR doesn't match target {} SR".format(
-                    sampling_rate, self.sampling_rate
-                )
-            )
+        return load_spectrogram(
+            filename, self.stft, self.sampling_rate, self.max_wav_value
+        )
 
-        audio_norm = audio / self.max_wav_value
-        audio_norm = audio_norm.unsqueeze(0)
-        spec_filename = filename.replace(".wav", ".uberduck.spec.pt")
-        if os.path.exists(spec_filename):
-            spec = torch.load(spec_filename)
-        else:
-            spec = self.stft.spectrogram(audio_norm)
-            spec = torch.squeeze(spec, 0)
-            torch.save(spec, spec_filename)
-        return spec, audio_norm
+    def get_audio_segment(self, filename):
+        return load_spectrogram_segment(
+            filename,
+            self.stft,
+            self.sampling_rate,
+            self.max_wav_value,
+            self.segment_size,
+            self.hop_length,
+        )
 
     def get_text(self, text):
         if self.cleaned_text:
@@ -466,7 +561,8 @@ class TextAudioSpeakerCollate:
         """Collate's training batch from normalized text, audio and speaker identities
         PARAMS
         ------
-        batch: [text_normalized, spec_normalized, wav_normalized, sid]
+        batch: [text_normalized, spec_normalized, wav_normalized, sid], with the
+        frame each wav segment starts on last if the loader reads segments.
         """
         # Right zero-pad all one-hot text sequences to max input length
         _, ids_sorted_decreasing = torch.sort(
@@ -481,6 +577,7 @@ class TextAudioSpeakerCollate:
         spec_lengths = torch.LongTensor(len(batch))
         wav_lengths = torch.LongTensor(len(batch))
         sid = torch.LongTensor(len(batch))
+        ids_slice = torch.LongTensor(len(batch))
 
         text_padded = torch.LongTensor(len(batch), max_text_len)
         spec_padded = torch.FloatTensor(len(batch), batch[0][1].size(0), max_spec_len)
@@ -504,19 +601,10 @@ class TextAudioSpeakerCollate:
             wav_lengths[i] = wav.size(1)
 
             sid[i] = row[3]
+            if len(row) > 4:
+                ids_slice[i] = row[4]
 
-        if self.return_ids:
-            return (
-                text_padded,
-                text_lengths,
-                spec_padded,
-                spec_lengths,
-                wav_padded,
-                wav_lengths,
-                sid,
-                ids_sorted_decreasing,
-            )
-        return (
+        ret = (
             text_padded,
             text_lengths,
             spec_padded,
@@ -525,6 +613,74 @@ class TextAudioSpeakerCollate:
             wav_lengths,
             sid,
         )
+        if len(batch[0]) > 4:
+            ret += (ids_slice,)
+        if self.return_ids:
+            ret += (ids_sorted_decreasing,)
+        return ret
+
+# Cell
+
+
+class VoiceConversionLoader(Dataset):
+    """
+    1) loads audio, source speaker id, target speaker id rows
+    2) computes spectrograms from audio files, through the same cache as
+    TextAudioSpeakerLoader.
+    """
+
+    def __init__(self, audiopaths_sids, hparams):
+        self.audiopaths_sids = load_filepaths_and_text(audiopaths_sids)
+        self.max_wav_value = hparams.max_wav_value
+        self.sampling_rate = hparams.sampling_rate
+        self.hop_length = hparams.hop_length
+        self.stft = MelSTFT(
+            filter_length=hparams.filter_length,
+            hop_length=hparams.hop_length,
+            win_length=hparams.win_length,
+            n_mel_channels=hparams.n_mel_channels,
+            sampling_rate=hparams.sampling_rate,
+            mel_fmin=hparams.mel_fmin,
+            mel_fmax=hparams.mel_fmax,
+            padding=(hparams.filter_length - hparams.hop_length) // 2,
+        )
+        # NOTE: spectrogram lengths estimated from file sizes, for bucketing.
+        self.lengths = [
+            os.path.getsize(row[0]) // (2 * self.hop_length)
+            for row in self.audiopaths_sids
+        ]
+
+    def __getitem__(self, index):
+        audiopath, sid_src, sid_tgt = self.audiopaths_sids[index][:3]
+        spec = load_cached_spectrogram(
+            audiopath, self.stft, self.sampling_rate, self.max_wav_value
+        )
+        return spec, int(sid_src), int(sid_tgt), index
+
+    def __len__(self):
+        return len(self.audiopaths_sids)
+
+# Cell
+
+
+class VoiceConversionCollate:
+    """Zero-pads spectrograms for voice conversion"""
+
+    def __call__(self, batch):
+        """Collate's batch from VoiceConversionLoader
+        PARAMS
+        ------
+        batch: [spec_normalized, sid_src, sid_tgt, index]
+        """
+        max_spec_len = max([x[0].size(1) for x in batch])
+        spec_padded = torch.zeros(len(batch), batch[0][0].size(0), max_spec_len)
+        spec_lengths = torch.LongTensor([x[0].size(1) for x in batch])
+        for i, row in enumerate(batch):
+            spec_padded[i, :, : row[0].size(1)] = row[0]
+        sid_src = torch.LongTensor([x[1] for x in batch])
+        sid_tgt = torch.LongTensor([x[2] for x in batch])
+        indices = torch.LongTensor([x[3] for x in batch])
+        return spec_padded, spec_lengths, sid_src, sid_tgt, indices
 
 # Cell
 
@@ -556,6 +712,13 @@ class DistributedBucketSampler(DistributedSampler):
         self.buckets, self.num_samples_per_bucket = self._create_buckets()
         self.total_size = sum(self.num_samples_per_bucket)
         self.num_samples = self.total_size // self.num_replicas
+        self.start_batch = 0
+
+    def fast_forward(self, num_samples):
+        """Skip the first num_samples samples (of this rank) in the next iteration,
+        e.g. to resume an epoch where a checkpoint left off."""
+        assert num_samples % self.batch_size == 0
+        self.start_batch = num_samples // self.batch_size
 
     def _create_buckets(self):
         buckets = [[] for _ in range(len(self.boundaries) - 1)]
@@ -627,7 +790,8 @@ class DistributedBucketSampler(DistributedSampler):
         self.batches = batches
 
         assert len(self.batches) * self.batch_size == self.num_samples
-        return iter(self.batches)
+        start_batch, self.start_batch = self.start_batch, 0
+        return iter(self.batches[start_batch:])
 
     def _bisect(self, x, lo=0, hi=None):
         if hi is None:
@@ -645,4 +809,58 @@ class DistributedBucketSampler(DistributedSampler):
             return -1
 
     def __len__(self):
-        return self.num_samples // self.batch_size
\ No newline at end of file
+        return self.num_samples // self.batch_size
+
+# Cell
+
+
+class DynamicBatchSampler(Sampler):
+    """Group the indices of `sampler` into batches of a changeable size.
+
+    Unlike `torch.utils.data.BatchSampler`, the batch size is read every time a
+    batch is formed, so it can be changed with `set_batch_size` (e.g. by a
+    reduction window schedule) without rebuilding the DataLoader, its sampler
+    or its datasets. The change takes effect from the next batch drawn.
+
+    If `sampler` has a `set_epoch` method or a `generator`, `set_epoch` makes its
+    order a function of the epoch, so that `fast_forward` can resume an epoch
+    part way through.
+    """
+
+    def __init__(self, sampler, batch_size, drop_last=False):
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        generator = getattr(sampler, "generator", None)
+        self.seed = None if generator is None else generator.initial_seed()
+        self.start_sample = 0
+
+    def set_batch_size(self, batch_size):
+        self.batch_size = batch_size
+
+    def set_epoch(self, epoch):
+        if hasattr(self.sampler, "set_epoch"):
+            self.sampler.set_epoch(epoch)
+        elif self.seed is not None:
+            self.sampler.generator.manual_seed(self.seed + epoch)
+
+    def fast_forward(self, num_samples):
+        """Skip the first num_samples indices of the next iteration. Only indices
+        are drawn for them, no data is loaded."""
+        self.start_sample = num_samples
+
+    def __iter__(self):
+        batch = []
+        start_sample, self.start_sample = self.start_sample, 0
+        for idx in islice(self.sampler, start_sample, None):
+            batch.append(idx)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch and not self.drop_last:
+            yield batch
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.sampler) // self.batch_size
+        return (len(self.sampler) + self.batch_size - 1) // self.batch_size
\ No newline at end of file
@@ -39,15 +39,7 @@ def tts(
         speaker_ids = torch.zeros(len(lines), dtype=torch.long, device=device)
     input_ = sequences, input_lengths, speaker_ids
     _, mel_outputs_postnet, gate_outputs, alignment, lengths = model.inference(input_)
-    mels = mel_outputs_postnet
-    mel = mels[0, :, : lengths[0].item()]
-    for idx in range(1, mels.size(0)):
-        length = lengths[idx].item()
-        mel = torch.cat((mel, mels[idx, :, :length]), dim=-1)
-    tensor_cls = torch.FloatTensor if device == "cpu" else torch.cuda.FloatTensor
-    mel = mel[None, :]
-    y_g_hat = vocoder(tensor_cls(mel).to(device=device))
-    audio = y_g_hat.reshape(1, -1)
+    audio = torch.cat(vocoder(mel_outputs_postnet, lengths), dim=-1)[None]
     audio = audio * max_wav_value
     return audio
 
@@ -95,7 +87,6 @@ def rhythm_transfer(
     _, mel_postnet, _, _ = model.inference_noattention(
         (sequence, input_lengths, speaker_ids, attn.transpose(0, 1))
     )
-    y_g_hat = vocoder(torch.tensor(mel_postnet, dtype=torch.float, device=device))
-    audio = y_g_hat.reshape(1, -1)
+    audio = vocoder(mel_postnet.float()).reshape(1, -1)
     audio = audio * max_wav_value
     return audio
\ No newline at end of file
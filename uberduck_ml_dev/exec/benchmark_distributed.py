@@ -0,0 +1,167 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: nbs/exec.benchmark_distributed.ipynb (unless otherwise specified).
+
+__all__ = ['SyntheticMelDataset', 'parse_args', 'run', 'benchmark']
+
+# Cell
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import torch
+from torch import multiprocessing as mp
+from torch import nn
+import torch.distributed as dist
+from torch.utils.data import Dataset
+from torch.utils.data.distributed import DistributedSampler
+
+from ..trainer.base import TTSTrainer, DEFAULTS
+from ..vendor.tfcompat.hparam import HParams
+
+
+class SyntheticMelDataset(Dataset):
+    """Random mel spectrograms, generated from their index, so the benchmark
+    measures training rather than reading and processing audio."""
+
+    def __init__(self, size, n_mel_channels=80, n_frames=400):
+        self.size = size
+        self.n_mel_channels = n_mel_channels
+        self.n_frames = n_frames
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        generator = torch.Generator().manual_seed(idx)
+        return torch.randn(self.n_mel_channels, self.n_frames, generator=generator)
+
+# Cell
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--processes",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="Numbers of processes to benchmark",
+    )
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup_steps", type=int, default=3)
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="Torch threads per process. Defaults to splitting the cores between processes.",
+    )
+    parser.add_argument("--dist_backend", default="gloo")
+    return parser.parse_args(args)
+
+
+def run(rank, world_size, hparams):
+    """Train a small convolutional model on SyntheticMelDataset in one process of
+    a distributed run, and write rank 0's measurements to hparams.result_path."""
+    trainer = TTSTrainer(hparams, rank=rank, world_size=world_size, device="cpu")
+    trainer.init_distributed()
+    model = trainer.wrap_ddp(
+        nn.Sequential(
+            nn.Conv1d(hparams.n_mel_channels, 256, 5, padding=2),
+            nn.ReLU(),
+            nn.Conv1d(256, 256, 5, padding=2),
+            nn.ReLU(),
+            nn.Conv1d(256, hparams.n_mel_channels, 5, padding=2),
+        )
+    )
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    n_steps = hparams.warmup_steps + hparams.steps
+    dataset = SyntheticMelDataset(
+        n_steps * hparams.batch_size * world_size, hparams.n_mel_channels
+    )
+    loader = trainer.build_loader(
+        dataset,
+        batch_size=hparams.batch_size,
+        sampler=DistributedSampler(dataset, num_replicas=world_size, rank=rank),
+    )
+    for step, mel in enumerate(loader):
+        if step == hparams.warmup_steps:
+            start = time.perf_counter()
+        loss = nn.functional.l1_loss(model(mel), mel)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+    elapsed = torch.tensor(time.perf_counter() - start)
+    dist.all_reduce(elapsed, op=dist.ReduceOp.MAX)
+    if rank == 0:
+        utterances = hparams.steps * hparams.batch_size * world_size
+        with open(hparams.result_path, "w") as f:
+            json.dump(
+                dict(
+                    processes=world_size,
+                    threads_per_process=torch.get_num_threads(),
+                    seconds=elapsed.item(),
+                    utterances_per_second=utterances / elapsed.item(),
+                ),
+                f,
+            )
+    dist.destroy_process_group()
+    trainer.flush_logs()
+
+
+def benchmark(
+    processes=(1, 2, 4, 8),
+    batch_size=16,
+    steps=20,
+    warmup_steps=3,
+    num_threads=None,
+    dist_backend="gloo",
+):
+    """Measure CPU data-parallel training throughput at each number of processes.
+
+    Returns a list of dicts with the throughput at each number of processes and
+    the speedup over the first.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, world_size in enumerate(processes):
+            config = DEFAULTS.values()
+            config.update(
+                distributed_run=True,
+                dist_backend=dist_backend,
+                # NOTE: use a fresh port for each run.
+                dist_init_method=f"tcp://localhost:{54321 + i}",
+                num_threads=num_threads,
+                log_dir=os.path.join(tmp, f"logs_{world_size}"),
+                async_logging=False,
+                symbol_set="nvidia_taco2",
+                n_mel_channels=80,
+                batch_size=batch_size,
+                steps=steps,
+                warmup_steps=warmup_steps,
+                result_path=os.path.join(tmp, f"result_{world_size}.json"),
+            )
+            hparams = HParams(**config)
+            mp.spawn(run, (world_size, hparams), world_size)
+            with open(hparams.result_path) as f:
+                result = json.load(f)
+            result["speedup"] = (
+                result["utterances_per_second"]
+                / (results or [result])[0]["utterances_per_second"]
+            )
+            results.append(result)
+    return results
+
+# Cell
+try:
+    from nbdev.imports import IN_NOTEBOOK
+except:
+    IN_NOTEBOOK = False
+if __name__ == "__main__" and not IN_NOTEBOOK:
+    args = parse_args(sys.argv[1:])
+    print("processes | threads/process | utterances/s | speedup")
+    for result in benchmark(**vars(args)):
+        print(
+            f"{result['processes']:>9} | {result['threads_per_process']:>15} | "
+            f"{result['utterances_per_second']:>12.1f} | {result['speedup']:.2f}x"
+        )
\ No newline at end of file
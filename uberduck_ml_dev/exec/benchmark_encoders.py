@@ -0,0 +1,102 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: nbs/exec.benchmark_encoders.ipynb (unless otherwise specified).
+
+__all__ = ['parse_args', 'build_encoder', 'benchmark_encoders']
+
+# Cell
+import argparse
+import sys
+import time
+
+import torch
+
+from ..models.attentions import VITSEncoder
+from ..models.gradtts import Encoder as GradTTSEncoder
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[50, 100, 200, 400])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--train",
+        action="store_true",
+        help="Time forward and backward passes instead of inference.",
+    )
+    return parser.parse_args(args)
+
+# Cell
+def build_encoder(name, window_size=4):
+    """The text encoder transformer of VITS or GradTTS, at the size of their
+    DEFAULTS. window_size=None disables relative attention."""
+    if name == "vits":
+        return VITSEncoder(192, 768, 2, 6, 3, 0.1, window_size=window_size)
+    return GradTTSEncoder(192, 768, 2, 6, 3, 0.1, window_size=window_size)
+
+
+def benchmark_encoders(
+    device=None,
+    batch_size=16,
+    lengths=(50, 100, 200, 400),
+    repeats=5,
+    train=False,
+    encoders=(("vits", 4), ("gradtts", 4), ("vits", None)),
+):
+    """Measure the throughput of the VITS and GradTTS text encoders on random
+    batches of each of lengths, whose items are between half and all of it long.
+
+    encoders are (name, window_size) pairs, for build_encoder. Returns a list of
+    dicts with the tokens per second of each, the best of repeats.
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    results = []
+    for name, window_size in encoders:
+        torch.manual_seed(0)
+        encoder = build_encoder(name, window_size).to(device).train(train)
+        for length in lengths:
+            x = torch.randn(batch_size, 192, length, device=device)
+            x_lengths = torch.randint(length // 2, length + 1, (batch_size,))
+            x_mask = (torch.arange(length) < x_lengths[:, None]).unsqueeze(1)
+            x_mask = x_mask.to(device=device, dtype=x.dtype)
+
+            def step():
+                if train:
+                    encoder(x, x_mask).sum().backward()
+                else:
+                    with torch.no_grad():
+                        encoder(x, x_mask)
+
+            step()
+            times = []
+            for _ in range(repeats):
+                if device == "cuda":
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+                step()
+                if device == "cuda":
+                    torch.cuda.synchronize()
+                times.append(time.perf_counter() - start)
+            results.append(
+                dict(
+                    encoder=name,
+                    window_size=window_size,
+                    length=length,
+                    tokens_per_second=x_lengths.sum().item() / min(times),
+                )
+            )
+    return results
+
+# Cell
+try:
+    from nbdev.imports import IN_NOTEBOOK
+except:
+    IN_NOTEBOOK = False
+if __name__ == "__main__" and not IN_NOTEBOOK:
+    args = parse_args(sys.argv[1:])
+    print("encoder | window | length | tokens/s")
+    for result in benchmark_encoders(**vars(args)):
+        print(
+            f"{result['encoder']:>7} | {str(result['window_size']):>6} | "
+            f"{result['length']:>6} | {result['tokens_per_second']:>10.0f}"
+        )
\ No newline at end of file
@@ -0,0 +1,305 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: nbs/exec.benchmark_gradtts.ipynb (unless otherwise specified).
+
+__all__ = ['synthetic_batch', 'parse_args', 'benchmark_precision', 'benchmark_solvers',
+           'benchmark_estimator']
+
+# Cell
+import argparse
+import sys
+import tempfile
+import time
+
+import torch
+from torch.cuda.amp import GradScaler
+
+from ..models.gradtts import GradTTS, DEFAULTS as GRADTTS_DEFAULTS
+from ..text.symbols import SYMBOL_SETS
+from ..trainer.gradtts import GradTTSTrainer
+from ..vendor.tfcompat.hparam import HParams
+
+
+def synthetic_batch(hparams, batch_size, n_tokens, n_frames, seed=0):
+    """A random batch of token ids and mel spectrograms, with lengths spread
+    between half and all of n_tokens and n_frames."""
+    generator = torch.Generator().manual_seed(seed)
+    n_vocab = len(SYMBOL_SETS[hparams.symbol_set])
+    x = torch.randint(0, n_vocab, (batch_size, n_tokens), generator=generator)
+    x_lengths = torch.randint(
+        n_tokens // 2, n_tokens + 1, (batch_size,), generator=generator
+    )
+    x_lengths[0] = n_tokens
+    y = torch.randn(batch_size, hparams.n_feats, n_frames, generator=generator)
+    y_lengths = torch.randint(
+        n_frames // 2, n_frames + 1, (batch_size,), generator=generator
+    )
+    y_lengths[0] = n_frames
+    # NOTE: MAS needs at least one frame per token.
+    y_lengths = torch.maximum(y_lengths, x_lengths)
+    return x, x_lengths, y, y_lengths
+
+# Cell
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--precisions",
+        nargs="+",
+        default=None,
+        help="Any of fp32, bf16 and fp16 (CUDA only). Defaults to all that the device supports.",
+    )
+    parser.add_argument("--device", default=None)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--warmup_steps", type=int, default=2)
+    parser.add_argument("--n_tokens", type=int, default=100)
+    parser.add_argument("--n_frames", type=int, default=400)
+    parser.add_argument(
+        "--solvers",
+        action="store_true",
+        help="Report the quality and speed of the reverse diffusion solvers instead.",
+    )
+    parser.add_argument(
+        "--checkpoint", default=None, help="GradTTS state dict for --solvers"
+    )
+    parser.add_argument(
+        "--estimator",
+        action="store_true",
+        help="Time reverse diffusion steps with and without cached conditioning instead.",
+    )
+    return parser.parse_args(args)
+
+
+def benchmark_precision(
+    precisions=None,
+    device=None,
+    batch_size=16,
+    steps=10,
+    warmup_steps=2,
+    n_tokens=100,
+    n_frames=400,
+    **hparams,
+):
+    """Measure GradTTS training throughput in each of fp32, bf16 and fp16.
+
+    Each precision trains the same model, from the same initialization, on the
+    same synthetic batch. hparams override the GradTTS DEFAULTS. Returns a list of
+    dicts with the throughput of each precision and the speedup over the first.
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    if precisions is None:
+        precisions = ["fp32", "bf16"] + (["fp16"] if device == "cuda" else [])
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for precision in precisions:
+            config = GRADTTS_DEFAULTS.values()
+            config.update(
+                training_audiopaths_and_text=None,
+                test_audiopaths_and_text=None,
+                log_dir=tmp,
+                async_logging=False,
+                batch_size=batch_size,
+            )
+            config.update(hparams)
+            config.update(fp16_run=precision == "fp16", bf16_run=precision == "bf16")
+            trainer = GradTTSTrainer(
+                HParams(**config), rank=0, world_size=1, device=device
+            )
+            torch.manual_seed(trainer.seed)
+            model = GradTTS(trainer.hparams).to(device)
+            optimizer = torch.optim.Adam(model.parameters(), lr=trainer.learning_rate)
+            scaler = GradScaler(enabled=trainer.fp16_run)
+            x, x_lengths, y, y_lengths = synthetic_batch(
+                trainer.hparams, batch_size, n_tokens, n_frames
+            )
+            losses = []
+            for step in range(warmup_steps + steps):
+                if step == warmup_steps:
+                    if device == "cuda":
+                        torch.cuda.synchronize()
+                    start = time.perf_counter()
+                with trainer.autocast_context():
+                    dur_loss, prior_loss, diff_loss = model.compute_loss(
+                        x, x_lengths, y, y_lengths, out_size=trainer.out_size
+                    )
+                    loss = dur_loss + prior_loss + diff_loss
+                scaler.scale(loss).backward()
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad()
+                losses.append(loss.detach())
+            if device == "cuda":
+                torch.cuda.synchronize()
+            elapsed = time.perf_counter() - start
+            trainer.flush_logs()
+            result = dict(
+                precision=precision,
+                seconds=elapsed,
+                steps_per_second=steps / elapsed,
+                utterances_per_second=steps * batch_size / elapsed,
+                final_loss=losses[-1].item(),
+            )
+            result["speedup"] = (
+                result["steps_per_second"]
+                / (results or [result])[0]["steps_per_second"]
+            )
+            results.append(result)
+    return results
+
+
+def benchmark_solvers(
+    checkpoint=None,
+    device=None,
+    solvers=("euler", "heun", "dpm"),
+    schedules=("uniform", "quadratic", "logsnr"),
+    timesteps=(4, 8, 16, 32, 64),
+    reference_timesteps=1000,
+    batch_size=4,
+    n_tokens=100,
+    seed=0,
+    **hparams,
+):
+    """Compare reverse diffusion solvers by the distance of their mels to a
+    reference_timesteps Euler reference, against the number of estimator calls.
+
+    Every run starts from the same text and the same noise. checkpoint is a
+    GradTTS state dict; without one the (untrained) estimator makes the distances
+    only a smoke test. Returns a list of dicts, one per solver, schedule and number
+    of timesteps.
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    config = GRADTTS_DEFAULTS.values()
+    config.update(hparams)
+    hparams = HParams(**config)
+    model = GradTTS(hparams)
+    if checkpoint:
+        model.load_state_dict(torch.load(checkpoint, map_location="cpu"))
+    model = model.to(device).eval()
+    x, x_lengths, _, _ = synthetic_batch(hparams, batch_size, n_tokens, 1, seed=seed)
+    calls = [0]
+
+    def count_call(*args):
+        calls[0] += 1
+
+    model.decoder.estimator.register_forward_hook(count_call)
+
+    def decode(n_timesteps, solver, schedule):
+        torch.manual_seed(seed)
+        calls[0] = 0
+        if device == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        _, y_dec, _ = model(x, x_lengths, n_timesteps, solver=solver, schedule=schedule)
+        if device == "cuda":
+            torch.cuda.synchronize()
+        return y_dec, time.perf_counter() - start
+
+    reference, _ = decode(reference_timesteps, "euler", "uniform")
+    results = []
+    for solver in solvers:
+        for schedule in schedules:
+            for n_timesteps in timesteps:
+                y_dec, seconds = decode(n_timesteps, solver, schedule)
+                results.append(
+                    dict(
+                        solver=solver,
+                        schedule=schedule,
+                        n_timesteps=n_timesteps,
+                        estimator_calls=calls[0],
+                        seconds=seconds,
+                        mel_l1=(y_dec - reference).abs().mean().item(),
+                    )
+                )
+    return results
+
+
+def benchmark_estimator(
+    device=None,
+    n_timesteps=10,
+    batch_size=1,
+    n_frames=200,
+    repeats=5,
+    **hparams,
+):
+    """Time the reverse diffusion steps of the decoder with the estimator's
+    conditioning recomputed at every step, as forward does, and with it computed
+    once per call, as DiffusionODESolver does.
+
+    Returns a dict of milliseconds per step for both, the best of repeats.
+    """
+    device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+    config = GRADTTS_DEFAULTS.values()
+    config.update(hparams)
+    hparams = HParams(**config)
+    decoder = GradTTS(hparams).decoder.to(device).eval()
+    generator = torch.Generator().manual_seed(0)
+    mu = torch.randn(batch_size, hparams.n_feats, n_frames, generator=generator)
+    z = mu + torch.randn(mu.shape, generator=generator)
+    mu, z = mu.to(device), z.to(device)
+    mask = torch.ones(batch_size, 1, n_frames, device=device)
+    h = 1.0 / n_timesteps
+
+    def uncached():
+        xt = z * mask
+        for i in range(n_timesteps):
+            t = (1.0 - (i + 0.5) * h) * torch.ones(batch_size, device=device)
+            score = decoder.estimator(xt, mask, mu, t)
+            xt = (xt - 0.5 * (mu - xt - score) * h) * mask
+        return xt
+
+    def cached():
+        return decoder(z, mask, mu, n_timesteps)
+
+    results = {}
+    with torch.no_grad():
+        for name, fn in [("uncached", uncached), ("cached", cached)]:
+            fn()
+            times = []
+            for _ in range(repeats):
+                if device == "cuda":
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+                fn()
+                if device == "cuda":
+                    torch.cuda.synchronize()
+                times.append(time.perf_counter() - start)
+            results[f"{name}_ms_per_step"] = 1000 * min(times) / n_timesteps
+    results["speedup"] = results["uncached_ms_per_step"] / results["cached_ms_per_step"]
+    return results
+
+# Cell
+try:
+    from nbdev.imports import IN_NOTEBOOK
+except:
+    IN_NOTEBOOK = False
+if __name__ == "__main__" and not IN_NOTEBOOK:
+    args = parse_args(sys.argv[1:])
+    if args.solvers:
+        print("solver | schedule  | timesteps | estimator calls | seconds | mel L1")
+        for result in benchmark_solvers(
+            args.checkpoint, args.device, batch_size=args.batch_size
+        ):
+            print(
+                f"{result['solver']:>6} | {result['schedule']:>9} | "
+                f"{result['n_timesteps']:>9} | {result['estimator_calls']:>15} | "
+                f"{result['seconds']:>7.2f} | {result['mel_l1']:.4f}"
+            )
+    elif args.estimator:
+        for batch_size in [1, args.batch_size]:
+            for n_frames in [100, args.n_frames]:
+                result = benchmark_estimator(
+                    args.device, batch_size=batch_size, n_frames=n_frames
+                )
+                print(
+                    f"batch {batch_size:>3}, {n_frames:>4} frames: "
+                    f"{result['uncached_ms_per_step']:.2f} -> "
+                    f"{result['cached_ms_per_step']:.2f} ms/step "
+                    f"({result['speedup']:.2f}x)"
+                )
+    else:
+        args = vars(args)
+        del args["solvers"], args["checkpoint"], args["estimator"]
+        print("precision | utterances/s | final loss | speedup")
+        for result in benchmark_precision(**args):
+            print(
+                f"{result['precision']:>9} | {result['utterances_per_second']:>12.2f} | "
+                f"{result['final_loss']:>10.4f} | {result['speedup']:.2f}x"
+            )
\ No newline at end of file
@@ -0,0 +1,174 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: nbs/exec.benchmark_mas.ipynb (unless otherwise specified).
+
+__all__ = ['synthetic_scores', 'parse_args', 'benchmark', 'benchmark_banded']
+
+# Cell
+import argparse
+import sys
+import time
+
+import torch
+
+import monotonic_align
+
+
+def synthetic_scores(batch_size, n_frames, seed=0):
+    """MAS scores [b, t_x, t_y] and mask for utterances whose frames follow random
+    token durations of 1 to 7 frames, like speech does, rather than the diagonal.
+
+    Lengths are spread between half and all of n_frames, like a bucketed batch.
+    """
+    generator = torch.Generator().manual_seed(seed)
+    y_lengths = torch.randint(
+        n_frames // 2, n_frames + 1, (batch_size,), generator=generator
+    )
+    durations = torch.randint(1, 8, (batch_size, n_frames), generator=generator)
+    # NOTE: the token each frame belongs to, clamped to end on the last token.
+    tokens = (durations.cumsum(1)[:, :, None] <= torch.arange(n_frames)).sum(1)
+    x_lengths = tokens.gather(1, y_lengths[:, None] - 1)[:, 0] + 1
+    tokens = torch.minimum(tokens, x_lengths[:, None] - 1)
+    t_x = int(x_lengths.max())
+    x = torch.arange(t_x)[None, :, None]
+    value = -((x - tokens[:, None, :]) ** 2).float()
+    value = value + torch.randn(value.shape, generator=generator)
+    mask = (x < x_lengths[:, None, None]) & (
+        torch.arange(n_frames)[None, None, :] < y_lengths[:, None, None]
+    )
+    return value, mask.float()
+
+# Cell
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument(
+        "--n_frames",
+        type=int,
+        nargs="+",
+        default=[200, 800],
+        help="Mel frames per utterance. Utterances have a quarter as many tokens.",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        nargs="+",
+        default=[1, torch.get_num_threads()],
+        help="OpenMP threads to solve the batch on",
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--band_widths",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Compare banded MAS at these widths with the full search instead.",
+    )
+    return parser.parse_args(args)
+
+
+def benchmark(
+    batch_sizes=(1, 16, 64), n_frames=(200, 800), num_threads=(1,), repeats=5
+):
+    """Measure monotonic_align.maximum_path_gradtts at each batch size, number of
+    frames and number of threads.
+
+    Lengths are spread between half and all of n_frames, like a bucketed batch.
+    Returns a list of dicts with the best time per call of repeats and the speedup
+    over the first number of threads.
+    """
+    results = []
+    for batch_size in batch_sizes:
+        for frames in n_frames:
+            value, mask = synthetic_scores(batch_size, frames)
+            first = None
+            for threads in num_threads:
+                monotonic_align.maximum_path_gradtts(value, mask, threads)
+                times = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    monotonic_align.maximum_path_gradtts(value, mask, threads)
+                    times.append(time.perf_counter() - start)
+                result = dict(
+                    batch_size=batch_size,
+                    n_frames=frames,
+                    num_threads=threads,
+                    ms=1000 * min(times),
+                )
+                first = first or result
+                result["speedup"] = first["ms"] / result["ms"]
+                results.append(result)
+    return results
+
+
+def _best_ms(fn, repeats):
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return 1000 * min(times)
+
+
+def benchmark_banded(
+    band_widths=(4, 8, 16, 32), batch_size=16, n_frames=(400, 1600), repeats=5
+):
+    """Compare monotonic_align.maximum_path_gradtts_banded at each band width with
+    the full search, on synthetic_scores.
+
+    Returns a list of dicts with the best time per call of repeats, the speedup
+    over the full search and the fraction of frames aligned to the same token.
+    """
+    results = []
+    for frames in n_frames:
+        value, mask = synthetic_scores(batch_size, frames)
+        exact = monotonic_align.maximum_path_gradtts(value, mask)
+        full_ms = _best_ms(
+            lambda: monotonic_align.maximum_path_gradtts(value, mask), repeats
+        )
+        for band_width in band_widths:
+            path = monotonic_align.maximum_path_gradtts_banded(value, mask, band_width)
+            agreement = (path.argmax(1) == exact.argmax(1)).float()[mask[:, 0] > 0]
+            ms = _best_ms(
+                lambda: monotonic_align.maximum_path_gradtts_banded(
+                    value, mask, band_width
+                ),
+                repeats,
+            )
+            results.append(
+                dict(
+                    n_frames=frames,
+                    band_width=band_width,
+                    ms=ms,
+                    speedup=full_ms / ms,
+                    agreement=agreement.mean().item(),
+                )
+            )
+    return results
+
+# Cell
+try:
+    from nbdev.imports import IN_NOTEBOOK
+except:
+    IN_NOTEBOOK = False
+if __name__ == "__main__" and not IN_NOTEBOOK:
+    args = parse_args(sys.argv[1:])
+    if args.band_widths:
+        print("frames | band width | ms/call | speedup | frames matching full")
+        for result in benchmark_banded(
+            args.band_widths, args.batch_sizes[-1], args.n_frames, args.repeats
+        ):
+            print(
+                f"{result['n_frames']:>6} | {result['band_width']:>10} | "
+                f"{result['ms']:>7.2f} | {result['speedup']:>6.2f}x | "
+                f"{result['agreement']:.4f}"
+            )
+        sys.exit()
+    args = vars(args)
+    del args["band_widths"]
+    print("batch size | frames | threads | ms/call | speedup")
+    for result in benchmark(**args):
+        print(
+            f"{result['batch_size']:>10} | {result['n_frames']:>6} | "
+            f"{result['num_threads']:>7} | {result['ms']:>7.2f} | "
+            f"{result['speedup']:.2f}x"
+        )
\ No newline at end of file
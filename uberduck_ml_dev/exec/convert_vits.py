@@ -0,0 +1,151 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: nbs/exec.convert_vits.ipynb (unless otherwise specified).
+
+__all__ = ['parse_args', 'length_sorted_batches', 'load_generator', 'output_path', 'convert']
+
+# Cell
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import sys
+
+import numpy as np
+from scipy.io.wavfile import write
+import torch
+from torch.utils.data import DataLoader
+
+from ..data_loader import VoiceConversionLoader, VoiceConversionCollate
+from ..models.vits import DEFAULTS as VITS_DEFAULTS, SynthesizerTrn
+from ..text.symbols import symbols_with_ipa
+from ..utils.audio import to_int16
+from ..vendor.tfcompat.hparam import HParams
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", help="Path to JSON config", required=True)
+    parser.add_argument("--checkpoint", help="Generator checkpoint", required=True)
+    parser.add_argument(
+        "--filelist",
+        help="Rows of audio path|source speaker id|target speaker id, with an optional output path",
+        required=True,
+    )
+    parser.add_argument(
+        "--output_dir", default=".", help="Where rows without an output path go"
+    )
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--num_workers", type=int, default=2)
+    parser.add_argument("--write_threads", type=int, default=4)
+    parser.add_argument("--noise_scale", type=float, default=1.0)
+    parser.add_argument("--device", default=None)
+    return parser.parse_args(args)
+
+# Cell
+def length_sorted_batches(lengths, batch_size):
+    """Batches of indices of similar lengths, so that little of each batch is
+    padding."""
+    indices = np.argsort(lengths, kind="stable").tolist()
+    return [indices[i : i + batch_size] for i in range(0, len(indices), batch_size)]
+
+
+def load_generator(hparams, checkpoint=None, device="cpu"):
+    """The SynthesizerTrn that VITSTrainer trains for hparams, with the weights
+    of a generator checkpoint it saved."""
+    model_kwargs = {
+        k: getattr(hparams, k) for k in VITS_DEFAULTS.values() if hasattr(hparams, k)
+    }
+    net_g = SynthesizerTrn(
+        len(symbols_with_ipa),
+        hparams.filter_length // 2 + 1,
+        hparams.segment_size // hparams.hop_length,
+        n_speakers=hparams.n_speakers,
+        **model_kwargs,
+    )
+    if checkpoint:
+        net_g.load_state_dict(torch.load(checkpoint, map_location="cpu")["model"])
+    return net_g.to(device).eval()
+
+
+def output_path(row, output_dir):
+    """The path of row's conversion: its fourth column, or else the audio file's
+    name with the target speaker id appended, in output_dir."""
+    if len(row) > 3 and row[3]:
+        return row[3]
+    name = os.path.splitext(os.path.basename(row[0]))[0]
+    return os.path.join(output_dir, f"{name}_{row[2]}.wav")
+
+
+def convert(
+    net_g,
+    dataset,
+    output_dir=".",
+    batch_size=16,
+    num_workers=2,
+    write_threads=4,
+    noise_scale=1.0,
+):
+    """Convert every row of a VoiceConversionLoader, batch_size items of similar
+    length at a time, and write each one, trimmed to its length, to output_path.
+
+    Spectrograms load in num_workers processes and audio is written on
+    write_threads threads while the next batch converts. Returns the paths
+    written, in the order of the rows.
+    """
+    device = next(net_g.parameters()).device
+    loader = DataLoader(
+        dataset,
+        batch_sampler=length_sorted_batches(dataset.lengths, batch_size),
+        num_workers=num_workers,
+        collate_fn=VoiceConversionCollate(),
+    )
+    paths = [output_path(row, output_dir) for row in dataset.audiopaths_sids]
+    hop_length = int(np.prod(net_g.upsample_rates))
+    with ThreadPoolExecutor(write_threads) as executor:
+        writes = []
+        for spec, spec_lengths, sid_src, sid_tgt, indices in loader:
+            with torch.no_grad():
+                audio, _, _ = net_g.voice_conversion(
+                    spec.to(device),
+                    spec_lengths.to(device),
+                    sid_src.to(device),
+                    sid_tgt.to(device),
+                    noise_scale=noise_scale,
+                )
+            audio = to_int16(audio.squeeze(1), dataset.max_wav_value)
+            for item, index in enumerate(indices.tolist()):
+                length = spec_lengths[item].item() * hop_length
+                writes.append(
+                    executor.submit(
+                        write,
+                        paths[index],
+                        dataset.sampling_rate,
+                        audio[item, :length],
+                    )
+                )
+        for future in writes:
+            future.result()
+    return paths
+
+# Cell
+try:
+    from nbdev.imports import IN_NOTEBOOK
+except:
+    IN_NOTEBOOK = False
+if __name__ == "__main__" and not IN_NOTEBOOK:
+    args = parse_args(sys.argv[1:])
+    config = VITS_DEFAULTS.values()
+    with open(args.config) as f:
+        config.update(json.load(f))
+    hparams = HParams(**config)
+    device = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+    os.makedirs(args.output_dir, exist_ok=True)
+    paths = convert(
+        load_generator(hparams, args.checkpoint, device),
+        VoiceConversionLoader(args.filelist, hparams),
+        output_dir=args.output_dir,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        write_threads=args.write_threads,
+        noise_scale=args.noise_scale,
+    )
+    print(f"Wrote {len(paths)} files")
\ No newline at end of file
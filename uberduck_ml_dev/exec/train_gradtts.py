@@ -11,6 +11,7 @@ import sys
 import torch
 from torch import multiprocessing as mp
 
+from ..trainer.base import launch
 from ..trainer.gradtts import GradTTSTrainer
 from ..vendor.tfcompat.hparam import HParams
 from ..models.gradtts import DEFAULTS as GRADTTS_DEFAULTS
@@ -45,7 +46,6 @@ if __name__ == "__main__" and not IN_NOTEBOOK:
             config.update(json.load(f))
     hparams = HParams(**config)
     if hparams.distributed_run:
-        device_count = torch.cuda.device_count()
-        mp.spawn(run, (device_count, hparams), device_count)
+        launch(run, hparams)
     else:
         run(0, 1, hparams)
\ No newline at end of file
@@ -11,6 +11,7 @@ import sys
 import torch
 from torch import multiprocessing as mp
 
+from ..trainer.base import launch
 from ..trainer.mellotron import MellotronTrainer
 from ..vendor.tfcompat.hparam import HParams
 from ..models.mellotron import DEFAULTS as MELLOTRON_DEFAULTS
@@ -39,7 +40,6 @@ if __name__ == "__main__" and not IN_NOTEBOOK:
             config.update(json.load(f))
     hparams = HParams(**config)
     if hparams.distributed_run:
-        device_count = torch.cuda.device_count()
-        mp.spawn(run, (device_count, hparams), device_count)
+        launch(run, hparams)
     else:
         run(None, None, hparams)
\ No newline at end of file
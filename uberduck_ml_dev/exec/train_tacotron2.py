@@ -3,6 +3,7 @@
 __all__ = ['parse_args', 'run']
 
 # Cell
+from ..trainer.base import launch
 from ..trainer.tacotron2 import Tacotron2Trainer
 from ..vendor.tfcompat.hparam import HParams
 from ..trainer.tacotron2 import DEFAULTS as TACOTRON2_TRAINER_DEFAULTS
@@ -43,7 +44,6 @@ if __name__ == "__main__" and not IN_NOTEBOOK:
     config.update(vars(args))
     hparams = HParams(**config)
     if hparams.distributed_run:
-        device_count = torch.cuda.device_count()
-        mp.spawn(run, (device_count, hparams), device_count)
+        launch(run, hparams)
     else:
         run(None, None, hparams)
\ No newline at end of file
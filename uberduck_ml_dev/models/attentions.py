@@ -5,6 +5,7 @@ __all__ = ['VITSEncoder', 'Decoder', 'MultiHeadAttention', 'FFN']
 # Cell
 
 import copy
+import functools
 import math
 import numpy as np
 import torch
@@ -164,6 +165,38 @@ class Decoder(nn.Module):
         return x
 
 
+# NOTE: fused attention needs torch >= 2.0. Older versions take the explicit path.
+_HAS_SDPA = hasattr(F, "scaled_dot_product_attention")
+
+
+# NOTE: the relative position indices and masks only depend on the length (and
+# device), so they are built once per length rather than on every forward.
+@functools.lru_cache(maxsize=256)
+def _relative_index(length, window_size, device):
+    """For each position and relative position in [-window_size, window_size], the
+    position it refers to, clamped to the sequence, and whether it is in it."""
+    index = torch.arange(length, device=device)[:, None] + torch.arange(
+        -window_size, window_size + 1, device=device
+    )
+    return index.clamp(0, length - 1), (index >= 0) & (index < length)
+
+
+@functools.lru_cache(maxsize=256)
+def _band_mask(length, width, device):
+    """Mask of the pairs of positions at most width apart."""
+    r = torch.arange(length, device=device)
+    return (r[None] - r[:, None]).abs() <= width
+
+
+@functools.lru_cache(maxsize=256)
+def _proximal_bias(length, device, dtype):
+    """Bias for self-attention to encourage attention to close positions, of
+    shape [1, 1, length, length]."""
+    r = torch.arange(length, dtype=torch.float32, device=device)
+    diff = torch.unsqueeze(r, 0) - torch.unsqueeze(r, 1)
+    return -torch.log1p(torch.abs(diff))[None, None].to(dtype)
+
+
 class MultiHeadAttention(nn.Module):
     def __init__(
         self,
@@ -189,6 +222,8 @@ class MultiHeadAttention(nn.Module):
         self.block_length = block_length
         self.proximal_bias = proximal_bias
         self.proximal_init = proximal_init
+        # NOTE: the attention weights of the last forward, or None when they were
+        # not materialized because attention was fused (see attention).
         self.attn = None
 
         self.k_channels = channels // n_heads
@@ -235,130 +270,71 @@ class MultiHeadAttention(nn.Module):
         key = key.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
         value = value.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
 
-        scores = torch.matmul(query / math.sqrt(self.k_channels), key.transpose(-2, -1))
+        if (
+            _HAS_SDPA
+            and self.window_size is None
+            and not self.proximal_bias
+            and self.block_length is None
+        ):
+            # NOTE: without relative positions or biases this is plain scaled dot
+            # product attention, which torch fuses. The attention weights are not
+            # materialized, so None is returned in their place, and callers that
+            # plot them have to handle None.
+            if mask is not None:
+                mask = torch.zeros(
+                    mask.shape, dtype=query.dtype, device=query.device
+                ).masked_fill(mask == 0, -1e4)
+            output = F.scaled_dot_product_attention(
+                query,
+                key,
+                value,
+                attn_mask=mask,
+                dropout_p=self.p_dropout if self.training else 0.0,
+            )
+            return output.transpose(2, 3).contiguous().view(b, d, t_t), None
+
+        query = query / math.sqrt(self.k_channels)
+        scores = torch.matmul(query, key.transpose(-2, -1))
         if self.window_size is not None:
             assert (
                 t_s == t_t
             ), "Relative attention is only available for self-attention."
-            key_relative_embeddings = self._get_relative_embeddings(self.emb_rel_k, t_s)
-            rel_logits = self._matmul_with_relative_keys(
-                query / math.sqrt(self.k_channels), key_relative_embeddings
+            # NOTE: only the 2 * window_size + 1 positions around each query have
+            # relative embeddings, so score just those and add them to their band of
+            # the scores, rather than padding the embeddings out to every position.
+            index, valid = _relative_index(t_s, self.window_size, query.device)
+            rel_logits = torch.matmul(
+                query, self.emb_rel_k.unsqueeze(0).transpose(-2, -1)
+            )
+            scores.scatter_add_(
+                -1, index.expand_as(rel_logits), rel_logits.masked_fill(~valid, 0)
             )
-            scores_local = self._relative_position_to_absolute_position(rel_logits)
-            scores = scores + scores_local
         if self.proximal_bias:
             assert t_s == t_t, "Proximal bias is only available for self-attention."
-            scores = scores + self._attention_bias_proximal(t_s).to(
-                device=scores.device, dtype=scores.dtype
-            )
+            scores = scores + _proximal_bias(t_s, scores.device, scores.dtype)
         if mask is not None:
             scores = scores.masked_fill(mask == 0, -1e4)
             if self.block_length is not None:
                 assert (
                     t_s == t_t
                 ), "Local attention is only available for self-attention."
-                block_mask = (
-                    torch.ones_like(scores)
-                    .triu(-self.block_length)
-                    .tril(self.block_length)
-                )
-                scores = scores.masked_fill(block_mask == 0, -1e4)
+                block_mask = _band_mask(t_s, self.block_length, scores.device)
+                scores = scores.masked_fill(~block_mask, -1e4)
         p_attn = F.softmax(scores, dim=-1)  # [b, n_h, t_t, t_s]
         p_attn = self.drop(p_attn)
         output = torch.matmul(p_attn, value)
         if self.window_size is not None:
-            relative_weights = self._absolute_position_to_relative_position(p_attn)
-            value_relative_embeddings = self._get_relative_embeddings(
-                self.emb_rel_v, t_s
-            )
-            output = output + self._matmul_with_relative_values(
-                relative_weights, value_relative_embeddings
+            relative_weights = p_attn.gather(
+                -1, index.expand(*p_attn.shape[:3], -1)
+            ).masked_fill(~valid, 0)
+            output = output + torch.matmul(
+                relative_weights, self.emb_rel_v.unsqueeze(0)
             )
         output = (
             output.transpose(2, 3).contiguous().view(b, d, t_t)
         )  # [b, n_h, t_t, d_k] -> [b, d, t_t]
         return output, p_attn
 
-    def _matmul_with_relative_values(self, x, y):
-        """
-        x: [b, h, l, m]
-        y: [h or 1, m, d]
-        ret: [b, h, l, d]
-        """
-        ret = torch.matmul(x, y.unsqueeze(0))
-        return ret
-
-    def _matmul_with_relative_keys(self, x, y):
-        """
-        x: [b, h, l, d]
-        y: [h or 1, m, d]
-        ret: [b, h, l, m]
-        """
-        ret = torch.matmul(x, y.unsqueeze(0).transpose(-2, -1))
-        return ret
-
-    def _get_relative_embeddings(self, relative_embeddings, length):
-        max_relative_position = 2 * self.window_size + 1
-        # Pad first before slice to avoid using cond ops.
-        pad_length = max(length - (self.window_size + 1), 0)
-        slice_start_position = max((self.window_size + 1) - length, 0)
-        slice_end_position = slice_start_position + 2 * length - 1
-        if pad_length > 0:
-            padded_relative_embeddings = F.pad(
-                relative_embeddings,
-                convert_pad_shape([[0, 0], [pad_length, pad_length], [0, 0]]),
-            )
-        else:
-            padded_relative_embeddings = relative_embeddings
-        used_relative_embeddings = padded_relative_embeddings[
-            :, slice_start_position:slice_end_position
-        ]
-        return used_relative_embeddings
-
-    def _relative_position_to_absolute_position(self, x):
-        """
-        x: [b, h, l, 2*l-1]
-        ret: [b, h, l, l]
-        """
-        batch, heads, length, _ = x.size()
-        # Concat columns of pad to shift from relative to absolute indexing.
-        x = F.pad(x, convert_pad_shape([[0, 0], [0, 0], [0, 0], [0, 1]]))
-
-        # Concat extra elements so to add up to shape (len+1, 2*len-1).
-        x_flat = x.view([batch, heads, length * 2 * length])
-        x_flat = F.pad(x_flat, convert_pad_shape([[0, 0], [0, 0], [0, length - 1]]))
-
-        # Reshape and slice out the padded elements.
-        x_final = x_flat.view([batch, heads, length + 1, 2 * length - 1])[
-            :, :, :length, length - 1 :
-        ]
-        return x_final
-
-    def _absolute_position_to_relative_position(self, x):
-        """
-        x: [b, h, l, l]
-        ret: [b, h, l, 2*l-1]
-        """
-        batch, heads, length, _ = x.size()
-        # padd along column
-        x = F.pad(x, convert_pad_shape([[0, 0], [0, 0], [0, 0], [0, length - 1]]))
-        x_flat = x.view([batch, heads, length**2 + length * (length - 1)])
-        # add 0's in the beginning that will skew the elements after reshape
-        x_flat = F.pad(x_flat, convert_pad_shape([[0, 0], [0, 0], [length, 0]]))
-        x_final = x_flat.view([batch, heads, length, 2 * length])[:, :, :, 1:]
-        return x_final
-
-    def _attention_bias_proximal(self, length):
-        """Bias for self-attention to encourage attention to close positions.
-        Args:
-          length: an integer scalar.
-        Returns:
-          a Tensor with shape [1, 1, length, length]
-        """
-        r = torch.arange(length, dtype=torch.float32)
-        diff = torch.unsqueeze(r, 0) - torch.unsqueeze(r, 1)
-        return torch.unsqueeze(torch.unsqueeze(-torch.log1p(torch.abs(diff)), 0), 0)
-
 
 class FFN(nn.Module):
     def __init__(
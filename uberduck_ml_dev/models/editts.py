@@ -23,6 +23,7 @@ from .gradtts import (
     generate_path,
     fix_len_compatibility,
     get_noise,
+    DiffusionODESolver,
     DEFAULTS,
 )
 
@@ -56,6 +57,8 @@ class EdiTTS(torch.nn.Module):
         amax=0.9,
         amin=0.1,
         intersperse_token=148,
+        solver="euler",
+        schedule="uniform",
     ):
         """
         EdiTTS
@@ -68,6 +71,8 @@ class EdiTTS(torch.nn.Module):
         n_timesteps (int): number of steps to use for reverse diffusion in decoder.
         symbol_set (str): symbol set key to lookup the symbol set
         intersperse_token (int): value used for interspersing
+        solver (str): reverse diffusion solver, "euler", "heun" or "dpm"
+        schedule (str): spacing of the reverse diffusion timesteps, "uniform", "quadratic" or "logsnr"
 
         Output:
         y_dec1: Mel spectrogram of text1
@@ -115,6 +120,8 @@ class EdiTTS(torch.nn.Module):
             n_soften=n_soften,
             amax=amax,
             amin=amin,
+            solver=solver,
+            schedule=schedule,
         )
         return y_dec1, y_dec2, y_dec_edit, y_dec_cat
 
@@ -136,6 +143,8 @@ class EdiTTS(torch.nn.Module):
         amax=0.9,
         amin=0.1,
         intersperse_token=148,
+        solver="euler",
+        schedule="uniform",
     ):
         """
         EdiTTS
@@ -150,6 +159,8 @@ class EdiTTS(torch.nn.Module):
         symbol_set (str): symbol set key to lookup the symbol set
         desired_time (float): Length of time for audio to be substituted into mel (seconds)
         intersperse_token (int): value used for interspersing
+        solver (str): reverse diffusion solver, "euler", "heun" or "dpm"
+        schedule (str): spacing of the reverse diffusion timesteps, "uniform", "quadratic" or "logsnr"
 
         Output:
         y_dec1: Mel spectrogram of text1
@@ -182,6 +193,8 @@ class EdiTTS(torch.nn.Module):
             n_soften=n_soften,
             amax=amax,
             amin=amin,
+            solver=solver,
+            schedule=schedule,
         )
         return y_dec1, y_dec2, y_dec_edit, y_dec_cat
 
@@ -207,6 +220,8 @@ class EdiTTS(torch.nn.Module):
         n_soften=16,
         amax=0.9,
         amin=0.1,
+        solver="euler",
+        schedule="uniform",
     ):
         def _process_input(x, x_lengths):
             x, x_lengths = self.gradtts_model.relocate_input([x, x_lengths])
@@ -381,7 +396,9 @@ class EdiTTS(torch.nn.Module):
         if mel1 is not None:
             dec1 = mu_y1
         else:
-            dec1 = self.gradtts_model.decoder(z1, y1_mask, mu_y1, n_timesteps, stoc)
+            dec1 = self.gradtts_model.decoder(
+                z1, y1_mask, mu_y1, n_timesteps, stoc, solver=solver, schedule=schedule
+            )
 
         dec2, dec_edit = self.double_forward_text(
             z2,
@@ -399,6 +416,8 @@ class EdiTTS(torch.nn.Module):
             stoc,
             soften_mask,
             n_soften,
+            solver,
+            schedule,
         )
 
         dec1 = dec1[:, :, :y1_max_length]
@@ -428,6 +447,8 @@ class EdiTTS(torch.nn.Module):
         stoc=False,
         soften_mask=True,
         n_soften=20,
+        solver="euler",
+        schedule="uniform",
     ):
         if soften_mask:
             kernel = [
@@ -456,49 +477,23 @@ class EdiTTS(torch.nn.Module):
             mask_edit_soft = mask_edit_soft.squeeze(1)
             mask_edit_grad = mask_edit_grad + (1 - mask_edit_grad) * mask_edit_soft
 
-        h = 1.0 / n_timesteps
+        # NOTE: the stochastic term would differ between the two trajectories.
+        assert not stoc
+        decoder = self.gradtts_model.decoder
+        ode_solver = DiffusionODESolver(decoder, n_timesteps, solver, schedule)
+        ode_solver_edit = DiffusionODESolver(decoder, n_timesteps, solver, schedule)
         xt = z * mask
         xt_edit = z_edit * mask_edit_net
 
         for i in range(n_timesteps):
-            t = (1.0 - (i + 0.5) * h) * torch.ones(
-                z.shape[0], dtype=z.dtype, device=z.device
-            )
-            time = t.unsqueeze(-1).unsqueeze(-1)
-            noise_t = get_noise(
-                time,
-                self.gradtts_model.decoder.beta_min,
-                self.gradtts_model.decoder.beta_max,
-                cumulative=False,
+            dxt = xt - ode_solver.step(i, xt, mask, mu)
+            dxt_edit = xt_edit - ode_solver_edit.step(
+                i, xt_edit, mask_edit_net, mu_edit
             )
-            if stoc:  # adds stochastic term
-                # NOTE: should not come here
-                assert False
-                dxt_det = 0.5 * (mu - xt) - self.gradtts_model.decoder.estimator(
-                    xt, mask, mu, t
-                )
-                dxt_det = dxt_det * noise_t * h
-                dxt_stoc = torch.randn(
-                    z.shape, dtype=z.dtype, device=z.device, requires_grad=False
-                )
-                dxt_stoc = dxt_stoc * torch.sqrt(noise_t * h)
-                dxt = dxt_det + dxt_stoc
-            else:
-                dxt = 0.5 * (
-                    mu - xt - self.gradtts_model.decoder.estimator(xt, mask, mu, t)
-                )
-                dxt = dxt * noise_t * h
-                dxt_edit = 0.5 * (
-                    mu_edit
-                    - xt_edit
-                    - self.gradtts_model.decoder.estimator(
-                        xt_edit, mask_edit_net, mu_edit, t
-                    )
-                )
-                dxt_edit = dxt_edit * noise_t * h
 
             xt = (xt - dxt) * mask
 
+            # NOTE: inside the edited region, follow the updates of the source.
             dxt_trg = torch.zeros_like(dxt_edit)
             dxt_trg[:, :, i1 : i1 + (j2 - i2)] = dxt[:, :, i2:j2]
 
@@ -1,9 +1,10 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/models.gradtts.ipynb (unless otherwise specified).
 
-__all__ = ['BaseModule', 'Mish', 'Upsample', 'Downsample', 'Rezero', 'Block', 'ResnetBlock', 'LinearAttention',
-           'Residual', 'SinusoidalPosEmb', 'GradLogPEstimator2d', 'get_noise', 'Diffusion', 'sequence_mask',
-           'fix_len_compatibility', 'convert_pad_shape', 'generate_path', 'duration_loss', 'LayerNorm', 'ConvReluNorm',
-           'DurationPredictor', 'MultiHeadAttention', 'FFN', 'Encoder', 'TextEncoder', 'GradTTS', 'DEFAULTS']
+__all__ = ['BaseModule', 'Mish', 'Upsample', 'Downsample', 'Rezero', 'masked_group_norm', 'Block', 'ResnetBlock',
+           'LinearAttention', 'Residual', 'SinusoidalPosEmb', 'GradLogPEstimator2d', 'get_noise', 'DiffusionODESolver',
+           'Diffusion', 'sequence_mask', 'fix_len_compatibility', 'convert_pad_shape', 'generate_path', 'duration_loss',
+           'LayerNorm', 'ConvReluNorm', 'DurationPredictor', 'MultiHeadAttention', 'FFN', 'Encoder', 'TextEncoder',
+           'GradTTS', 'DEFAULTS']
 
 # Cell
 import random
@@ -15,6 +16,7 @@ import numpy as np
 import torch
 import torch.nn.functional as F
 
+from .attentions import MultiHeadAttention as VITSMultiHeadAttention
 from .base import TTSModel
 from ..vendor.tfcompat.hparam import HParams
 from ..text.symbols import SYMBOL_SETS
@@ -81,13 +83,28 @@ class Rezero(BaseModule):
         self.fn = fn
         self.g = torch.nn.Parameter(torch.zeros(1))
 
-    def forward(self, x):
-        return self.fn(x) * self.g
+    def forward(self, x, *args, **kwargs):
+        return self.fn(x, *args, **kwargs) * self.g
+
+
+def masked_group_norm(x, mask, norm):
+    """Apply the GroupNorm norm to x [B, C, H, W], with statistics over the frames
+    where mask [B, 1, 1, W] is 1 only, so that each item of a batch is normalized
+    as it would be on its own, regardless of how much it is padded."""
+    b, c, h, w = x.shape
+    groups = x.view(b, norm.num_groups, -1, h, w)
+    mask = mask.view(b, 1, 1, 1, w)
+    count = mask.sum((2, 3, 4), keepdim=True) * groups.size(2) * h
+    mean = (groups * mask).sum((2, 3, 4), keepdim=True) / count
+    var = ((groups - mean) * mask).pow(2).sum((2, 3, 4), keepdim=True) / count
+    x = ((groups - mean) * torch.rsqrt(var + norm.eps)).view(b, c, h, w)
+    return x * norm.weight.view(1, c, 1, 1) + norm.bias.view(1, c, 1, 1)
 
 
 class Block(BaseModule):
-    def __init__(self, dim, dim_out, groups=8):
+    def __init__(self, dim, dim_out, groups=8, mask_padding=False):
         super(Block, self).__init__()
+        self.mask_padding = mask_padding
         self.block = torch.nn.Sequential(
             torch.nn.Conv2d(dim, dim_out, 3, padding=1),
             torch.nn.GroupNorm(groups, dim_out),
@@ -95,25 +112,36 @@ class Block(BaseModule):
         )
 
     def forward(self, x, mask):
-        output = self.block(x * mask)
-        return output * mask
+        """With mask_padding the GroupNorm statistics exclude the padding."""
+        if not self.mask_padding:
+            output = self.block(x * mask)
+            return output * mask
+        conv, norm, mish = self.block
+        output = masked_group_norm(conv(x * mask), mask, norm)
+        return mish(output) * mask
 
 
 class ResnetBlock(BaseModule):
-    def __init__(self, dim, dim_out, time_emb_dim, groups=8):
+    def __init__(self, dim, dim_out, time_emb_dim, groups=8, mask_padding=False):
         super(ResnetBlock, self).__init__()
         self.mlp = torch.nn.Sequential(Mish(), torch.nn.Linear(time_emb_dim, dim_out))
 
-        self.block1 = Block(dim, dim_out, groups=groups)
-        self.block2 = Block(dim_out, dim_out, groups=groups)
+        self.block1 = Block(dim, dim_out, groups=groups, mask_padding=mask_padding)
+        self.block2 = Block(dim_out, dim_out, groups=groups, mask_padding=mask_padding)
         if dim != dim_out:
             self.res_conv = torch.nn.Conv2d(dim, dim_out, 1)
         else:
             self.res_conv = torch.nn.Identity()
 
-    def forward(self, x, mask, time_emb):
+    def time_bias(self, time_emb):
+        return self.mlp(time_emb).unsqueeze(-1).unsqueeze(-1)
+
+    def forward(self, x, mask, time_emb=None, time_bias=None):
+        """Pass either the time embedding, or its time_bias if precomputed."""
+        if time_bias is None:
+            time_bias = self.time_bias(time_emb)
         h = self.block1(x, mask)
-        h += self.mlp(time_emb).unsqueeze(-1).unsqueeze(-1)
+        h += time_bias
         h = self.block2(h, mask)
         output = h + self.res_conv(x * mask)
         return output
@@ -127,12 +155,16 @@ class LinearAttention(BaseModule):
         self.to_qkv = torch.nn.Conv2d(dim, hidden_dim * 3, 1, bias=False)
         self.to_out = torch.nn.Conv2d(hidden_dim, dim, 1)
 
-    def forward(self, x):
+    def forward(self, x, mask=None):
+        """Attend over the frames where mask [B, 1, 1, W], if given, is 1."""
         b, c, h, w = x.shape
         qkv = self.to_qkv(x)
         q, k, v = rearrange(
             qkv, "b (qkv heads c) h w -> qkv b heads c (h w)", heads=self.heads, qkv=3
         )
+        if mask is not None:
+            mask = mask.expand(b, 1, h, w).reshape(b, 1, 1, h * w)
+            k = k.masked_fill(mask == 0, float("-inf"))
         k = k.softmax(dim=-1)
         context = torch.einsum("bhdn,bhen->bhde", k, v)
         out = torch.einsum("bhde,bhdn->bhen", context, q)
@@ -177,11 +209,13 @@ class GradLogPEstimator2d(BaseModule):
         spk_emb_dim=64,
         n_feats=80,
         pe_scale=1000,
+        mask_padding=False,
     ):
         super(GradLogPEstimator2d, self).__init__()
         self.dim = dim
         self.dim_mults = dim_mults
         self.groups = groups
+        self.mask_padding = mask_padding
         self.n_spks = n_spks if not isinstance(n_spks, type(None)) else 1
         self.spk_emb_dim = spk_emb_dim
         self.pe_scale = pe_scale
@@ -208,8 +242,15 @@ class GradLogPEstimator2d(BaseModule):
             self.downs.append(
                 torch.nn.ModuleList(
                     [
-                        ResnetBlock(dim_in, dim_out, time_emb_dim=dim),
-                        ResnetBlock(dim_out, dim_out, time_emb_dim=dim),
+                        ResnetBlock(
+                            dim_in, dim_out, time_emb_dim=dim, mask_padding=mask_padding
+                        ),
+                        ResnetBlock(
+                            dim_out,
+                            dim_out,
+                            time_emb_dim=dim,
+                            mask_padding=mask_padding,
+                        ),
                         Residual(Rezero(LinearAttention(dim_out))),
                         Downsample(dim_out) if not is_last else torch.nn.Identity(),
                     ]
@@ -217,61 +258,105 @@ class GradLogPEstimator2d(BaseModule):
             )
 
         mid_dim = dims[-1]
-        self.mid_block1 = ResnetBlock(mid_dim, mid_dim, time_emb_dim=dim)
+        self.mid_block1 = ResnetBlock(
+            mid_dim, mid_dim, time_emb_dim=dim, mask_padding=mask_padding
+        )
         self.mid_attn = Residual(Rezero(LinearAttention(mid_dim)))
-        self.mid_block2 = ResnetBlock(mid_dim, mid_dim, time_emb_dim=dim)
+        self.mid_block2 = ResnetBlock(
+            mid_dim, mid_dim, time_emb_dim=dim, mask_padding=mask_padding
+        )
 
         for ind, (dim_in, dim_out) in enumerate(reversed(in_out[1:])):
             self.ups.append(
                 torch.nn.ModuleList(
                     [
-                        ResnetBlock(dim_out * 2, dim_in, time_emb_dim=dim),
-                        ResnetBlock(dim_in, dim_in, time_emb_dim=dim),
+                        ResnetBlock(
+                            dim_out * 2,
+                            dim_in,
+                            time_emb_dim=dim,
+                            mask_padding=mask_padding,
+                        ),
+                        ResnetBlock(
+                            dim_in, dim_in, time_emb_dim=dim, mask_padding=mask_padding
+                        ),
                         Residual(Rezero(LinearAttention(dim_in))),
                         Upsample(dim_in),
                     ]
                 )
             )
-        self.final_block = Block(dim, dim)
+        self.final_block = Block(dim, dim, mask_padding=mask_padding)
         self.final_conv = torch.nn.Conv2d(dim, 1, 1)
 
-    def forward(self, x, mask, mu, t, spk=None):
-        if not isinstance(spk, type(None)):
-            s = self.spk_mlp(spk)
-
+    def _resnet_blocks(self):
+        """The ResnetBlocks in the order forward_conditioned runs them."""
+        blocks = []
+        for resnet1, resnet2, _, _ in self.downs:
+            blocks += [resnet1, resnet2]
+        blocks += [self.mid_block1, self.mid_block2]
+        for resnet1, resnet2, _, _ in self.ups:
+            blocks += [resnet1, resnet2]
+        return blocks
+
+    def time_biases(self, t):
+        """The time conditioning of each ResnetBlock for times t, of shape [B]."""
         t = self.time_pos_emb(t, scale=self.pe_scale)
         t = self.mlp(t)
+        return [block.time_bias(t) for block in self._resnet_blocks()]
 
-        if self.n_spks < 2:
-            x = torch.stack([mu, x], 1)
-        else:
-            s = s.unsqueeze(-1).repeat(1, 1, x.shape[-1])
-            x = torch.stack([mu, x, s], 1)
+    def condition(self, mask, mu, spk=None):
+        """The inputs of forward_conditioned that don't depend on x or t, which
+        reverse diffusion can compute once and reuse for every step."""
+        inputs = [mu, torch.zeros_like(mu)]
+        if self.n_spks >= 2:
+            s = self.spk_mlp(spk)
+            inputs.append(s.unsqueeze(-1).repeat(1, 1, mu.shape[-1]))
         mask = mask.unsqueeze(1)
+        masks = [mask]
+        for _ in self.downs:
+            masks.append(masks[-1][:, :, :, ::2])
+        return dict(inputs=torch.stack(inputs, 1), masks=masks)
+
+    def forward(self, x, mask, mu, t, spk=None):
+        return self.forward_conditioned(
+            x, self.condition(mask, mu, spk), self.time_biases(t)
+        )
+
+    def forward_conditioned(self, x, condition, time_biases):
+        """Estimate the score of x given the outputs of condition and time_biases.
+
+        NOTE: x is copied into condition["inputs"], in place.
+        """
+        inputs = condition["inputs"]
+        inputs[:, 1] = x
+        x = inputs
+        mask = condition["masks"][0]
+        time_biases = iter(time_biases)
 
         hiddens = []
-        masks = [mask]
-        for resnet1, resnet2, attn, downsample in self.downs:
+        masks = condition["masks"][:1]
+        for (resnet1, resnet2, attn, downsample), mask_next in zip(
+            self.downs, condition["masks"][1:]
+        ):
             mask_down = masks[-1]
-            x = resnet1(x, mask_down, t)
-            x = resnet2(x, mask_down, t)
-            x = attn(x)
+            x = resnet1(x, mask_down, time_bias=next(time_biases))
+            x = resnet2(x, mask_down, time_bias=next(time_biases))
+            x = attn(x, mask_down if self.mask_padding else None)
             hiddens.append(x)
             x = downsample(x * mask_down)
-            masks.append(mask_down[:, :, :, ::2])
+            masks.append(mask_next)
 
         masks = masks[:-1]
         mask_mid = masks[-1]
-        x = self.mid_block1(x, mask_mid, t)
-        x = self.mid_attn(x)
-        x = self.mid_block2(x, mask_mid, t)
+        x = self.mid_block1(x, mask_mid, time_bias=next(time_biases))
+        x = self.mid_attn(x, mask_mid if self.mask_padding else None)
+        x = self.mid_block2(x, mask_mid, time_bias=next(time_biases))
 
         for resnet1, resnet2, attn, upsample in self.ups:
             mask_up = masks.pop()
             x = torch.cat((x, hiddens.pop()), dim=1)
-            x = resnet1(x, mask_up, t)
-            x = resnet2(x, mask_up, t)
-            x = attn(x)
+            x = resnet1(x, mask_up, time_bias=next(time_biases))
+            x = resnet2(x, mask_up, time_bias=next(time_biases))
+            x = attn(x, mask_up if self.mask_padding else None)
             x = upsample(x * mask_up)
 
         x = self.final_block(x, mask)
@@ -288,6 +373,178 @@ def get_noise(t, beta_init, beta_term, cumulative=False):
     return noise
 
 
+class DiffusionODESolver:
+    """Step the reverse diffusion of one batch from t=1 to t=0.
+
+    solver is one of
+        "euler": the original first order update, with the estimator evaluated
+            at the middle of each step. Supports stoc.
+        "heun": second order (RK2) steps on the probability flow ODE. The last
+            step, which ends at t=0 where the estimator is not trained, is an
+            Euler step. 2 * n_timesteps - 1 estimator calls.
+        "dpm": a DPM-Solver++(2M) style multistep exponential integrator, which
+            reuses the previous step's estimate of the clean mel, so second
+            order at one estimator call per step.
+    and schedule is one of
+        "uniform": equal steps in t.
+        "quadratic": smaller steps close to t=0, where the score changes fastest.
+        "logsnr": equal steps in log signal to noise ratio, as DPM-Solver
+            assumes, from t=1 to t=1e-3 (t=0 is at infinite log SNR).
+    "dpm" with "logsnr" or "heun" with "quadratic" reach the quality of 50+ Euler
+    steps in around 10 steps.
+
+    step returns the unmasked next state. A solver keeps the history of its own
+    trajectory, so use one solver per trajectory. It also caches the estimator's
+    conditioning on mask, mu and spk and its time embeddings for every time the
+    schedule evaluates, so each step only runs the U-Net on the new state.
+    """
+
+    SOLVERS = ["euler", "heun", "dpm"]
+    SCHEDULES = ["uniform", "quadratic", "logsnr"]
+    LOGSNR_END = 1e-3
+
+    def __init__(
+        self, diffusion, n_timesteps, solver="euler", schedule="uniform", stoc=False
+    ):
+        if solver not in self.SOLVERS:
+            raise Exception(f"Unknown solver {solver}, expected one of {self.SOLVERS}")
+        if schedule not in self.SCHEDULES:
+            raise Exception(
+                f"Unknown schedule {schedule}, expected one of {self.SCHEDULES}"
+            )
+        if stoc and solver != "euler":
+            raise Exception("stoc is only supported by the euler solver")
+        self.diffusion = diffusion
+        self.n_timesteps = n_timesteps
+        self.solver = solver
+        self.stoc = stoc
+        steps = torch.linspace(0, 1, n_timesteps + 1, dtype=torch.float64)
+        if schedule == "uniform":
+            self.timesteps = (1.0 - steps).tolist()
+        elif schedule == "quadratic":
+            self.timesteps = ((1.0 - steps) ** 2).tolist()
+        else:
+            self.timesteps = self._logsnr_timesteps(steps)
+        if solver == "euler":
+            self.evaluation_times = [
+                0.5 * (t + t_next)
+                for t, t_next in zip(self.timesteps[:-1], self.timesteps[1:])
+            ]
+        elif solver == "heun":
+            self.evaluation_times = self.timesteps[:-1] + [
+                t for t in self.timesteps[1:] if t > 0
+            ]
+        else:
+            self.evaluation_times = self.timesteps[:-1]
+        self.n_function_evals = 0
+        self._previous = None
+        self._condition_inputs = None
+        self._condition = None
+        self._time_biases = None
+
+    def _noise(self, t, cumulative):
+        return get_noise(
+            t, self.diffusion.beta_min, self.diffusion.beta_max, cumulative=cumulative
+        )
+
+    def _score(self, xt, mask, mu, t, spk):
+        self.n_function_evals += 1
+        estimator = self.diffusion.estimator
+        if not isinstance(estimator, GradLogPEstimator2d):
+            t = t * torch.ones(xt.shape[0], dtype=xt.dtype, device=xt.device)
+            return estimator(xt, mask, mu, t, spk)
+        # NOTE: mask, mu and spk are the same for every step of a trajectory, and
+        # the times are known up front, so the conditioning of the estimator is
+        # computed once rather than at every step.
+        if self._condition_inputs is None or any(
+            a is not b for a, b in zip(self._condition_inputs, (mask, mu, spk))
+        ):
+            self._condition_inputs = (mask, mu, spk)
+            self._condition = estimator.condition(mask, mu, spk)
+        if self._time_biases is None:
+            times = sorted(set(self.evaluation_times))
+            biases = estimator.time_biases(
+                torch.tensor(times, dtype=xt.dtype, device=xt.device)
+            )
+            self._time_biases = {
+                time: [bias[k : k + 1] for bias in biases]
+                for k, time in enumerate(times)
+            }
+        time_biases = self._time_biases.get(t)
+        if time_biases is None:
+            time_biases = estimator.time_biases(
+                t * torch.ones(1, dtype=xt.dtype, device=xt.device)
+            )
+        return estimator.forward_conditioned(xt, self._condition, time_biases)
+
+    def _derivative(self, xt, mask, mu, t, spk):
+        """dx/dt of the probability flow ODE."""
+        score = self._score(xt, mask, mu, t, spk)
+        return 0.5 * self._noise(t, cumulative=False) * (mu - xt - score)
+
+    def _alpha_sigma(self, t):
+        cum_noise = self._noise(t, cumulative=True)
+        return math.exp(-0.5 * cum_noise), math.sqrt(1.0 - math.exp(-cum_noise))
+
+    def _logsnr_timesteps(self, steps):
+        alpha, sigma = self._alpha_sigma(1.0)
+        alpha_end, sigma_end = self._alpha_sigma(self.LOGSNR_END)
+        start, end = math.log(alpha / sigma), math.log(alpha_end / sigma_end)
+        lambdas = start + (end - start) * steps
+        # NOTE: invert lambda = log(alpha / sigma) for the cumulative noise, then
+        # cum_noise = beta_min * t + (beta_max - beta_min) * t ** 2 / 2 for t.
+        cum_noise = torch.log1p(torch.exp(-2 * lambdas))
+        beta_min, beta_max = self.diffusion.beta_min, self.diffusion.beta_max
+        t = (
+            torch.sqrt(beta_min**2 + 2 * (beta_max - beta_min) * cum_noise) - beta_min
+        ) / (beta_max - beta_min)
+        t[0], t[-1] = 1.0, self.LOGSNR_END
+        return t.tolist()
+
+    def step(self, i, xt, mask, mu, spk=None):
+        t, t_next = self.timesteps[i], self.timesteps[i + 1]
+        h = t - t_next
+        if self.solver == "euler":
+            t_mid = 0.5 * (t + t_next)
+            score = self._score(xt, mask, mu, t_mid, spk)
+            noise_t = self._noise(t_mid, cumulative=False)
+            if self.stoc:  # adds stochastic term
+                dxt_det = (0.5 * (mu - xt) - score) * noise_t * h
+                dxt_stoc = torch.randn(
+                    xt.shape, dtype=xt.dtype, device=xt.device, requires_grad=False
+                )
+                dxt = dxt_det + dxt_stoc * math.sqrt(noise_t * h)
+            else:
+                dxt = 0.5 * (mu - xt - score) * noise_t * h
+            return xt - dxt
+        if self.solver == "heun":
+            d = self._derivative(xt, mask, mu, t, spk)
+            x_euler = xt - h * d
+            if t_next == 0:
+                return x_euler
+            d_next = self._derivative(x_euler * mask, mask, mu, t_next, spk)
+            return xt - 0.5 * h * (d + d_next)
+        # NOTE: x - mu diffuses like a variance preserving SDE with
+        # alpha = exp(-cum_noise / 2), so DPM-Solver applies to it directly.
+        alpha, sigma = self._alpha_sigma(t)
+        score = self._score(xt, mask, mu, t, spk)
+        x0 = (xt - mu + sigma**2 * score) / alpha
+        if t_next == 0:
+            return mu + x0
+        alpha_next, sigma_next = self._alpha_sigma(t_next)
+        lambda_ = math.log(alpha / sigma)
+        lambda_next = math.log(alpha_next / sigma_next)
+        h = lambda_next - lambda_
+        if self._previous is None:
+            d = x0
+        else:
+            x0_previous, h_previous = self._previous
+            r = h_previous / h
+            d = (1 + 0.5 / r) * x0 - (0.5 / r) * x0_previous
+        self._previous = (x0, h)
+        return mu + (sigma_next / sigma) * (xt - mu) - alpha_next * math.expm1(-h) * d
+
+
 class Diffusion(BaseModule):
     def __init__(
         self,
@@ -298,6 +555,7 @@ class Diffusion(BaseModule):
         beta_min=0.05,
         beta_max=20,
         pe_scale=1000,
+        mask_padding=False,
     ):
         super(Diffusion, self).__init__()
         self.n_feats = n_feats
@@ -309,7 +567,11 @@ class Diffusion(BaseModule):
         self.pe_scale = pe_scale
 
         self.estimator = GradLogPEstimator2d(
-            dim, n_spks=n_spks, spk_emb_dim=spk_emb_dim, pe_scale=pe_scale
+            dim,
+            n_spks=n_spks,
+            spk_emb_dim=spk_emb_dim,
+            pe_scale=pe_scale,
+            mask_padding=mask_padding,
         )
 
     def forward_diffusion(self, x0, mask, mu, t):
@@ -324,39 +586,47 @@ class Diffusion(BaseModule):
         return xt * mask, z * mask
 
     @torch.no_grad()
-    def reverse_diffusion(self, z, mask, mu, n_timesteps, stoc=False, spk=None):
-        h = 1.0 / n_timesteps
+    def reverse_diffusion(
+        self,
+        z,
+        mask,
+        mu,
+        n_timesteps,
+        stoc=False,
+        spk=None,
+        solver="euler",
+        schedule="uniform",
+    ):
+        ode_solver = DiffusionODESolver(self, n_timesteps, solver, schedule, stoc)
         xt = z * mask
         for i in range(n_timesteps):
-            t = (1.0 - (i + 0.5) * h) * torch.ones(
-                z.shape[0], dtype=z.dtype, device=z.device
-            )
-            time = t.unsqueeze(-1).unsqueeze(-1)
-            noise_t = get_noise(time, self.beta_min, self.beta_max, cumulative=False)
-            if stoc:  # adds stochastic term
-                dxt_det = 0.5 * (mu - xt) - self.estimator(xt, mask, mu, t, spk)
-                dxt_det = dxt_det * noise_t * h
-                dxt_stoc = torch.randn(
-                    z.shape, dtype=z.dtype, device=z.device, requires_grad=False
-                )
-                dxt_stoc = dxt_stoc * torch.sqrt(noise_t * h)
-                dxt = dxt_det + dxt_stoc
-            else:
-                dxt = 0.5 * (mu - xt - self.estimator(xt, mask, mu, t, spk))
-                dxt = dxt * noise_t * h
-            xt = (xt - dxt) * mask
+            xt = ode_solver.step(i, xt, mask, mu, spk) * mask
         return xt
 
     @torch.no_grad()
-    def forward(self, z, mask, mu, n_timesteps, stoc=False, spk=None):
-        return self.reverse_diffusion(z, mask, mu, n_timesteps, stoc, spk)
+    def forward(
+        self,
+        z,
+        mask,
+        mu,
+        n_timesteps,
+        stoc=False,
+        spk=None,
+        solver="euler",
+        schedule="uniform",
+    ):
+        return self.reverse_diffusion(
+            z, mask, mu, n_timesteps, stoc, spk, solver, schedule
+        )
 
     def loss_t(self, x0, mask, mu, t, spk=None):
         xt, z = self.forward_diffusion(x0, mask, mu, t)
         time = t.unsqueeze(-1).unsqueeze(-1)
         cum_noise = get_noise(time, self.beta_min, self.beta_max, cumulative=True)
-        noise_estimation = self.estimator(xt, mask, mu, t, spk)
-        noise_estimation *= torch.sqrt(1.0 - torch.exp(-cum_noise))
+        # NOTE: the estimator may run in reduced precision under autocast, but the
+        # loss is reduced in float32.
+        noise_estimation = self.estimator(xt, mask, mu, t, spk).float()
+        noise_estimation = noise_estimation * torch.sqrt(1.0 - torch.exp(-cum_noise))
         loss = torch.sum((noise_estimation + z) ** 2) / (torch.sum(mask) * self.n_feats)
         return loss, xt
 
@@ -528,7 +798,10 @@ class DurationPredictor(BaseModule):
         return x * x_mask
 
 
-class MultiHeadAttention(BaseModule):
+class MultiHeadAttention(VITSMultiHeadAttention, BaseModule):
+    """The multi-head attention of models.attentions, with GradTTS's argument
+    order."""
+
     def __init__(
         self,
         channels,
@@ -540,144 +813,16 @@ class MultiHeadAttention(BaseModule):
         proximal_bias=False,
         proximal_init=False,
     ):
-        super(MultiHeadAttention, self).__init__()
-        assert channels % n_heads == 0
-
-        self.channels = channels
-        self.out_channels = out_channels
-        self.n_heads = n_heads
-        self.window_size = window_size
-        self.heads_share = heads_share
-        self.proximal_bias = proximal_bias
-        self.p_dropout = p_dropout
-        self.attn = None
-
-        self.k_channels = channels // n_heads
-        self.conv_q = torch.nn.Conv1d(channels, channels, 1)
-        self.conv_k = torch.nn.Conv1d(channels, channels, 1)
-        self.conv_v = torch.nn.Conv1d(channels, channels, 1)
-        if window_size is not None:
-            n_heads_rel = 1 if heads_share else n_heads
-            rel_stddev = self.k_channels**-0.5
-            self.emb_rel_k = torch.nn.Parameter(
-                torch.randn(n_heads_rel, window_size * 2 + 1, self.k_channels)
-                * rel_stddev
-            )
-            self.emb_rel_v = torch.nn.Parameter(
-                torch.randn(n_heads_rel, window_size * 2 + 1, self.k_channels)
-                * rel_stddev
-            )
-        self.conv_o = torch.nn.Conv1d(channels, out_channels, 1)
-        self.drop = torch.nn.Dropout(p_dropout)
-
-        torch.nn.init.xavier_uniform_(self.conv_q.weight)
-        torch.nn.init.xavier_uniform_(self.conv_k.weight)
-        if proximal_init:
-            self.conv_k.weight.data.copy_(self.conv_q.weight.data)
-            self.conv_k.bias.data.copy_(self.conv_q.bias.data)
-        torch.nn.init.xavier_uniform_(self.conv_v.weight)
-
-    def forward(self, x, c, attn_mask=None):
-        q = self.conv_q(x)
-        k = self.conv_k(c)
-        v = self.conv_v(c)
-
-        x, self.attn = self.attention(q, k, v, mask=attn_mask)
-
-        x = self.conv_o(x)
-        return x
-
-    def attention(self, query, key, value, mask=None):
-        b, d, t_s, t_t = (*key.size(), query.size(2))
-        query = query.view(b, self.n_heads, self.k_channels, t_t).transpose(2, 3)
-        key = key.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
-        value = value.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
-
-        scores = torch.matmul(query, key.transpose(-2, -1)) / math.sqrt(self.k_channels)
-        if self.window_size is not None:
-            assert (
-                t_s == t_t
-            ), "Relative attention is only available for self-attention."
-            key_relative_embeddings = self._get_relative_embeddings(self.emb_rel_k, t_s)
-            rel_logits = self._matmul_with_relative_keys(query, key_relative_embeddings)
-            rel_logits = self._relative_position_to_absolute_position(rel_logits)
-            scores_local = rel_logits / math.sqrt(self.k_channels)
-            scores = scores + scores_local
-        if self.proximal_bias:
-            assert t_s == t_t, "Proximal bias is only available for self-attention."
-            scores = scores + self._attention_bias_proximal(t_s).to(
-                device=scores.device, dtype=scores.dtype
-            )
-        if mask is not None:
-            scores = scores.masked_fill(mask == 0, -1e4)
-        p_attn = torch.nn.functional.softmax(scores, dim=-1)
-        p_attn = self.drop(p_attn)
-        output = torch.matmul(p_attn, value)
-        if self.window_size is not None:
-            relative_weights = self._absolute_position_to_relative_position(p_attn)
-            value_relative_embeddings = self._get_relative_embeddings(
-                self.emb_rel_v, t_s
-            )
-            output = output + self._matmul_with_relative_values(
-                relative_weights, value_relative_embeddings
-            )
-        output = output.transpose(2, 3).contiguous().view(b, d, t_t)
-        return output, p_attn
-
-    def _matmul_with_relative_values(self, x, y):
-        ret = torch.matmul(x, y.unsqueeze(0))
-        return ret
-
-    def _matmul_with_relative_keys(self, x, y):
-        ret = torch.matmul(x, y.unsqueeze(0).transpose(-2, -1))
-        return ret
-
-    def _get_relative_embeddings(self, relative_embeddings, length):
-        pad_length = max(length - (self.window_size + 1), 0)
-        slice_start_position = max((self.window_size + 1) - length, 0)
-        slice_end_position = slice_start_position + 2 * length - 1
-        if pad_length > 0:
-            padded_relative_embeddings = torch.nn.functional.pad(
-                relative_embeddings,
-                convert_pad_shape([[0, 0], [pad_length, pad_length], [0, 0]]),
-            )
-        else:
-            padded_relative_embeddings = relative_embeddings
-        used_relative_embeddings = padded_relative_embeddings[
-            :, slice_start_position:slice_end_position
-        ]
-        return used_relative_embeddings
-
-    def _relative_position_to_absolute_position(self, x):
-        batch, heads, length, _ = x.size()
-        x = torch.nn.functional.pad(
-            x, convert_pad_shape([[0, 0], [0, 0], [0, 0], [0, 1]])
-        )
-        x_flat = x.view([batch, heads, length * 2 * length])
-        x_flat = torch.nn.functional.pad(
-            x_flat, convert_pad_shape([[0, 0], [0, 0], [0, length - 1]])
-        )
-        x_final = x_flat.view([batch, heads, length + 1, 2 * length - 1])[
-            :, :, :length, length - 1 :
-        ]
-        return x_final
-
-    def _absolute_position_to_relative_position(self, x):
-        batch, heads, length, _ = x.size()
-        x = torch.nn.functional.pad(
-            x, convert_pad_shape([[0, 0], [0, 0], [0, 0], [0, length - 1]])
-        )
-        x_flat = x.view([batch, heads, length**2 + length * (length - 1)])
-        x_flat = torch.nn.functional.pad(
-            x_flat, convert_pad_shape([[0, 0], [0, 0], [length, 0]])
+        super(MultiHeadAttention, self).__init__(
+            channels,
+            out_channels,
+            n_heads,
+            p_dropout=p_dropout,
+            window_size=window_size,
+            heads_share=heads_share,
+            proximal_bias=proximal_bias,
+            proximal_init=proximal_init,
         )
-        x_final = x_flat.view([batch, heads, length, 2 * length])[:, :, :, 1:]
-        return x_final
-
-    def _attention_bias_proximal(self, length):
-        r = torch.arange(length, dtype=torch.float32)
-        diff = torch.unsqueeze(r, 0) - torch.unsqueeze(r, 1)
-        return torch.unsqueeze(torch.unsqueeze(-torch.log1p(torch.abs(diff)), 0), 0)
 
 
 class FFN(BaseModule):
@@ -872,6 +1017,13 @@ class GradTTS(TTSModel):
         self.pe_scale = hparams.pe_scale
         self.hop_length = hparams.hop_length
         self.sampling_rate = hparams.sampling_rate
+        self.mas_band_width = hparams.mas_band_width
+        self.mas_backend = hparams.mas_backend
+        self.mask_decoder_padding = hparams.mask_decoder_padding
+        if self.mas_backend not in ("cython", "torch"):
+            raise Exception(f"Unknown mas_backend: {self.mas_backend}")
+        if self.mas_backend == "torch" and self.mas_band_width is not None:
+            raise Exception("mas_band_width requires mas_backend=cython")
         # NOTE(zach): Parametrize this later
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
 
@@ -897,6 +1049,7 @@ class GradTTS(TTSModel):
             self.beta_min,
             self.beta_max,
             self.pe_scale,
+            mask_padding=self.mask_decoder_padding,
         )
 
     @property
@@ -930,6 +1083,8 @@ class GradTTS(TTSModel):
         stoc=False,
         spk=None,
         length_scale=1.0,
+        solver="euler",
+        schedule="uniform",
     ):
         """
         Generates mel-spectrogram from text. Returns:
@@ -946,6 +1101,10 @@ class GradTTS(TTSModel):
                 Usually, does not provide synthesis improvements.
             length_scale (float, optional): controls speech pace.
                 Increase value to slow down generated speech and vice versa.
+            solver (str, optional): reverse diffusion solver, "euler", "heun" or "dpm".
+                See DiffusionODESolver. "heun" and "dpm" need far fewer n_timesteps.
+            schedule (str, optional): spacing of the timesteps, "uniform", "quadratic"
+                or "logsnr". See DiffusionODESolver.
         """
         x, x_lengths = self.relocate_input([x, x_lengths])
 
@@ -974,7 +1133,9 @@ class GradTTS(TTSModel):
         # Sample latent representation from terminal distribution N(mu_y, I)
         z = mu_y + torch.randn_like(mu_y, device=mu_y.device) / temperature
         # Generate sample by performing reverse dynamics
-        decoder_outputs = self.decoder(z, y_mask, mu_y, n_timesteps, stoc, spk)
+        decoder_outputs = self.decoder(
+            z, y_mask, mu_y, n_timesteps, stoc, spk, solver, schedule
+        )
         decoder_outputs = decoder_outputs[:, :, :y_max_length]
 
         return encoder_outputs, decoder_outputs, attn[:, :, :y_max_length]
@@ -991,30 +1152,106 @@ class GradTTS(TTSModel):
         length_scale=1.0,
         intersperse_text=True,
         intersperse_token=148,
+        solver="euler",
+        schedule="uniform",
+        batch_size=None,
     ):
-        seq = text_to_sequence(
-            text, cleaner_names=cleaner_names, p_arpabet=1.0, symbol_set="gradtts"
-        )
-        if intersperse_text:
-            x = torch.LongTensor(intersperse(seq, intersperse_token))[None]
-        else:
-            x = torch.LongTensor(seq)[None]
+        """
+        Generates mel-spectrograms from a text or a list of texts.
 
-        x_lengths = torch.LongTensor([x.shape[-1]])
-        if self.device == "cuda":
-            x = x.cuda()
-            x_lengths = x_lengths.cuda()
+        For a single text returns the encoder outputs, decoder outputs and alignment,
+        each with a batch dimension of 1. For a list of texts returns a list of
+        these, one per text; see infer_sequences. spk is a speaker id, or a list of
+        them for a list of texts. solver ("euler", "heun" or "dpm") and schedule
+        ("uniform", "quadratic" or "logsnr") are as for forward.
+        """
+        texts = [text] if isinstance(text, str) else text
+        sequences = []
+        for text_ in texts:
+            seq = text_to_sequence(
+                text_, cleaner_names=cleaner_names, p_arpabet=1.0, symbol_set="gradtts"
+            )
+            if intersperse_text:
+                seq = intersperse(seq, intersperse_token)
+            sequences.append(seq)
 
-        y_enc, y_dec, attn = self.forward(
-            x,
-            x_lengths,
-            n_timesteps=n_timesteps,
+        outputs = self.infer_sequences(
+            sequences,
+            n_timesteps,
             temperature=temperature,
             stoc=stoc,
             spk=spk,
             length_scale=length_scale,
+            solver=solver,
+            schedule=schedule,
+            batch_size=batch_size,
         )
-        return y_enc, y_dec, attn
+        if isinstance(text, str):
+            return outputs[0]
+        return outputs
+
+    @torch.no_grad()
+    def infer_sequences(
+        self,
+        sequences,
+        n_timesteps,
+        temperature=1.0,
+        stoc=False,
+        spk=None,
+        length_scale=1.0,
+        solver="euler",
+        schedule="uniform",
+        batch_size=None,
+    ):
+        """
+        Generates mel-spectrograms for a list of symbol id sequences in batches.
+
+        The sequences are sorted by length and split into batches of batch_size
+        (by default, a single batch), so that each batch is padded as little as
+        possible, and the reverse diffusion runs once per batch. Returns a list of
+        (encoder outputs, decoder outputs, alignment) in the order of sequences,
+        each trimmed to the length of its sequence and mel and with a batch
+        dimension of 1. solver ("euler", "heun" or "dpm") and schedule ("uniform",
+        "quadratic" or "logsnr") are as for forward. Only with the
+        mask_decoder_padding hparam are the outputs the same as for each sequence
+        on its own; otherwise the decoder's norms and attention also see the
+        padding.
+        """
+        device = next(self.parameters()).device
+        if spk is not None:
+            spk = torch.as_tensor(spk, dtype=torch.long, device=device).reshape(-1)
+            if len(spk) == 1:
+                spk = spk.expand(len(sequences))
+        order = sorted(range(len(sequences)), key=lambda i: -len(sequences[i]))
+        batch_size = batch_size or len(sequences)
+        outputs = [None] * len(sequences)
+        for start in range(0, len(order), batch_size):
+            idx = order[start : start + batch_size]
+            x = torch.nn.utils.rnn.pad_sequence(
+                [torch.LongTensor(sequences[i]) for i in idx], batch_first=True
+            ).to(device)
+            x_lengths = torch.LongTensor([len(sequences[i]) for i in idx]).to(device)
+            y_enc, y_dec, attn = self.forward(
+                x,
+                x_lengths,
+                n_timesteps=n_timesteps,
+                temperature=temperature,
+                stoc=stoc,
+                spk=None if spk is None else spk[idx],
+                length_scale=length_scale,
+                solver=solver,
+                schedule=schedule,
+            )
+            # NOTE: the alignment assigns each frame of a mel to exactly one symbol.
+            y_lengths = attn.sum([1, 2, 3]).long().tolist()
+            for b, i in enumerate(idx):
+                x_length, y_length = len(sequences[i]), y_lengths[b]
+                outputs[i] = (
+                    y_enc[b : b + 1, :, :y_length],
+                    y_dec[b : b + 1, :, :y_length],
+                    attn[b : b + 1, :, :x_length, :y_length],
+                )
+        return outputs
 
     def compute_loss(self, x, x_lengths, y, y_lengths, spk=None, out_size=None):
         """
@@ -1044,20 +1281,35 @@ class GradTTS(TTSModel):
         y_mask = sequence_mask(y_lengths, y_max_length).unsqueeze(1).to(x_mask)
         attn_mask = x_mask.unsqueeze(-1) * y_mask.unsqueeze(2)
 
-        # Use MAS to find most likely alignment `attn` between text and mel-spectrogram
-        with torch.no_grad():
+        # Use MAS to find most likely alignment `attn` between text and mel-spectrogram.
+        # The log-prior is computed in float32, even under autocast.
+        with torch.no_grad(), torch.autocast(y.device.type, enabled=False):
+            mu_x_f32 = mu_x.float()
             const = -0.5 * math.log(2 * math.pi) * self.n_feats
-            factor = -0.5 * torch.ones(mu_x.shape, dtype=mu_x.dtype, device=mu_x.device)
+            factor = -0.5 * torch.ones(
+                mu_x_f32.shape, dtype=mu_x_f32.dtype, device=mu_x_f32.device
+            )
             y_square = torch.matmul(factor.transpose(1, 2), y**2)
-            y_mu_double = torch.matmul(2.0 * (factor * mu_x).transpose(1, 2), y)
-            mu_square = torch.sum(factor * (mu_x**2), 1).unsqueeze(-1)
+            y_mu_double = torch.matmul(2.0 * (factor * mu_x_f32).transpose(1, 2), y)
+            mu_square = torch.sum(factor * (mu_x_f32**2), 1).unsqueeze(-1)
             log_prior = y_square - y_mu_double + mu_square + const
-            attn = monotonic_align.maximum_path_gradtts(log_prior, attn_mask.squeeze(1))
+            if self.mas_backend == "torch":
+                attn = monotonic_align.maximum_path_gradtts_torch(
+                    log_prior, attn_mask.squeeze(1)
+                )
+            elif self.mas_band_width is None:
+                attn = monotonic_align.maximum_path_gradtts(
+                    log_prior, attn_mask.squeeze(1)
+                )
+            else:
+                attn = monotonic_align.maximum_path_gradtts_banded(
+                    log_prior, attn_mask.squeeze(1), self.mas_band_width
+                )
             attn = attn.detach()
 
         # Compute loss between predicted log-scaled durations and those obtained from MAS
         logw_ = torch.log(1e-8 + torch.sum(attn.unsqueeze(1), -1)) * x_mask
-        dur_loss = duration_loss(logw, logw_, x_lengths)
+        dur_loss = duration_loss(logw.float(), logw_, x_lengths)
 
         # Cut a small segment of mel-spectrogram in order to increase batch size
         if not isinstance(out_size, type(None)):
@@ -1109,6 +1361,7 @@ class GradTTS(TTSModel):
         diff_loss, xt = self.decoder.compute_loss(y, y_mask, mu_y, spk)
 
         # Compute loss between aligned encoder outputs and mel-spectrogram
+        mu_y = mu_y.float()
         prior_loss = torch.sum(0.5 * ((y - mu_y) ** 2 + math.log(2 * math.pi)) * y_mask)
         prior_loss = prior_loss / (torch.sum(y_mask) * self.n_feats)
 
@@ -1121,6 +1374,7 @@ DEFAULTS = HParams(
     symbol_set="gradtts",
     intersperse_text=True,
     n_spks=1,
+    n_speakers=1,
     spk_emb_dim=64,
     sampling_rate=22050,
     hop_length=256,
@@ -1141,6 +1395,16 @@ DEFAULTS = HParams(
     n_epochs=10000,
     batch_size=1,
     learning_rate=1e-4,
+    fp16_run=False,
+    bf16_run=False,
+    # NOTE: search only this many tokens either side of the diagonal in MAS.
+    mas_band_width=None,
+    # NOTE: "torch" runs MAS on the model's device instead of the CPU.
+    mas_backend="cython",
+    # NOTE: exclude the padding from the decoder's GroupNorms and attention, so
+    # batched inference matches unbatched. This changes what the decoder computes,
+    # so checkpoints trained without it should keep it off.
+    mask_decoder_padding=False,
     seed=37,
     out_size=2 * 22050 // 256,
     filter_length=1024,
@@ -1153,6 +1417,11 @@ DEFAULTS = HParams(
     mel_fmax=8000,
     mel_fmin=0.0,
     checkpoint=None,
+    checkpoint_name="gradtts",
     log_interval=100,
     save_every=1000,
+    bucket_boundaries=[32, 300, 400, 500, 600, 700, 800, 900, 1000],
+    vocoder_algorithm="griffin-lim",
+    hifigan_config=None,
+    hifigan_checkpoint=None,
 )
\ No newline at end of file
@@ -743,6 +743,14 @@ class Mellotron(Tacotron2):
             output_lengths = to_gpu(output_lengths).long()
             speaker_ids = to_gpu(speaker_ids.data).long()
 
+        # NOTE: batches collated before a change of n_frames_per_step may not be
+        # padded to a multiple of the current value, so pad them here.
+        remainder = mel_padded.size(2) % self.n_frames_per_step_current
+        if remainder:
+            pad = self.n_frames_per_step_current - remainder
+            mel_padded = F.pad(mel_padded, (0, pad))
+            gate_padded = F.pad(gate_padded, (0, pad), value=1.0)
+
         max_len = torch.max(input_lengths.data).item()
 
         ret_x = [
@@ -784,6 +784,14 @@ class Tacotron2(TTSModel):
 
         self.gst_init(hparams)
 
+    def set_current_frames_per_step(self, n_frames: int):
+        if n_frames > self.n_frames_per_step_initial:
+            raise Exception(
+                f"n_frames_per_step ({n_frames}) cannot exceed n_frames_per_step_initial ({self.n_frames_per_step_initial})"
+            )
+        self.decoder.set_current_frames_per_step(n_frames)
+        self.n_frames_per_step_current = n_frames
+
     def gst_init(self, hparams):
         self.gst_lin = None
         self.gst_type = None
@@ -818,6 +826,14 @@ class Tacotron2(TTSModel):
             if embedded_gst is not None:
                 embedded_gst = to_gpu(embedded_gst).float()
 
+        # NOTE: batches collated before a change of n_frames_per_step may not be
+        # padded to a multiple of the current value, so pad them here.
+        remainder = mel_padded.size(2) % self.n_frames_per_step_current
+        if remainder:
+            pad = self.n_frames_per_step_current - remainder
+            mel_padded = F.pad(mel_padded, (0, pad))
+            gate_padded = F.pad(gate_padded, (0, pad), value=1.0)
+
         max_len = torch.max(input_lengths.data).item()
 
         ret_x = [
@@ -10,7 +10,6 @@ from torch.nn import functional as F
 
 import numpy as np
 
-
 DEFAULT_MIN_BIN_WIDTH = 1e-3
 DEFAULT_MIN_BIN_HEIGHT = 1e-3
 DEFAULT_MIN_DERIVATIVE = 1e-3
@@ -50,9 +49,13 @@ def piecewise_rational_quadratic_transform(
     return outputs, logabsdet
 
 
-def searchsorted(bin_locations, inputs, eps=1e-6):
-    bin_locations[..., -1] += eps
-    return torch.sum(inputs[..., None] >= bin_locations, dim=-1) - 1
+def searchsorted(bin_locations, inputs):
+    """The bin of bin_locations [..., num_bins + 1] that each of inputs [...] is
+    in, with the right edge counted in the last bin."""
+    bin_idx = torch.searchsorted(
+        bin_locations, inputs[..., None].to(bin_locations.dtype), right=True
+    )[..., 0]
+    return (bin_idx - 1).clamp(0, bin_locations.shape[-1] - 2)
 
 
 def unconstrained_rational_quadratic_spline(
@@ -67,31 +70,23 @@ def unconstrained_rational_quadratic_spline(
     min_bin_height=DEFAULT_MIN_BIN_HEIGHT,
     min_derivative=DEFAULT_MIN_DERIVATIVE,
 ):
-    inside_interval_mask = (inputs >= -tail_bound) & (inputs <= tail_bound)
-    outside_interval_mask = ~inside_interval_mask
-
-    outputs = torch.zeros_like(inputs)
-    logabsdet = torch.zeros_like(inputs)
-
     if tails == "linear":
-        unnormalized_derivatives = F.pad(unnormalized_derivatives, pad=(1, 1))
         constant = np.log(np.exp(1 - min_derivative) - 1)
-        unnormalized_derivatives[..., 0] = constant
-        unnormalized_derivatives[..., -1] = constant
-
-        outputs[outside_interval_mask] = inputs[outside_interval_mask]
-        logabsdet[outside_interval_mask] = 0
+        unnormalized_derivatives = F.pad(
+            unnormalized_derivatives, pad=(1, 1), value=constant
+        )
     else:
         raise RuntimeError(f"{tails} tails are not implemented.")
 
-    (
-        outputs[inside_interval_mask],
-        logabsdet[inside_interval_mask],
-    ) = rational_quadratic_spline(
-        inputs=inputs[inside_interval_mask],
-        unnormalized_widths=unnormalized_widths[inside_interval_mask, :],
-        unnormalized_heights=unnormalized_heights[inside_interval_mask, :],
-        unnormalized_derivatives=unnormalized_derivatives[inside_interval_mask, :],
+    # NOTE: transform every input, with those outside the interval replaced by 0,
+    # and keep the identity outside it, rather than indexing out the inputs inside
+    # the interval, which syncs with the device and copies every parameter tensor.
+    inside_interval_mask = (inputs >= -tail_bound) & (inputs <= tail_bound)
+    outputs, logabsdet = rational_quadratic_spline(
+        inputs=inputs.masked_fill(~inside_interval_mask, 0),
+        unnormalized_widths=unnormalized_widths,
+        unnormalized_heights=unnormalized_heights,
+        unnormalized_derivatives=unnormalized_derivatives,
         inverse=inverse,
         left=-tail_bound,
         right=tail_bound,
@@ -101,6 +96,8 @@ def unconstrained_rational_quadratic_spline(
         min_bin_height=min_bin_height,
         min_derivative=min_derivative,
     )
+    outputs = torch.where(inside_interval_mask, outputs, inputs)
+    logabsdet = logabsdet.masked_fill(~inside_interval_mask, 0)
 
     return outputs, logabsdet
 
@@ -119,7 +116,8 @@ def rational_quadratic_spline(
     min_bin_height=DEFAULT_MIN_BIN_HEIGHT,
     min_derivative=DEFAULT_MIN_DERIVATIVE,
 ):
-    if torch.min(inputs) < left or torch.max(inputs) > right:
+    lowest, highest = torch.aminmax(inputs)
+    if lowest < left or highest > right:
         raise ValueError("Input to a transform is not within its domain")
 
     num_bins = unnormalized_widths.shape[-1]
@@ -136,7 +134,6 @@ def rational_quadratic_spline(
     cumwidths = (right - left) * cumwidths + left
     cumwidths[..., 0] = left
     cumwidths[..., -1] = right
-    widths = cumwidths[..., 1:] - cumwidths[..., :-1]
 
     derivatives = min_derivative + F.softplus(unnormalized_derivatives)
 
@@ -147,33 +144,38 @@ def rational_quadratic_spline(
     cumheights = (top - bottom) * cumheights + bottom
     cumheights[..., 0] = bottom
     cumheights[..., -1] = top
-    heights = cumheights[..., 1:] - cumheights[..., :-1]
 
     if inverse:
         bin_idx = searchsorted(cumheights, inputs)[..., None]
     else:
         bin_idx = searchsorted(cumwidths, inputs)[..., None]
+    # NOTE: only the bin of each input is needed, so gather both of its edges
+    # rather than computing the widths, heights and slopes of every bin.
+    bin_edges = torch.cat([bin_idx, bin_idx + 1], dim=-1)
 
-    input_cumwidths = cumwidths.gather(-1, bin_idx)[..., 0]
-    input_bin_widths = widths.gather(-1, bin_idx)[..., 0]
-
-    input_cumheights = cumheights.gather(-1, bin_idx)[..., 0]
-    delta = heights / widths
-    input_delta = delta.gather(-1, bin_idx)[..., 0]
+    input_cumwidths, input_cumwidths_plus_one = cumwidths.gather(-1, bin_edges).unbind(
+        -1
+    )
+    input_bin_widths = input_cumwidths_plus_one - input_cumwidths
 
-    input_derivatives = derivatives.gather(-1, bin_idx)[..., 0]
-    input_derivatives_plus_one = derivatives[..., 1:].gather(-1, bin_idx)[..., 0]
+    input_cumheights, input_cumheights_plus_one = cumheights.gather(
+        -1, bin_edges
+    ).unbind(-1)
+    input_heights = input_cumheights_plus_one - input_cumheights
+    input_delta = input_heights / input_bin_widths
 
-    input_heights = heights.gather(-1, bin_idx)[..., 0]
+    input_derivatives, input_derivatives_plus_one = derivatives.gather(
+        -1, bin_edges
+    ).unbind(-1)
+    input_slopes = input_derivatives + input_derivatives_plus_one - 2 * input_delta
 
     if inverse:
-        a = (inputs - input_cumheights) * (
-            input_derivatives + input_derivatives_plus_one - 2 * input_delta
-        ) + input_heights * (input_delta - input_derivatives)
-        b = input_heights * input_derivatives - (inputs - input_cumheights) * (
-            input_derivatives + input_derivatives_plus_one - 2 * input_delta
+        input_offsets = inputs - input_cumheights
+        a = input_offsets * input_slopes + input_heights * (
+            input_delta - input_derivatives
         )
-        c = -input_delta * (inputs - input_cumheights)
+        b = input_heights * input_derivatives - input_offsets * input_slopes
+        c = -input_delta * input_offsets
 
         discriminant = b.pow(2) - 4 * a * c
         assert (discriminant >= 0).all()
@@ -182,10 +184,7 @@ def rational_quadratic_spline(
         outputs = root * input_bin_widths + input_cumwidths
 
         theta_one_minus_theta = root * (1 - root)
-        denominator = input_delta + (
-            (input_derivatives + input_derivatives_plus_one - 2 * input_delta)
-            * theta_one_minus_theta
-        )
+        denominator = input_delta + input_slopes * theta_one_minus_theta
         derivative_numerator = input_delta.pow(2) * (
             input_derivatives_plus_one * root.pow(2)
             + 2 * input_delta * theta_one_minus_theta
@@ -201,10 +200,7 @@ def rational_quadratic_spline(
         numerator = input_heights * (
             input_delta * theta.pow(2) + input_derivatives * theta_one_minus_theta
         )
-        denominator = input_delta + (
-            (input_derivatives + input_derivatives_plus_one - 2 * input_delta)
-            * theta_one_minus_theta
-        )
+        denominator = input_delta + input_slopes * theta_one_minus_theta
         outputs = input_cumheights + numerator / denominator
 
         derivative_numerator = input_delta.pow(2) * (
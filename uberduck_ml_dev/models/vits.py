@@ -24,11 +24,14 @@ DEFAULTS = HParams(
     upsample_kernel_sizes=[16, 16, 4, 4],
     upsample_rates=[8, 8, 2, 2],
     use_spectral_norm=False,
+    mas_band_width=None,
+    mas_backend="cython",
 )
 
 # Cell
 import copy
 import math
+import numpy as np
 import torch
 from torch import nn
 from torch.nn import functional as F
@@ -57,6 +60,7 @@ from ..utils.utils import (
     init_weights,
     get_padding,
     rand_slice_segments,
+    slice_segments,
     generate_path,
 )
 
@@ -392,27 +396,61 @@ class Generator(torch.nn.Module):
         if gin_channels != 0:
             self.cond = nn.Conv1d(gin_channels, upsample_initial_channel, 1)
 
-    def forward(self, x, g=None):
+    def forward(self, x, g=None, x_mask=None):
+        """x_mask [b, 1, t] zeroes each convolution's input past the end of each
+        item, so that items in a padded batch decode as they would on their own."""
         x = self.conv_pre(x)
         if g is not None:
             x = x + self.cond(g)
 
         for i in range(self.num_upsamples):
             x = F.leaky_relu(x, LRELU_SLOPE)
+            if x_mask is not None:
+                x = x * x_mask
+                x_mask = x_mask.repeat_interleave(self.ups[i].stride[0], 2)
             x = self.ups[i](x)
             xs = None
             for j in range(self.num_kernels):
                 if xs is None:
-                    xs = self.resblocks[i * self.num_kernels + j](x)
+                    xs = self.resblocks[i * self.num_kernels + j](x, x_mask)
                 else:
-                    xs += self.resblocks[i * self.num_kernels + j](x)
+                    xs += self.resblocks[i * self.num_kernels + j](x, x_mask)
             x = xs / self.num_kernels
         x = F.leaky_relu(x)
+        if x_mask is not None:
+            x = x * x_mask
         x = self.conv_post(x)
         x = torch.tanh(x)
 
         return x
 
+    def receptive_field(self):
+        """Input frames either side of a frame that its output samples depend on."""
+        frames = self.conv_pre.dilation[0] * (self.conv_pre.kernel_size[0] - 1) / 2
+        hop = 1
+        for i, up in enumerate(self.ups):
+            # NOTE: a transposed convolution reads kernel_size / stride inputs.
+            frames += up.kernel_size[0] / up.stride[0] / hop
+            hop *= up.stride[0]
+            resblocks = self.resblocks[
+                i * self.num_kernels : (i + 1) * self.num_kernels
+            ]
+            frames += (
+                max(
+                    sum(
+                        c.dilation[0] * (c.kernel_size[0] - 1) / 2
+                        for c in resblock.modules()
+                        if isinstance(c, nn.Conv1d)
+                    )
+                    for resblock in resblocks
+                )
+                / hop
+            )
+        frames += (
+            self.conv_post.dilation[0] * (self.conv_post.kernel_size[0] - 1) / 2 / hop
+        )
+        return math.ceil(frames)
+
     def remove_weight_norm(self):
         print("Removing weight norm...")
         for l in self.ups:
@@ -583,7 +621,9 @@ class SynthesizerTrn(nn.Module):
         n_speakers=0,
         gin_channels=0,
         use_sdp=True,
-        **kwargs
+        mas_band_width=None,
+        mas_backend="cython",
+        **kwargs,
     ):
 
         super().__init__()
@@ -607,6 +647,12 @@ class SynthesizerTrn(nn.Module):
         self.gin_channels = gin_channels
 
         self.use_sdp = use_sdp
+        self.mas_band_width = mas_band_width
+        self.mas_backend = mas_backend
+        if mas_backend not in ("cython", "torch"):
+            raise Exception(f"Unknown mas_backend: {mas_backend}")
+        if mas_backend == "torch" and mas_band_width is not None:
+            raise Exception("mas_band_width requires mas_backend=cython")
 
         self.enc_p = TextEncoder(
             n_vocab,
@@ -653,8 +699,9 @@ class SynthesizerTrn(nn.Module):
         if n_speakers > 1:
             self.emb_g = nn.Embedding(n_speakers, gin_channels)
 
-    def forward(self, x, x_lengths, y, y_lengths, sid=None):
-        """SynthesizerTrn forward pass"""
+    def forward(self, x, x_lengths, y, y_lengths, sid=None, ids_slice=None):
+        """SynthesizerTrn forward pass. ids_slice is the first frame of the segment
+        of each item to decode, random by default."""
         x, m_p, logs_p, x_mask = self.enc_p(x, x_lengths)
         if self.n_speakers > 0:
             g = self.emb_g(sid).unsqueeze(-1)  # [b, h, 1]
@@ -682,11 +729,17 @@ class SynthesizerTrn(nn.Module):
             neg_cent = neg_cent1 + neg_cent2 + neg_cent3 + neg_cent4
 
             attn_mask = torch.unsqueeze(x_mask, 2) * torch.unsqueeze(y_mask, -1)
-            attn = (
-                monotonic_align.maximum_path(neg_cent, attn_mask.squeeze(1))
-                .unsqueeze(1)
-                .detach()
-            )
+            if self.mas_backend == "torch":
+                attn = monotonic_align.maximum_path_torch(
+                    neg_cent, attn_mask.squeeze(1)
+                )
+            elif self.mas_band_width is None:
+                attn = monotonic_align.maximum_path(neg_cent, attn_mask.squeeze(1))
+            else:
+                attn = monotonic_align.maximum_path_banded(
+                    neg_cent, attn_mask.squeeze(1), self.mas_band_width
+                )
+            attn = attn.unsqueeze(1).detach()
 
         w = attn.sum(2)
         if self.use_sdp:
@@ -703,7 +756,10 @@ class SynthesizerTrn(nn.Module):
         m_p = torch.matmul(attn.squeeze(1), m_p.transpose(1, 2)).transpose(1, 2)
         logs_p = torch.matmul(attn.squeeze(1), logs_p.transpose(1, 2)).transpose(1, 2)
 
-        z_slice, ids_slice = rand_slice_segments(z, y_lengths, self.segment_size)
+        if ids_slice is None:
+            z_slice, ids_slice = rand_slice_segments(z, y_lengths, self.segment_size)
+        else:
+            z_slice = slice_segments(z, ids_slice, self.segment_size)
         o = self.dec(z_slice, g=g)
         return (
             o,
@@ -724,6 +780,60 @@ class SynthesizerTrn(nn.Module):
         length_scale=1,
         noise_scale_w=1.0,
         max_len=None,
+    ):
+        z, g, attn, y_mask, latents = self._infer_latent(
+            x, x_lengths, sid, noise_scale, length_scale, noise_scale_w
+        )
+        o = self.dec((z * y_mask)[:, :, :max_len], g=g)
+        return o, attn, y_mask, latents
+
+    def infer_stream(
+        self,
+        x,
+        x_lengths,
+        sid=None,
+        noise_scale=1,
+        length_scale=1,
+        noise_scale_w=1.0,
+        max_len=None,
+        chunk_frames=32,
+        context_frames=None,
+        crossfade_frames=2,
+    ):
+        """Like infer, but yield the waveform [b, 1, t] in chunks of chunk_frames
+        frames as soon as each one is decoded, rather than all of it at the end.
+
+        Each chunk is decoded with context_frames frames of latent either side,
+        which defaults to the decoder's receptive field, so that the chunks join
+        up to infer's waveform. Neighbouring chunks overlap by crossfade_frames,
+        which are crossfaded linearly to hide the seam a shorter context leaves.
+        """
+        z, g, _, y_mask, _ = self._infer_latent(
+            x, x_lengths, sid, noise_scale, length_scale, noise_scale_w
+        )
+        z = (z * y_mask)[:, :, :max_len]
+        if context_frames is None:
+            context_frames = self.dec.receptive_field()
+        hop = int(np.prod(self.upsample_rates))
+        ramp = torch.linspace(0, 1, crossfade_frames * hop + 2, device=z.device)[1:-1]
+        n_frames = z.shape[2]
+        tail = None
+        for start in range(0, n_frames, chunk_frames):
+            end = min(start + chunk_frames + crossfade_frames, n_frames)
+            window_start = max(start - context_frames, 0)
+            window_end = min(end + context_frames, n_frames)
+            o = self.dec(z[:, :, window_start:window_end], g=g)
+            o = o[:, :, (start - window_start) * hop : (end - window_start) * hop]
+            if tail is not None:
+                o[:, :, : len(ramp)] = tail * (1 - ramp) + o[:, :, : len(ramp)] * ramp
+            if end == n_frames:
+                yield o
+                return
+            tail = o[:, :, chunk_frames * hop :]
+            yield o[:, :, : chunk_frames * hop]
+
+    def _infer_latent(
+        self, x, x_lengths, sid, noise_scale, length_scale, noise_scale_w
     ):
         x, m_p, logs_p, x_mask = self.enc_p(x, x_lengths)
         if self.n_speakers > 0:
@@ -751,15 +861,18 @@ class SynthesizerTrn(nn.Module):
 
         z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
         z = self.flow(z_p, y_mask, g=g, reverse=True)
-        o = self.dec((z * y_mask)[:, :, :max_len], g=g)
-        return o, attn, y_mask, (z, z_p, m_p, logs_p)
+        return z, g, attn, y_mask, (z, z_p, m_p, logs_p)
 
-    def voice_conversion(self, y, y_lengths, sid_src, sid_tgt):
+    def voice_conversion(self, y, y_lengths, sid_src, sid_tgt, noise_scale=1.0):
+        """Convert a batch of spectrograms y [b, spec_channels, t] from speakers
+        sid_src [b] to speakers sid_tgt [b]. Items are masked to y_lengths, so
+        each converts as it would on its own."""
         assert self.n_speakers > 0, "n_speakers have to be larger than 0."
         g_src = self.emb_g(sid_src).unsqueeze(-1)
         g_tgt = self.emb_g(sid_tgt).unsqueeze(-1)
         z, m_q, logs_q, y_mask = self.enc_q(y, y_lengths, g=g_src)
+        z = m_q + (z - m_q) * noise_scale
         z_p = self.flow(z, y_mask, g=g_src)
         z_hat = self.flow(z_p, y_mask, g=g_tgt, reverse=True)
-        o_hat = self.dec(z_hat * y_mask, g=g_tgt)
+        o_hat = self.dec(z_hat * y_mask, g=g_tgt, x_mask=y_mask)
         return o_hat, y_mask, (z, z_p, z_hat)
\ No newline at end of file
@@ -1,14 +1,22 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: nbs/trainer.base.ipynb (unless otherwise specified).
 
-__all__ = ['TTSTrainer', 'DEFAULTS', 'config', 'DEFAULTS']
+__all__ = ['StepTimer', 'AsyncLogger', 'MetricAccumulator', 'CheckpointWriter', 'TTSTrainer', 'DEFAULTS', 'config', 'DEFAULTS', 'launch']
 
 # Cell
+from contextlib import contextmanager, ExitStack
 import os
 from pathlib import Path
 from pprint import pprint
+import queue
+import random
+import tempfile
+import threading
 
 import torch
 import torch.distributed as dist
+from torch import multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.utils.data import DataLoader
 from tensorboardX import SummaryWriter
 import numpy as np
 import time
@@ -17,6 +25,322 @@ from ..models.common import MelSTFT
 from ..vocoders.hifigan import HiFiGanGenerator
 
 
+def _seed_worker(worker_id):
+    # NOTE: torch seeds itself and `random` in each worker from the loader's
+    # generator, but not numpy.
+    np.random.seed(torch.initial_seed() % 2**32)
+
+
+def _get_rng_state():
+    # NOTE: numpy's state is stored as tensors and lists so the checkpoint can be
+    # loaded with torch.load(weights_only=True).
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    return {
+        "python": random.getstate(),
+        "numpy": [
+            name,
+            torch.from_numpy(keys.astype(np.int64)),
+            pos,
+            has_gauss,
+            cached_gaussian,
+        ],
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state() if torch.cuda.is_initialized() else None,
+    }
+
+
+def _set_rng_state(state):
+    random.setstate(state["python"])
+    name, keys, pos, has_gauss, cached_gaussian = state["numpy"]
+    np.random.set_state(
+        (name, keys.cpu().numpy().astype(np.uint32), pos, has_gauss, cached_gaussian)
+    )
+    torch.set_rng_state(state["torch"].cpu())
+    if state["cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state(state["cuda"].cpu())
+
+
+class StepTimer:
+    """Accumulate the wall-clock time spent in named phases of training steps.
+
+    On cuda the device is synchronized at phase boundaries so that asynchronously
+    launched kernels are charged to the phase that launched them. When disabled,
+    phases are not timed and nothing is synchronized.
+    """
+
+    def __init__(self, device="cpu", enabled=True):
+        self.device = device
+        self.enabled = enabled
+        self.durations = {}
+        self.start_time = None
+
+    def _synchronize(self):
+        if str(self.device).startswith("cuda"):
+            torch.cuda.synchronize()
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        self._synchronize()
+        start = time.perf_counter()
+        try:
+            with torch.profiler.record_function(name):
+                yield
+        finally:
+            self._synchronize()
+            self.durations[name] = (
+                self.durations.get(name, 0.0) + time.perf_counter() - start
+            )
+
+    def iterate(self, loader):
+        """Iterate over loader, timing the wait for each batch as the "data" phase."""
+        iterator = iter(loader)
+        while True:
+            with self.phase("data"):
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    return
+            yield batch
+
+    def reset(self):
+        """Clear the phase durations and return them along with the time elapsed
+        since the previous reset (None on the first call)."""
+        now = time.perf_counter()
+        durations = self.durations
+        elapsed = None if self.start_time is None else now - self.start_time
+        self.durations = {}
+        self.start_time = now
+        return durations, elapsed
+
+
+class AsyncLogger:
+    """Run logging tasks on a background thread behind a bounded queue.
+
+    Tasks submitted while the queue is full are dropped instead of blocking
+    training, and counted in `dropped`. Tasks must be submitted from a single
+    thread. Since training keeps updating its tensors, tasks should only hold CPU
+    copies of them or a snapshot of the model.
+    """
+
+    def __init__(self, max_queue_size=2):
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                fn, args, kwargs = task
+                fn(*args, **kwargs)
+            except Exception as e:
+                print(f"Exception raised in async logging task: {e}")
+            finally:
+                self.queue.task_done()
+
+    def full(self):
+        return self.queue.full()
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs), returning False if it was dropped."""
+        try:
+            self.queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self):
+        """Block until every queued task has run."""
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+
+class MetricAccumulator:
+    """Running sums of losses, overall and per speaker, kept on the device they were
+    computed on.
+
+    Nothing is copied to the host until `flush`, which reduces the sums across
+    ranks in a single all_reduce when distributed.
+    """
+
+    def __init__(self, n_speakers):
+        self.n_speakers = n_speakers
+        self.reset()
+
+    def reset(self):
+        self.n_steps = 0
+        self.totals = {}
+        self.speaker_totals = {}
+        self.speaker_counts = None
+
+    def add(self, **values):
+        """Add one step's scalar tensors, e.g. the mean losses of a batch."""
+        self.n_steps += 1
+        for name, value in values.items():
+            value = value.detach().float().reshape(1)
+            if name in self.totals:
+                self.totals[name] += value
+            else:
+                self.totals[name] = value.clone()
+
+    def add_per_speaker(self, speaker_ids, **values):
+        """Add per-utterance tensors, e.g. the loss of each item of a batch."""
+        device = next(iter(values.values())).device
+        speaker_ids = speaker_ids.to(device).long()
+        if self.speaker_counts is None:
+            self.speaker_counts = torch.zeros(self.n_speakers, device=device)
+        self.speaker_counts += torch.bincount(speaker_ids, minlength=self.n_speakers)
+        for name, value in values.items():
+            if name not in self.speaker_totals:
+                self.speaker_totals[name] = torch.zeros(self.n_speakers, device=device)
+            self.speaker_totals[name].scatter_add_(
+                0, speaker_ids, value.detach().float()
+            )
+
+    def flush(self, world_size=None):
+        """Return the means since the last flush and reset.
+
+        Returns a dict of overall means and, for each name passed to
+        add_per_speaker, a {speaker_id: mean} dict of the speakers seen. If
+        world_size is given the sums are first reduced across ranks.
+        """
+        names = list(self.totals)
+        speaker_names = list(self.speaker_totals)
+        parts = [self.totals[name] for name in names]
+        if self.speaker_counts is not None:
+            parts.append(self.speaker_counts)
+            parts.extend(self.speaker_totals[name] for name in speaker_names)
+        n_steps = self.n_steps
+        self.reset()
+        if not parts:
+            return {}, {}
+        flat = torch.cat(parts)
+        if world_size:
+            dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+            n_steps *= world_size
+        flat = flat.tolist()
+
+        means = {name: flat[i] / n_steps for i, name in enumerate(names)}
+        speaker_means = {}
+        if speaker_names:
+            offset = len(names)
+            counts = flat[offset : offset + self.n_speakers]
+            for i, name in enumerate(speaker_names):
+                start = offset + (i + 1) * self.n_speakers
+                totals = flat[start : start + self.n_speakers]
+                speaker_means[name] = {
+                    speaker_id: totals[speaker_id] / count
+                    for speaker_id, count in enumerate(counts)
+                    if count > 0
+                }
+        return means, speaker_means
+
+
+def _to_cpu(obj):
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+class CheckpointWriter:
+    """Write checkpoints on a background thread.
+
+    `save` copies the checkpoint's tensors to the CPU and returns; the copy is
+    serialized to a temporary file in the destination directory, which is then
+    renamed into place so a checkpoint on disk is never partially written. At most
+    one save is in flight: a new save first waits for the previous one.
+
+    Each series of checkpoints (e.g. generator and discriminator) keeps only its
+    keep_last most recent files, plus the first one saved at or after each
+    multiple of keep_every steps. None keeps everything. Only files saved by this
+    writer are pruned; checkpoints already on disk, e.g. from an earlier run, are
+    never deleted.
+    """
+
+    def __init__(self, keep_last=None, keep_every=None, on_saved=None):
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.on_saved = on_saved
+        self.thread = None
+        self.error = None
+        self.saved = {}
+
+    def save(self, path, checkpoint, step=None, series=None):
+        """Save checkpoint to path, returning the seconds the caller was blocked."""
+        start = time.perf_counter()
+        self.wait()
+        checkpoint = _to_cpu(checkpoint)
+        self.thread = threading.Thread(
+            target=self._write, args=(path, checkpoint, step, series)
+        )
+        self.thread.start()
+        return time.perf_counter() - start
+
+    def wait(self):
+        """Wait for the in-flight save and raise if it failed."""
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _write(self, path, checkpoint, step, series):
+        start = time.perf_counter()
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                torch.save(checkpoint, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self._apply_retention(path, step, series)
+        except Exception as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.error = e
+            return
+        if self.on_saved is not None:
+            self.on_saved(path, step, time.perf_counter() - start)
+
+    def _apply_retention(self, path, step, series):
+        saved = [s for s in self.saved.get(series, []) if s[1] != path]
+        saved.append((step, path))
+        self.saved[series] = saved
+        if self.keep_last is None:
+            return
+        keep = {p for _, p in saved[-self.keep_last :]}
+        if self.keep_every:
+            previous = None
+            for s, p in saved:
+                if s is not None and (
+                    previous is None
+                    or s // self.keep_every > previous // self.keep_every
+                ):
+                    keep.add(p)
+                previous = s
+        self.saved[series] = [(s, p) for s, p in saved if p in keep]
+        for _, p in saved:
+            if p not in keep and os.path.exists(p):
+                os.remove(p)
+
+
 class TTSTrainer:
     def __init__(self, hparams, rank=None, world_size=None, device=None):
         print("TTSTrainer start", time.perf_counter())
@@ -28,6 +352,10 @@ class TTSTrainer:
         self.global_step = 0
         self.rank = rank
         self.world_size = world_size
+        # NOTE: torchrun sets LOCAL_RANK, the rank of the process on its node.
+        self.local_rank = (
+            None if rank is None else int(os.environ.get("LOCAL_RANK", rank))
+        )
         self.log_dir = hparams.log_dir
         self.seed = hparams.seed
         self.symbol_set = hparams.symbol_set
@@ -42,6 +370,57 @@ class TTSTrainer:
         self.writer = SummaryWriter(self.log_dir)
         if not hasattr(self, "debug"):
             self.debug = False
+        # NOTE: not every model's DEFAULTS include the loader and timing hparams.
+        for param in [
+            "num_workers",
+            "prefetch_factor",
+            "persistent_workers",
+            "pin_memory",
+            "step_timing",
+            "profiler_steps",
+            "async_logging",
+            "log_queue_size",
+            "steps_per_log",
+            "checkpoint_keep_last",
+            "checkpoint_keep_every",
+            "steps_per_checkpoint",
+            "accumulation_steps",
+            "distributed_run",
+            "dist_backend",
+            "dist_init_method",
+            "num_processes",
+            "num_threads",
+            "load_audio_segments",
+        ]:
+            if not hasattr(self, param):
+                setattr(self, param, getattr(DEFAULTS, param))
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        elif self.distributed_run and self.device == "cpu":
+            # NOTE: split the cores between the processes on this node, rather than
+            # each process using all of them.
+            local_world_size = int(
+                os.environ.get("LOCAL_WORLD_SIZE", self.world_size or 1)
+            )
+            torch.set_num_threads(max(1, os.cpu_count() // local_world_size))
+        self.step_timer = StepTimer(self.device, enabled=self.step_timing)
+        self._profiler = None
+        self.log_worker = (
+            AsyncLogger(self.log_queue_size)
+            if self.async_logging and (self.rank is None or self.rank == 0)
+            else None
+        )
+        self.epoch_samples = 0
+        self.micro_step = 0
+        self._step_utterances = 0
+        self._step_frames = 0
+        self._resume_samples = 0
+        self._resume_states = {}
+        self.checkpoint_writer = CheckpointWriter(
+            keep_last=self.checkpoint_keep_last,
+            keep_every=self.checkpoint_keep_every,
+            on_saved=self._log_checkpoint_saved,
+        )
         if self.debug:
             print("Running in debug mode with hparams:")
             pprint(hparams.values())
@@ -56,13 +435,50 @@ class TTSTrainer:
             raise Exception(
                 "Rank and world size must be provided when distributed training"
             )
+        backend = self.dist_backend or ("nccl" if self.device == "cuda" else "gloo")
+        init_method = self.dist_init_method
+        if init_method is None:
+            init_method = (
+                "env://" if "MASTER_ADDR" in os.environ else "tcp://localhost:54321"
+            )
         dist.init_process_group(
-            "nccl",
-            init_method="tcp://localhost:54321",
+            backend,
+            init_method=init_method,
             rank=self.rank,
             world_size=self.world_size,
         )
-        torch.cuda.set_device(self.rank)
+        if self.device == "cuda":
+            torch.cuda.set_device(self.local_rank)
+
+    def wrap_ddp(self, model):
+        """Wrap model in DistributedDataParallel if training is distributed."""
+        if not self.distributed_run:
+            return model
+        if self.device == "cuda":
+            return DDP(model, device_ids=[self.local_rank])
+        return DDP(model)
+
+    def build_loader(self, dataset, **kwargs):
+        """Return a DataLoader for dataset using the num_workers, prefetch_factor,
+        persistent_workers and pin_memory hparams.
+
+        Worker seeds are drawn from a generator seeded with seed + rank, so they are
+        deterministic and differ between ranks when distributed. kwargs are passed
+        through to DataLoader and take precedence.
+        """
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + (self.rank or 0))
+        loader_kwargs = dict(
+            num_workers=self.num_workers,
+            pin_memory=self.pin_memory and self.device == "cuda",
+            worker_init_fn=_seed_worker,
+            generator=generator,
+        )
+        if self.num_workers > 0:
+            loader_kwargs["prefetch_factor"] = self.prefetch_factor
+            loader_kwargs["persistent_workers"] = self.persistent_workers
+        loader_kwargs.update(kwargs)
+        return DataLoader(dataset, **loader_kwargs)
 
     def save_checkpoint(self, checkpoint_name, **kwargs):
         if self.rank is not None and self.rank != 0:
@@ -73,11 +489,68 @@ class TTSTrainer:
                 checkpoint[k] = v.state_dict()
             else:
                 checkpoint[k] = v
+        self.write_checkpoint(checkpoint_name, checkpoint)
+
+    def write_checkpoint(self, checkpoint_name, checkpoint, series=None):
+        """Save checkpoint to checkpoint_path/{checkpoint_name}.pt in the background.
+
+        The checkpoint_keep_last and checkpoint_keep_every hparams are applied to
+        each series separately, counting in global steps, to the checkpoints saved
+        by this trainer.
+        """
+        if self.rank is not None and self.rank != 0:
+            return
         if not Path(self.checkpoint_path).exists():
             os.makedirs(Path(self.checkpoint_path))
-        torch.save(
-            checkpoint, os.path.join(self.checkpoint_path, f"{checkpoint_name}.pt")
+        blocked_seconds = self.checkpoint_writer.save(
+            os.path.join(self.checkpoint_path, f"{checkpoint_name}.pt"),
+            checkpoint,
+            step=self.global_step,
+            series=series,
         )
+        self.log("Checkpoint/blocked_seconds", self.global_step, scalar=blocked_seconds)
+
+    def _log_checkpoint_saved(self, path, step, save_seconds):
+        print(f"Saved checkpoint {path} in {save_seconds:.2f}s")
+        self.log("Checkpoint/save_seconds", step, scalar=save_seconds)
+
+    def train_state(self, epoch, epoch_samples):
+        """Return the state needed to resume training at sample epoch_samples of
+        epoch, to be saved in a checkpoint as "train_state".
+
+        This includes the RNG states of every rank, so when distributed it must be
+        called on every rank.
+        """
+        rng_states = [_get_rng_state()]
+        if dist.is_available() and dist.is_initialized():
+            rng_states = [None] * dist.get_world_size()
+            dist.all_gather_object(rng_states, _get_rng_state())
+        return dict(epoch=epoch, epoch_samples=epoch_samples, rng_states=rng_states)
+
+    def restore_train_state(self, train_state):
+        """Restore the RNG states saved by train_state and return the epoch to
+        resume from. The samples already seen are skipped by begin_epoch."""
+        rng_states = train_state["rng_states"]
+        rank = self.rank or 0
+        if rank < len(rng_states):
+            _set_rng_state(rng_states[rank])
+        self._resume_samples = train_state["epoch_samples"]
+        return train_state["epoch"]
+
+    def restore_state(self, name, obj):
+        """Load the state saved as name in the warm start checkpoint into obj (e.g.
+        a GradScaler or LR scheduler), if there is one."""
+        if name in self._resume_states:
+            obj.load_state_dict(self._resume_states.pop(name))
+
+    def begin_epoch(self, epoch, batch_sampler):
+        """Seed batch_sampler's order for epoch and, when resuming part way
+        through it, fast-forward past the samples already trained on."""
+        batch_sampler.set_epoch(epoch)
+        if self._resume_samples:
+            batch_sampler.fast_forward(self._resume_samples)
+        self.epoch_samples = self._resume_samples
+        self._resume_samples = 0
 
     def load_checkpoint(self):
         return torch.load(self.warm_start_name, map_location=self.device)
@@ -98,6 +571,124 @@ class TTSTrainer:
         if figure is not None:
             self.writer.add_figure(tag, figure, step)
 
+    def log_async(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the logging worker, or inline if async_logging
+        is off. Returns False if the task was dropped because the queue was full.
+        """
+        if self.rank is not None and self.rank != 0:
+            return False
+        if self.log_worker is None:
+            fn(*args, **kwargs)
+            return True
+        return self.log_worker.submit(fn, *args, **kwargs)
+
+    def log_async_snapshot(self, fn, model, *args, **kwargs):
+        """log_async(fn, model, *args, state_dict=..., **kwargs), where state_dict
+        is a copy of model's weights on the CPU, so that fn never uses the model
+        being trained on the logging worker and the copies waiting in the queue take
+        no device memory.
+
+        When the queue is full the task is dropped before anything is copied. When
+        async_logging is off fn runs inline with state_dict=None and can use model
+        directly.
+        """
+        if self.rank is not None and self.rank != 0:
+            return False
+        if self.log_worker is None:
+            fn(model, *args, state_dict=None, **kwargs)
+            return True
+        # NOTE: only the training thread submits tasks, so a queue that is not full
+        # here still has room when the snapshot is submitted.
+        if self.log_worker.full():
+            self.log_worker.dropped += 1
+            return False
+        state_dict = {
+            k: v.detach().to("cpu", non_blocking=True, copy=True)
+            for k, v in model.state_dict().items()
+        }
+        # NOTE: wait for the copies from the device before the worker reads them.
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        return self.log_worker.submit(fn, model, *args, state_dict=state_dict, **kwargs)
+
+    def flush_logs(self):
+        """Wait for queued logging tasks and checkpoint writes to finish and flush
+        the SummaryWriter."""
+        self.checkpoint_writer.wait()
+        if self.log_worker is not None:
+            self.log_worker.flush()
+        self.writer.flush()
+
+    @contextmanager
+    def accumulate(self, *models):
+        """Context for the forward and backward passes of one micro-batch.
+
+        Yields True if the micro-batch completes an optimizer step, which happens
+        every accumulation_steps micro-batches. For the other micro-batches the
+        DDP gradient all-reduce of models is skipped with no_sync. Losses should
+        be divided by accumulation_steps before calling backward.
+        """
+        self.micro_step += 1
+        optimizer_step = self.micro_step % self.accumulation_steps == 0
+        with ExitStack() as stack:
+            if not optimizer_step:
+                for model in models:
+                    if hasattr(model, "no_sync"):
+                        stack.enter_context(model.no_sync())
+            yield optimizer_step
+
+    def count_samples(self, n_utterances, n_frames):
+        """Count a micro-batch toward the position in the epoch and the
+        throughput of the current optimizer step."""
+        self.epoch_samples += n_utterances
+        self._step_utterances += n_utterances
+        self._step_frames += n_frames
+
+    def log_step_timing(self, step):
+        """Log the phase durations and throughput of the step(s) since the last call.
+
+        Throughput counts every micro-batch passed to count_samples since the last
+        call, and is per process. Phase durations are only logged when the
+        step_timing hparam is set. Also starts or stops the torch.profiler trace
+        when step reaches the bounds of the profiler_steps hparam.
+        """
+        n_utterances, n_frames = self._step_utterances, self._step_frames
+        self._step_utterances = self._step_frames = 0
+        durations, elapsed = self.step_timer.reset()
+        if elapsed:
+            for name, duration in durations.items():
+                self.log(f"StepTime/{name}", step, scalar=duration)
+            self.log("StepTime/total", step, scalar=elapsed)
+            self.log(
+                "Throughput/utterances_per_second",
+                step,
+                scalar=n_utterances / elapsed,
+            )
+            self.log("Throughput/frames_per_second", step, scalar=n_frames / elapsed)
+        self._profiler_step(step)
+
+    def _profiler_step(self, step):
+        if not self.profiler_steps:
+            return
+        start, stop = self.profiler_steps
+        # NOTE: this runs at the end of a step, so the trace covers the next one.
+        next_step = step + 1
+        if self._profiler is None and start <= next_step < stop:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.device == "cuda":
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(
+                activities=activities,
+                record_shapes=True,
+                on_trace_ready=torch.profiler.tensorboard_trace_handler(
+                    os.path.join(self.log_dir, "profiler")
+                ),
+            )
+            self._profiler.__enter__()
+        elif self._profiler is not None and next_step >= stop:
+            self._profiler.__exit__(None, None, None)
+            self._profiler = None
+
     def sample(self, mel, algorithm="griffin-lim", **kwargs):
         """Invert the mel spectrogram and return the resulting audio.
 
@@ -143,6 +734,12 @@ class TTSTrainer:
         if "global_step" in checkpoint:
             self.global_step = checkpoint["global_step"]
             print(f"Adjusted global step to {self.global_step}")
+        if "train_state" in checkpoint:
+            start_epoch = self.restore_train_state(checkpoint["train_state"])
+            print(f"Resuming epoch {start_epoch} at sample {self._resume_samples}")
+        for k in ["scaler", "scheduler"]:
+            if k in checkpoint:
+                self._resume_states[k] = checkpoint[k]
         print("Ending warm_start", time.perf_counter())
         return model, optimizer, start_epoch
 
@@ -155,12 +752,14 @@ from ..vendor.tfcompat.hparam import HParams
 
 DEFAULTS = HParams(
     grad_clip_thresh=1.0,
+    # NOTE: "batch_size" may also be set per window; when it is omitted the
+    # batch_size hparam is kept.
     reduction_window_schedule=[
-        {"until_step": 10000, "batch_size": 16, "n_frames_per_step": 1},
-        {"until_step": 50000, "batch_size": 16, "n_frames_per_step": 1},
-        {"until_step": 60000, "batch_size": 16, "n_frames_per_step": 1},
-        {"until_step": 70000, "batch_size": 16, "n_frames_per_step": 1},
-        {"until_step": None, "batch_size": 16, "n_frames_per_step": 1},
+        {"until_step": 10000, "n_frames_per_step": 1},
+        {"until_step": 50000, "n_frames_per_step": 1},
+        {"until_step": 60000, "n_frames_per_step": 1},
+        {"until_step": 70000, "n_frames_per_step": 1},
+        {"until_step": None, "n_frames_per_step": 1},
     ],
     batch_size=16,
     decay_start=15000,
@@ -170,8 +769,68 @@ DEFAULTS = HParams(
     weight_decay=1e-6,
     sample_inference_speaker_ids=None,
     is_validate=True,
+    num_workers=0,
+    prefetch_factor=2,
+    persistent_workers=True,
+    pin_memory=True,
+    # NOTE: phase timing synchronizes the device at every phase boundary, so it is
+    # off by default. Throughput and total step time are logged either way.
+    step_timing=False,
+    # NOTE: [start, stop) range of steps to trace with torch.profiler, or None.
+    profiler_steps=None,
+    async_logging=True,
+    log_queue_size=2,
+    # NOTE: training losses are accumulated on device and only copied to the host
+    # (and reduced across ranks) every steps_per_log steps.
+    steps_per_log=10,
+    # NOTE: also checkpoint every steps_per_checkpoint steps within an epoch, so
+    # training can resume mid-epoch. None only checkpoints at the end of epochs.
+    steps_per_checkpoint=None,
+    # NOTE: gradients are accumulated over accumulation_steps batches per
+    # optimizer step, for an effective batch size of batch_size * accumulation_steps.
+    accumulation_steps=1,
+    distributed_run=False,
+    # NOTE: None picks nccl when training on GPU and gloo on CPU.
+    dist_backend=None,
+    # NOTE: None uses the environment variables set by torchrun (MASTER_ADDR,
+    # MASTER_PORT) if there are any, and tcp://localhost:54321 otherwise.
+    dist_init_method=None,
+    # NOTE: the number of processes to spawn for distributed training on CPU. On
+    # GPU one process is spawned per device.
+    num_processes=1,
+    # NOTE: torch threads per process. None splits the node's cores between
+    # processes when distributed on CPU, and leaves torch's default otherwise.
+    num_threads=None,
+    # NOTE: None keeps every checkpoint.
+    checkpoint_keep_last=None,
+    checkpoint_keep_every=None,
+    # NOTE: only read the audio that training uses. VITS reads the segment_size
+    # samples of each wav it decodes, and GradTTS, whose alignment needs the whole
+    # mel, caches mels next to the wavs rather than reading the audio.
+    load_audio_segments=False,
 )
 
 config = DEFAULTS.values()
 config.update(MODEL_DEFAULTS.values())
-DEFAULTS = HParams(**config)
\ No newline at end of file
+DEFAULTS = HParams(**config)
+
+# Cell
+
+
+def launch(run, hparams):
+    """Call run(rank, world_size, hparams) in every process of a distributed run.
+
+    Under torchrun (when RANK and WORLD_SIZE are set) this process is one of the
+    ranks and run is called directly. Otherwise one process is spawned per CUDA
+    device, or num_processes processes when training on CPU.
+    """
+    if "RANK" in os.environ and "WORLD_SIZE" in os.environ:
+        run(int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"]), hparams)
+        return
+    config = DEFAULTS.values()
+    config.update(hparams.values())
+    if torch.cuda.is_available() and config["cudnn_enabled"]:
+        world_size = torch.cuda.device_count()
+    else:
+        world_size = config["num_processes"]
+    mp.spawn(run, (world_size, hparams), world_size)
\ No newline at end of file
@@ -36,6 +36,7 @@ from ..data_loader import (
     DistributedBucketSampler,
     TextMelDataset,
 )
+from .base import MetricAccumulator
 from ..vendor.tfcompat.hparam import HParams
 from ..utils.plot import save_figure_to_numpy, plot_spectrogram
 from ..utils.utils import slice_segments, clip_grad_value_
@@ -48,6 +49,30 @@ from ..models.gradtts import GradTTS
 from ..utils.utils import intersperse
 
 
+class _ComputeLoss(torch.nn.Module):
+    """Call GradTTS.compute_loss as forward, so that the training step goes through
+    DistributedDataParallel and gradients are reduced across ranks."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, *args, **kwargs):
+        return self.model.compute_loss(*args, **kwargs)
+
+
+def _bucket_boundaries(boundaries, lengths):
+    """boundaries, plus a bucket for the lengths shorter than the first and one for
+    those longer than the last, since DistributedBucketSampler drops the lengths
+    outside of its buckets."""
+    boundaries = list(boundaries)
+    if min(lengths) <= boundaries[0]:
+        boundaries.insert(0, min(lengths) - 1)
+    if max(lengths) > boundaries[-1]:
+        boundaries.append(max(lengths))
+    return boundaries
+
+
 class GradTTSTrainer(TTSTrainer):
     REQUIRED_HPARAMS = [
         "training_audiopaths_and_text",
@@ -61,6 +86,20 @@ class GradTTSTrainer(TTSTrainer):
                 raise Exception(f"GradTTSTrainer missing a required param: {param}")
         self.sampling_rate = self.hparams.sampling_rate
         self.checkpoint_path = self.hparams.log_dir
+        if self.fp16_run and self.bf16_run:
+            raise Exception("Only one of fp16_run and bf16_run can be set")
+        if self.fp16_run and self.device != "cuda":
+            raise Exception("fp16_run requires CUDA, use bf16_run on CPU")
+
+    def autocast_context(self):
+        """Autocast the forward pass to float16 (fp16_run) or bfloat16 (bf16_run).
+
+        The model keeps the duration loss, the MAS log-prior and the loss
+        reductions in float32 either way.
+        """
+        if self.bf16_run:
+            return torch.autocast(self.device, dtype=torch.bfloat16)
+        return torch.autocast(self.device, dtype=torch.float16, enabled=self.fp16_run)
 
     def sample_inference(self, model, timesteps=10, spk=None):
         with torch.no_grad():
@@ -74,8 +113,8 @@ class GradTTSTrainer(TTSTrainer):
                 sequence = intersperse(
                     sequence, (len(SYMBOL_SETS[self.hparams.symbol_set]))
                 )
-            x = torch.LongTensor(sequence).cuda()[None]
-            x_lengths = torch.LongTensor([x.shape[-1]]).cuda()
+            x = torch.LongTensor(sequence).to(self.device)[None]
+            x_lengths = torch.LongTensor([x.shape[-1]]).to(self.device)
             y_enc, y_dec, attn = model(
                 x,
                 x_lengths,
@@ -97,12 +136,9 @@ class GradTTSTrainer(TTSTrainer):
                 audio = self.sample(y_dec.cpu()[0])
             return audio
 
-    def train(self, checkpoint=None):
-        if self.distributed_run:
-            self.init_distributed()
-
-        train_dataset = TextMelDataset(
-            self.hparams.training_audiopaths_and_text,
+    def _dataset(self, audiopaths_and_text):
+        return TextMelDataset(
+            audiopaths_and_text,
             self.hparams.text_cleaners,
             1.0,
             self.hparams.n_feats,
@@ -111,139 +147,170 @@ class GradTTSTrainer(TTSTrainer):
             self.hparams.mel_fmax,
             self.hparams.filter_length,
             self.hparams.hop_length,
-            (self.hparams.filter_length - self.hparams.hop_length) // 2,
-            self.hparams.win_length,
+            win_length=self.hparams.win_length,
+            padding=(self.hparams.filter_length - self.hparams.hop_length) // 2,
             intersperse_text=self.hparams.intersperse_text,
             intersperse_token=(len(SYMBOL_SETS[self.hparams.symbol_set])),
             symbol_set=self.hparams.symbol_set,
-        )
-        collate_fn = TextMelCollate()
-
-        loader = DataLoader(
-            dataset=train_dataset,
-            batch_size=self.hparams.batch_size,
-            collate_fn=collate_fn,
-            drop_last=True,
-            num_workers=0,
-            shuffle=False,
+            cache_mels=self.load_audio_segments,
         )
 
-        test_dataset = TextMelDataset(
-            self.hparams.test_audiopaths_and_text,
-            self.hparams.text_cleaners,
-            1.0,
-            self.hparams.n_feats,
-            self.hparams.sampling_rate,
-            self.hparams.mel_fmin,
-            self.hparams.mel_fmax,
-            self.hparams.filter_length,
-            self.hparams.hop_length,
-            (self.hparams.filter_length - self.hparams.hop_length) // 2,
-            self.hparams.win_length,
-            intersperse_text=self.hparams.intersperse_text,
-            intersperse_token=(len(SYMBOL_SETS[self.hparams.symbol_set])),
-            symbol_set=self.hparams.symbol_set,
+    def train(self, checkpoint=None):
+        if self.distributed_run:
+            self.init_distributed()
+        is_main = self.rank is None or self.rank == 0
+
+        train_dataset = self._dataset(self.hparams.training_audiopaths_and_text)
+        # NOTE: each rank draws its own shard of length-bucketed batches. Without
+        # distributed training this is a single shard of the whole dataset.
+        sampler = DistributedBucketSampler(
+            train_dataset,
+            self.hparams.batch_size,
+            _bucket_boundaries(self.hparams.bucket_boundaries, train_dataset.lengths),
+            num_replicas=self.world_size if self.distributed_run else 1,
+            rank=self.rank if self.distributed_run else 0,
+            shuffle=True,
+        )
+        loader = self.build_loader(
+            train_dataset,
+            collate_fn=TextMelCollate(),
+            batch_sampler=sampler,
         )
 
         model = GradTTS(self.hparams)
 
         if self.hparams.checkpoint:
-            model.load_state_dict(torch.load(self.hparams.checkpoint))
-        model = model.cuda()
+            model.load_state_dict(
+                torch.load(self.hparams.checkpoint, map_location="cpu")
+            )
+        model = model.to(self.device)
+        compute_loss = self.wrap_ddp(_ComputeLoss(model))
 
-        print(
-            "Number of encoder + duration predictor parameters: %.2fm"
-            % (model.encoder.nparams / 1e6)
-        )
-        print("Number of decoder parameters: %.2fm" % (model.decoder.nparams / 1e6))
-        print("Total parameters: %.2fm" % (model.nparams / 1e6))
+        if is_main:
+            print(
+                "Number of encoder + duration predictor parameters: %.2fm"
+                % (model.encoder.nparams / 1e6)
+            )
+            print("Number of decoder parameters: %.2fm" % (model.decoder.nparams / 1e6))
+            print("Total parameters: %.2fm" % (model.nparams / 1e6))
 
-        print("Initializing optimizer...")
+            print("Initializing optimizer...")
         optimizer = torch.optim.Adam(
             params=model.parameters(), lr=self.hparams.learning_rate
         )
-        test_batch = test_dataset.sample_test_batch(size=self.hparams.test_size)
+        # NOTE: bfloat16 has the exponent range of float32, so only fp16 needs scaling.
+        scaler = GradScaler(enabled=self.fp16_run)
+        test_batch = []
+        if is_main:
+            test_dataset = self._dataset(self.hparams.test_audiopaths_and_text)
+            test_batch = test_dataset.sample_test_batch(size=self.hparams.test_size)
         for i, item in enumerate(test_batch):
-            text, mel, spk = item
             self.log(
                 f"image_{i}/ground_truth",
                 0,
-                image=plot_tensor(mel.squeeze()),
+                image=plot_tensor(item["mel"].squeeze()),
             )
-        iteration = 0
+        world_size = self.world_size if self.distributed_run else None
+        train_metrics = MetricAccumulator(self.hparams.n_spks)
+        epoch_metrics = MetricAccumulator(self.hparams.n_spks)
+        step_losses = {}
         last_time = time.time()
         for epoch in range(0, self.hparams.n_epochs):
+            self.begin_epoch(epoch, sampler)
             model.train()
-            dur_losses = []
-            prior_losses = []
-            diff_losses = []
-            for batch_idx, batch in enumerate(loader):
-                model.zero_grad()
-                x, x_lengths, y, _, y_lengths, speaker_ids = batch
-
-                dur_loss, prior_loss, diff_loss = model.compute_loss(
-                    x, x_lengths, y, y_lengths, out_size=self.hparams.out_size
-                )
-                loss = sum([dur_loss, prior_loss, diff_loss])
-                loss.backward()
+            self.step_timer.reset()
+            for batch in self.step_timer.iterate(loader):
+                x, x_lengths, y, _, y_lengths, speaker_ids, _ = batch
 
-                enc_grad_norm = torch.nn.utils.clip_grad_norm_(
-                    model.encoder.parameters(), max_norm=1
-                )
-                dec_grad_norm = torch.nn.utils.clip_grad_norm_(
-                    model.decoder.parameters(), max_norm=1
+                with self.accumulate(compute_loss) as optimizer_step:
+                    with self.step_timer.phase("forward"), self.autocast_context():
+                        dur_loss, prior_loss, diff_loss = compute_loss(
+                            x, x_lengths, y, y_lengths, out_size=self.hparams.out_size
+                        )
+                        loss = sum([dur_loss, prior_loss, diff_loss])
+                    with self.step_timer.phase("backward"):
+                        scaler.scale(loss / self.accumulation_steps).backward()
+                self.count_samples(y_lengths.size(0), y_lengths.sum().item())
+
+                losses = dict(
+                    duration_loss=dur_loss,
+                    prior_loss=prior_loss,
+                    diffusion_loss=diff_loss,
                 )
-                optimizer.step()
+                epoch_metrics.add(**losses)
+                step_losses = {
+                    name: step_losses.get(name, 0)
+                    + value.detach() / self.accumulation_steps
+                    for name, value in losses.items()
+                }
+                if not optimizer_step:
+                    continue
 
-                self.log("training/duration_loss", iteration, dur_loss.item())
-                self.log("training/prior_loss", iteration, prior_loss.item())
-                self.log("training/diffusion_loss", iteration, diff_loss.item())
-                self.log("training/encoder_grad_norm", iteration, enc_grad_norm)
-                self.log("training/decoder_grad_norm", iteration, dec_grad_norm)
+                self.global_step += 1
+                with self.step_timer.phase("optimizer"):
+                    scaler.unscale_(optimizer)
+                    enc_grad_norm = torch.nn.utils.clip_grad_norm_(
+                        model.encoder.parameters(), max_norm=1
+                    )
+                    dec_grad_norm = torch.nn.utils.clip_grad_norm_(
+                        model.decoder.parameters(), max_norm=1
+                    )
+                    scaler.step(optimizer)
+                    scaler.update()
+                    model.zero_grad()
 
-                dur_losses.append(dur_loss.item())
-                prior_losses.append(prior_loss.item())
-                diff_losses.append(diff_loss.item())
+                with self.step_timer.phase("log"):
+                    train_metrics.add(
+                        encoder_grad_norm=enc_grad_norm,
+                        decoder_grad_norm=dec_grad_norm,
+                        **step_losses,
+                    )
+                    step_losses = {}
+                    if self.global_step % self.steps_per_log == 0:
+                        means, _ = train_metrics.flush(world_size)
+                        for name, value in means.items():
+                            self.log(f"training/{name}", self.global_step, value)
 
-                iteration += 1
+                self.log_step_timing(self.global_step)
 
-            log_msg = f"Epoch {epoch}, iter: {iteration}: dur_loss: {np.mean(dur_losses):.4f} | prior_loss: {np.mean(prior_losses):.4f} | diff_loss: {np.mean(diff_losses):.4f} | time: {time.time()-last_time:.2f}s"
+            means, _ = epoch_metrics.flush(world_size)
+            if is_main and means:
+                log_msg = f"Epoch {epoch}, iter: {self.global_step}: dur_loss: {means['duration_loss']:.4f} | prior_loss: {means['prior_loss']:.4f} | diff_loss: {means['diffusion_loss']:.4f} | time: {time.time()-last_time:.2f}s"
+                with open(f"{self.hparams.log_dir}/train.log", "a") as f:
+                    f.write(log_msg + "\n")
+                    print(log_msg)
             last_time = time.time()
-            with open(f"{self.hparams.log_dir}/train.log", "a") as f:
-                f.write(log_msg + "\n")
-                print(log_msg)
 
-            if epoch % self.log_interval == 0:
+            if is_main and epoch % self.log_interval == 0:
                 model.eval()
                 with torch.no_grad():
                     for i, item in enumerate(test_batch):
-                        x, _y, _speaker_id = item
-                        x = x.to(torch.long).unsqueeze(0)
+                        x = item["text_sequence"].to(torch.long).unsqueeze(0)
                         x_lengths = torch.LongTensor([x.shape[-1]])
                         y_enc, y_dec, attn = model(x, x_lengths, n_timesteps=50)
                         self.log(
                             f"image_{i}/generated_enc",
-                            iteration,
+                            self.global_step,
                             image=plot_tensor(y_enc.squeeze().cpu()),
                         )
                         self.log(
                             f"image_{i}/generated_dec",
-                            iteration,
+                            self.global_step,
                             image=plot_tensor(y_dec.squeeze().cpu()),
                         )
                         self.log(
                             f"image_{i}/alignment",
-                            iteration,
+                            self.global_step,
                             image=plot_tensor(attn.squeeze().cpu()),
                         )
                         self.log(
                             f"audio/inference_{i}",
-                            iteration,
+                            self.global_step,
                             audio=self.sample_inference(model),
                         )
 
             if epoch % self.save_every == 0:
-                torch.save(
-                    model.state_dict(),
-                    f=f"{self.hparams.log_dir}/{self.checkpoint_name}_{epoch}.pt",
-                )
\ No newline at end of file
+                self.write_checkpoint(
+                    f"{self.checkpoint_name}_{epoch}", model.state_dict()
+                )
+        self.flush_logs()
\ No newline at end of file
@@ -14,7 +14,7 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 from tensorboardX import SummaryWriter
 import time
 from torch.utils.data import DataLoader
-from random import choice
+from random import choice, randint
 from ..models.common import MelSTFT
 from ..utils.plot import (
     plot_attention,
@@ -41,129 +41,24 @@ class MellotronTrainer(Tacotron2Trainer):
         "pos_weight",
     ]
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.n_frames_per_step_current = self.n_frames_per_step_initial
-        self.reduction_window_idx = 0
-
-    def adjust_frames_per_step(
-        self,
-        model: Mellotron,
-        train_loader: DataLoader,
-        sampler,
-        collate_fn: TextMelCollate,
-    ):
-        """If necessary, adjust model and loader's n_frames_per_step."""
-        if not self.reduction_window_schedule:
-            return train_loader, sampler, collate_fn
-        settings = self.reduction_window_schedule[self.reduction_window_idx]
-        if settings["until_step"] is None:
-            return train_loader, sampler, collate_fn
-        if self.global_step < settings["until_step"]:
-            return train_loader, sampler, collate_fn
-        old_fps = settings["n_frames_per_step"]
-        while settings["until_step"] and self.global_step >= settings["until_step"]:
-            self.reduction_window_idx += 1
-            settings = self.reduction_window_schedule[self.reduction_window_idx]
-        fps = settings["n_frames_per_step"]
-        bs = settings["batch_size"]
-        print(f"Adjusting frames per step from {old_fps} to {fps}")
-        self.batch_size = bs
-        model.set_current_frames_per_step(fps)
-        self.n_frames_per_step_current = fps
-        _, _, train_loader, sampler, collate_fn = self.initialize_loader(
-            n_frames_per_step_current=self.n_frames_per_step_current,
-            include_f0=self.include_f0,
-        )
-        return train_loader, sampler, collate_fn
-
-    def validate(self, **kwargs):
-        model = kwargs["model"]
-        val_set = kwargs["val_set"]
-        collate_fn = kwargs["collate_fn"]
-        criterion = kwargs["criterion"]
-        sampler = DistributedSampler(val_set) if self.distributed_run else None
-        (
-            total_loss,
-            total_mel_loss,
-            total_gate_loss,
-            total_mel_loss_val,
-            total_gate_loss_val,
-        ) = (0, 0, 0, 0, 0)
-        total_steps = 0
-        model.eval()
-        speakers_val = []
-        total_mel_loss_val = []
-        total_gate_loss_val = []
-        with torch.no_grad():
-            val_loader = DataLoader(
-                val_set,
-                sampler=sampler,
-                shuffle=False,
-                batch_size=self.batch_size,
-                collate_fn=collate_fn,
-            )
-            for batch in val_loader:
-                total_steps += 1
-                if self.distributed_run:
-                    X, y = model.module.parse_batch(batch)
-                    speakers_val.append(X[5])
-                else:
-                    X, y = model.parse_batch(batch)
-                    speakers_val.append(X[5])
-                y_pred = model(X)
-                mel_loss, gate_loss, mel_loss_batch, gate_loss_batch = criterion(
-                    y_pred, y
-                )
-                if self.distributed_run:
-                    reduced_mel_loss = reduce_tensor(mel_loss, self.world_size).item()
-                    reduced_gate_loss = reduce_tensor(gate_loss, self.world_size).item()
-                    reduced_val_loss = reduced_mel_loss + reduced_gate_loss
-                else:
-                    reduced_mel_loss = mel_loss.item()
-                    reduced_gate_loss = gate_loss.item()
-                    reduced_mel_loss_val = mel_loss_batch.detach()
-                    reduced_gate_loss_val = gate_loss_batch.detach()
-
-                total_mel_loss_val.append(reduced_mel_loss_val)
-                total_gate_loss_val.append(reduced_gate_loss_val)
-                reduced_val_loss = reduced_mel_loss + reduced_gate_loss
-                total_mel_loss += reduced_mel_loss
-                total_gate_loss += reduced_gate_loss
-                total_loss += reduced_val_loss
-
-            mean_mel_loss = total_mel_loss / total_steps
-            mean_gate_loss = total_gate_loss / total_steps
-            mean_loss = total_loss / total_steps
-            total_mel_loss_val = torch.hstack(total_mel_loss_val)
-            total_gate_loss_val = torch.hstack(total_gate_loss_val)
-            speakers_val = torch.hstack(speakers_val)
-            self.log_validation(
-                X,
-                y_pred,
-                y,
-                mean_loss,
-                mean_mel_loss,
-                mean_gate_loss,
-                total_mel_loss_val,
-                total_gate_loss_val,
-                speakers_val,
-            )
-        model.train()
-
-    def sample_inference(self, model):
+    def sample_inference(self, model, transcription=None, speaker_id=None, step=None):
         if self.rank is not None and self.rank != 0:
             return
+        if step is None:
+            step = self.global_step
         # Generate an audio sample
         with torch.no_grad():
+            if transcription is None:
+                transcription = random_utterance()
             utterance = torch.LongTensor(
-                text_to_sequence(random_utterance(), self.text_cleaners, self.p_arpabet)
+                text_to_sequence(transcription, self.text_cleaners, self.p_arpabet)
             )[None].cuda()
-            speaker_id = (
-                choice(self.sample_inference_speaker_ids)
-                if self.sample_inference_speaker_ids
-                else randint(0, self.n_speakers - 1)
-            )
+            if speaker_id is None:
+                speaker_id = (
+                    choice(self.sample_inference_speaker_ids)
+                    if self.sample_inference_speaker_ids
+                    else randint(0, self.n_speakers - 1)
+                )
             input_ = [utterance, 0, torch.LongTensor([speaker_id]).cuda()]
             if self.include_f0:
                 input_.append(torch.zeros([1, 1, 200], device=self.device))
@@ -173,25 +68,25 @@ class MellotronTrainer(Tacotron2Trainer):
             model.train()
             try:
                 audio = self.sample(mel[0])
-                self.log("SampleInference", self.global_step, audio=audio)
+                self.log("SampleInference", step, audio=audio)
             except Exception as e:
                 print(f"Exception raised while doing sample inference: {e}")
                 print("Mel shape: ", mel[0].shape)
             self.log(
                 "Attention/sample_inference",
-                self.global_step,
+                step,
                 image=save_figure_to_numpy(
                     plot_attention(attn[0].data.cpu().transpose(0, 1))
                 ),
             )
             self.log(
                 "MelPredicted/sample_inference",
-                self.global_step,
+                step,
                 image=save_figure_to_numpy(plot_spectrogram(mel[0].data.cpu())),
             )
             self.log(
                 "Gate/sample_inference",
-                self.global_step,
+                step,
                 image=save_figure_to_numpy(
                     plot_gate_outputs(gate_outputs=gate[0].data.cpu())
                 ),
@@ -199,23 +94,9 @@ class MellotronTrainer(Tacotron2Trainer):
 
     @property
     def training_dataset_args(self):
-        return [
-            *super().training_dataset_args,
-            # self.training_audiopaths_and_text,
-            # self.text_cleaners,
-            # self.p_arpabet,
-            # audio params
-            # self.n_mel_channels,
-            # self.sampling_rate,
-            # self.mel_fmin,
-            # self.mel_fmax,
-            # self.filter_length,
-            # self.hop_length,
-            # self.win_length,
-            # self.max_wav_value,
-            self.include_f0,
-            # self.pos_weight,
-        ]
+        args = dict(**super().training_dataset_args)
+        args["include_f0"] = self.include_f0
+        return args
 
     #     def warm_start(self, model, optimizer, start_epoch=0):
 
@@ -246,7 +127,8 @@ class MellotronTrainer(Tacotron2Trainer):
     def train(self):
         print("start train", time.perf_counter())
         train_set, val_set, train_loader, sampler, collate_fn = self.initialize_loader(
-            include_f0=self.include_f0
+            include_f0=self.include_f0,
+            n_frames_per_step=self.n_frames_per_step_current,
         )
         criterion = Tacotron2Loss(
             pos_weight=self.pos_weight
@@ -256,8 +138,7 @@ class MellotronTrainer(Tacotron2Trainer):
         # move to TTSTrainer class
         if self.device == "cuda":
             model = model.cuda()
-        if self.distributed_run:
-            model = DDP(model, device_ids=[self.rank])
+        model = self.wrap_ddp(model)
         optimizer = torch.optim.Adam(
             model.parameters(),
             lr=self.learning_rate,
@@ -268,26 +149,29 @@ class MellotronTrainer(Tacotron2Trainer):
         if self.warm_start_name:
             model, optimizer, start_epoch = self.warm_start(model, optimizer)
 
+        scaler = None
         if self.fp16_run:
             scaler = GradScaler()
+            self.restore_state("scaler", scaler)
 
         # main training loop
+        self.adjust_frames_per_step(model, train_loader, collate_fn)
         for epoch in range(start_epoch, self.epochs):
-            train_loader, sampler, collate_fn = self.adjust_frames_per_step(
-                model, train_loader, sampler, collate_fn
-            )
-            if self.distributed_run:
-                sampler.set_epoch(epoch)
-            for batch in train_loader:
-                start_time = time.perf_counter()
-                self.global_step += 1
-                model.zero_grad()
-                if self.distributed_run:
-                    X, y = model.module.parse_batch(batch)
-                else:
-                    X, y = model.parse_batch(batch)
-                if self.fp16_run:
-                    with autocast():
+            self.begin_epoch(epoch, train_loader.batch_sampler)
+            self.step_timer.reset()
+            for batch in self.step_timer.iterate(train_loader):
+                if self.micro_step % self.accumulation_steps == 0:
+                    start_time = time.perf_counter()
+                self.adjust_frames_per_step(model, train_loader, collate_fn)
+                with self.step_timer.phase("to_device"):
+                    if self.distributed_run:
+                        X, y = model.module.parse_batch(batch)
+                    else:
+                        X, y = model.parse_batch(batch)
+                with self.accumulate(model) as optimizer_step:
+                    with self.step_timer.phase("forward"), autocast(
+                        enabled=self.fp16_run
+                    ):
                         y_pred = model(X)
                         (
                             mel_loss,
@@ -297,62 +181,56 @@ class MellotronTrainer(Tacotron2Trainer):
                         ) = criterion(y_pred, y)
                         loss = mel_loss + gate_loss
                         loss_batch = mel_loss_batch + gate_loss_batch
-                else:
-                    y_pred = model(X)
-                    mel_loss, gate_loss, mel_loss_batch, gate_loss_batch = criterion(
-                        y_pred, y
-                    )
-                    loss = mel_loss + gate_loss
-                    loss_batch = mel_loss_batch + gate_loss_batch
-
-                if self.distributed_run:
-                    reduced_mel_loss = reduce_tensor(mel_loss, self.world_size).item()
-                    reduced_gate_loss = reduce_tensor(gate_loss, self.world_size).item()
-                    reduced_loss = reduce_mel_loss + reduced_gate_loss
-                else:
-                    reduced_mel_loss = mel_loss.item()
-                    reduced_gate_loss = gate_loss.item()
-                    reduced_gate_loss_batch = gate_loss_batch.detach()
-                    reduced_mel_loss_batch = mel_loss_batch.detach()
+                    with self.step_timer.phase("backward"):
+                        if self.fp16_run:
+                            scaler.scale(loss / self.accumulation_steps).backward()
+                        else:
+                            (loss / self.accumulation_steps).backward()
+                self.add_micro_batch_losses(
+                    X, loss, mel_loss, gate_loss, mel_loss_batch, gate_loss_batch
+                )
+                self.count_samples(batch[4].size(0), batch[4].sum().item())
+                if not optimizer_step:
+                    continue
 
-                reduced_loss = reduced_mel_loss + reduced_gate_loss
-                reduced_loss_batch = reduced_gate_loss_batch + reduced_mel_loss_batch
-                if self.fp16_run:
-                    scaler.scale(loss).backward()
-                    scaler.unscale_(optimizer)
-                    grad_norm = torch.nn.utils.clip_grad_norm(
-                        model.parameters(), self.grad_clip_thresh
-                    )
-                    scaler.step(optimizer)
-                    scaler.update()
-                else:
-                    loss.backward()
+                self.global_step += 1
+                with self.step_timer.phase("optimizer"):
+                    if self.fp16_run:
+                        scaler.unscale_(optimizer)
                     grad_norm = torch.nn.utils.clip_grad_norm(
                         model.parameters(), self.grad_clip_thresh
                     )
-                    optimizer.step()
+                    if self.fp16_run:
+                        scaler.step(optimizer)
+                        scaler.update()
+                    else:
+                        optimizer.step()
+                    model.zero_grad()
                 step_duration_seconds = time.perf_counter() - start_time
-                self.log_training(
-                    model,
-                    X,
-                    y_pred,
-                    y,
-                    reduced_loss,
-                    reduced_mel_loss,
-                    reduced_gate_loss,
-                    reduced_mel_loss_batch,
-                    reduced_gate_loss_batch,
-                    grad_norm,
-                    step_duration_seconds,
-                )
+                with self.step_timer.phase("log"):
+                    self.log_training(
+                        model, X, y_pred, y, grad_norm, step_duration_seconds
+                    )
+                self.log_step_timing(self.global_step)
+                if (
+                    self.steps_per_checkpoint
+                    and self.global_step % self.steps_per_checkpoint == 0
+                ):
+                    self.save_train_checkpoint(
+                        f"{self.checkpoint_name}_{epoch}",
+                        model,
+                        optimizer,
+                        scaler,
+                        epoch,
+                    )
             if epoch % self.epochs_per_checkpoint == 0:
-                self.save_checkpoint(
+                self.save_train_checkpoint(
                     f"{self.checkpoint_name}_{epoch}",
-                    model=model,
-                    optimizer=optimizer,
-                    iteration=epoch,
-                    learning_rate=self.learning_rate,
-                    global_step=self.global_step,
+                    model,
+                    optimizer,
+                    scaler,
+                    epoch,
+                    end_of_epoch=True,
                 )
 
             # There's no need to validate in debug mode since we're not really training.
@@ -363,4 +241,5 @@ class MellotronTrainer(Tacotron2Trainer):
                 val_set=val_set,
                 collate_fn=collate_fn,
                 criterion=criterion,
-            )
\ No newline at end of file
+            )
+        self.flush_logs()
\ No newline at end of file
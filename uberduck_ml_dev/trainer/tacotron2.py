@@ -58,7 +58,7 @@ import torch.distributed as dist
 from torch.nn.parallel import DistributedDataParallel as DDP
 from tensorboardX import SummaryWriter
 import time
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, RandomSampler
 from ..models.common import MelSTFT
 from ..models.torchmoji import TorchMojiInterface
 from ..utils.plot import (
@@ -67,8 +67,8 @@ from ..utils.plot import (
     plot_spectrogram,
 )
 from ..text.util import text_to_sequence, random_utterance
-from .base import TTSTrainer
-from ..data_loader import TextMelDataset, TextMelCollate
+from .base import TTSTrainer, MetricAccumulator
+from ..data_loader import TextMelDataset, TextMelCollate, DynamicBatchSampler
 import pdb
 
 
@@ -109,123 +109,234 @@ class Tacotron2Trainer(TTSTrainer):
         if not self.sample_inference_speaker_ids:
             self.sample_inference_speaker_ids = list(range(self.n_speakers))
 
-        # pass
-
-    def log_training(
+        self.n_frames_per_step_current = self.n_frames_per_step_initial
+        self._val_loader = None
+        self._sample_model = None
+        self.train_metrics = MetricAccumulator(self.n_speakers)
+        self._step_losses = {}
+
+    def _reduction_window(self):
+        """Return the reduction window schedule entry for the current global step."""
+        for settings in self.reduction_window_schedule:
+            if (
+                settings["until_step"] is None
+                or self.global_step < settings["until_step"]
+            ):
+                return settings
+        return self.reduction_window_schedule[-1]
+
+    def adjust_frames_per_step(
         self,
-        model,
-        X,
-        y_pred,
-        y,
-        loss,
-        mel_loss,
-        gate_loss,
-        mel_loss_batch,
-        gate_loss_batch,
-        grad_norm,
-        step_duration_seconds,
+        model: Tacotron2,
+        train_loader: DataLoader,
+        collate_fn: TextMelCollate,
     ):
-        self.log("Loss/train", self.global_step, scalar=loss)
-        self.log("MelLoss/train", self.global_step, scalar=mel_loss)
-        self.log("GateLoss/train", self.global_step, scalar=gate_loss)
-        self.log("GradNorm", self.global_step, scalar=grad_norm.item())
-        self.log("LearningRate", self.global_step, scalar=self.learning_rate)
-        self.log(
-            "StepDurationSeconds",
-            self.global_step,
-            scalar=step_duration_seconds,
+        """If necessary, adjust model and loader's n_frames_per_step and batch size.
+
+        The datasets are left untouched: only the collate function and the batch
+        sampler of train_loader are updated, in place.
+        """
+        if not self.reduction_window_schedule:
+            return
+        settings = self._reduction_window()
+        fps = settings["n_frames_per_step"]
+        bs = settings.get("batch_size", self.batch_size)
+        if fps == self.n_frames_per_step_current and bs == self.batch_size:
+            return
+        print(
+            f"Adjusting frames per step from {self.n_frames_per_step_current} to {fps} and batch size from {self.batch_size} to {bs} at step {self.global_step}"
+        )
+        if self.distributed_run:
+            model.module.set_current_frames_per_step(fps)
+        else:
+            model.set_current_frames_per_step(fps)
+        collate_fn.set_frames_per_step(fps)
+        train_loader.batch_sampler.set_batch_size(bs)
+        self.n_frames_per_step_current = fps
+        self.batch_size = bs
+
+    def add_micro_batch_losses(
+        self, X, loss, mel_loss, gate_loss, mel_loss_batch, gate_loss_batch
+    ):
+        """Add a micro-batch's losses to the current optimizer step's, which
+        log_training logs."""
+        losses = dict(loss=loss, mel_loss=mel_loss, gate_loss=gate_loss)
+        for name, value in losses.items():
+            value = value.detach() / self.accumulation_steps
+            if name in self._step_losses:
+                self._step_losses[name] += value
+            else:
+                self._step_losses[name] = value
+        self.train_metrics.add_per_speaker(
+            X[5], mel_loss=mel_loss_batch, gate_loss=gate_loss_batch
         )
 
-        batch_levels = X[5]
-        batch_levels_unique = torch.unique(batch_levels)
-        for l in batch_levels_unique:
-            mlb = mel_loss_batch[torch.where(batch_levels == l)[0]].mean()
-            self.log(
-                f"MelLoss/train/speaker{l.item()}",
-                self.global_step,
-                scalar=mlb,
-            )
-            glb = gate_loss_batch[torch.where(batch_levels == l)[0]].mean()
-            self.log(
-                f"GateLoss/train/speaker{l.item()}",
-                self.global_step,
-                scalar=glb,
+    def log_training(self, model, X, y_pred, y, grad_norm, step_duration_seconds):
+        """Accumulate the optimizer step's losses, as added by
+        add_micro_batch_losses, and log them every steps_per_log steps.
+
+        Returns the logged means, or None if nothing was logged this step.
+        """
+        self.train_metrics.add(grad_norm=grad_norm, **self._step_losses)
+        self._step_losses = {}
+        means = None
+        if self.global_step % self.steps_per_log == 0:
+            means, speaker_means = self.train_metrics.flush(
+                self.world_size if self.distributed_run else None
             )
+            self.log("Loss/train", self.global_step, scalar=means["loss"])
+            self.log("MelLoss/train", self.global_step, scalar=means["mel_loss"])
+            self.log("GateLoss/train", self.global_step, scalar=means["gate_loss"])
+            self.log("GradNorm", self.global_step, scalar=means["grad_norm"])
+            self.log("LearningRate", self.global_step, scalar=self.learning_rate)
             self.log(
-                f"Loss/train/speaker{l.item()}",
+                "StepDurationSeconds",
                 self.global_step,
-                scalar=mlb + glb,
+                scalar=step_duration_seconds,
             )
+            self.log_speaker_losses("train", speaker_means)
 
         if self.global_step % self.steps_per_sample == 0:
             _, mel_out_postnet, gate_outputs, alignments, *_ = y_pred
             mel_target, gate_target = y
-            alignment_metrics = get_alignment_metrics(alignments)
-            alignment_diagonalness = alignment_metrics["diagonalness"]
-            alignment_max = alignment_metrics["max"]
             sample_idx = randint(0, mel_out_postnet.size(0) - 1)
-            audio = self.sample(mel=mel_out_postnet[sample_idx])
-            self.log(
-                "AlignmentDiagonalness/train",
+            self.log_async(
+                self.log_sample,
+                "train",
                 self.global_step,
-                scalar=alignment_diagonalness,
+                mel_out_postnet=mel_out_postnet[sample_idx].detach().cpu(),
+                mel_target=mel_target[sample_idx].detach().cpu(),
+                gate_outputs=gate_outputs[sample_idx].detach().cpu(),
+                gate_target=gate_target[sample_idx].detach().cpu(),
+                alignments=alignments.detach().cpu(),
+                sample_idx=sample_idx,
+                input_length=X[1][sample_idx].item(),
+                output_length=X[4][sample_idx].item(),
             )
-            self.log("AlignmentMax/train", self.global_step, scalar=alignment_max)
-            self.log("AudioSample/train", self.global_step, audio=audio)
-            self.log(
-                "MelPredicted/train",
+            if self.distributed_run:
+                model = model.module
+            self.log_async_snapshot(
+                self.sample_inference_speakers,
+                model,
                 self.global_step,
-                image=save_figure_to_numpy(
-                    plot_spectrogram(mel_out_postnet[sample_idx].data.cpu())
-                ),
+                n_frames_per_step=self.n_frames_per_step_current,
             )
+            if self.log_worker is not None:
+                self.log(
+                    "AsyncLogging/dropped",
+                    self.global_step,
+                    scalar=self.log_worker.dropped,
+                )
+        return means
+
+    def log_speaker_losses(self, split, speaker_means):
+        for speaker_id, mel_loss in speaker_means["mel_loss"].items():
+            gate_loss = speaker_means["gate_loss"][speaker_id]
             self.log(
-                "MelTarget/train",
+                f"MelLoss/{split}/speaker{speaker_id}",
                 self.global_step,
-                image=save_figure_to_numpy(
-                    plot_spectrogram(mel_target[sample_idx].data.cpu())
-                ),
+                scalar=mel_loss,
             )
             self.log(
-                "Gate/train",
+                f"GateLoss/{split}/speaker{speaker_id}",
                 self.global_step,
-                image=save_figure_to_numpy(
-                    plot_gate_outputs(
-                        gate_targets=gate_target[sample_idx].data.cpu(),
-                        gate_outputs=gate_outputs[sample_idx].data.cpu(),
-                    )
-                ),
+                scalar=gate_loss,
             )
-            input_length = X[1][sample_idx].item()
-            output_length = X[4][sample_idx].item()
             self.log(
-                "Attention/train",
+                f"Loss/{split}/speaker{speaker_id}",
                 self.global_step,
-                image=save_figure_to_numpy(
-                    plot_attention(
-                        alignments[sample_idx].data.cpu().transpose(0, 1),
-                        encoder_length=input_length,
-                        decoder_length=output_length,
-                    )
-                ),
+                scalar=mel_loss + gate_loss,
+            )
+
+    def log_sample(
+        self,
+        split,
+        step,
+        mel_out_postnet,
+        mel_target,
+        gate_outputs,
+        gate_target,
+        alignments,
+        sample_idx,
+        input_length,
+        output_length,
+    ):
+        """Render the alignment metrics, audio and plots of one sample of a batch.
+
+        Takes CPU tensors so that it can run on the logging worker.
+        """
+        alignment_metrics = get_alignment_metrics(alignments)
+        alignment_diagonalness = alignment_metrics["diagonalness"]
+        alignment_max = alignment_metrics["max"]
+        audio = self.sample(mel=mel_out_postnet)
+        self.log(f"AlignmentDiagonalness/{split}", step, scalar=alignment_diagonalness)
+        self.log(f"AlignmentMax/{split}", step, scalar=alignment_max)
+        self.log(f"AudioSample/{split}", step, audio=audio)
+        self.log(
+            f"MelPredicted/{split}",
+            step,
+            image=save_figure_to_numpy(plot_spectrogram(mel_out_postnet.data)),
+        )
+        self.log(
+            f"MelTarget/{split}",
+            step,
+            image=save_figure_to_numpy(plot_spectrogram(mel_target.data)),
+        )
+        self.log(
+            f"Gate/{split}",
+            step,
+            image=save_figure_to_numpy(
+                plot_gate_outputs(
+                    gate_targets=gate_target.data,
+                    gate_outputs=gate_outputs.data,
+                )
+            ),
+        )
+        self.log(
+            f"Attention/{split}",
+            step,
+            image=save_figure_to_numpy(
+                plot_attention(
+                    alignments[sample_idx].data.transpose(0, 1),
+                    encoder_length=input_length,
+                    decoder_length=output_length,
+                )
+            ),
+        )
+
+    def sample_inference_speakers(
+        self, model, step, n_frames_per_step=None, state_dict=None
+    ):
+        """Run sample_inference for each of sample_inference_speaker_ids.
+
+        If state_dict is given it is loaded onto model's device in a separate copy of
+        model, built on first use, so that the model being trained is left untouched.
+        The copy decodes n_frames_per_step frames per step, by default
+        n_frames_per_step_current.
+        """
+        if state_dict is not None:
+            if self._sample_model is None:
+                self._sample_model = type(model)(self.hparams).to(
+                    next(model.parameters()).device
+                )
+            if n_frames_per_step is None:
+                n_frames_per_step = self.n_frames_per_step_current
+            self._sample_model.set_current_frames_per_step(n_frames_per_step)
+            self._sample_model.load_state_dict(state_dict)
+            model = self._sample_model
+        for speaker_id in self.sample_inference_speaker_ids:
+            self.sample_inference(
+                model,
+                self.sample_inference_text,
+                speaker_id,
+                step=step,
             )
-            for speaker_id in self.sample_inference_speaker_ids:
-                if self.distributed_run:
-                    self.sample_inference(
-                        model.module,
-                        self.sample_inference_text,
-                        speaker_id,
-                    )
-                else:
-                    self.sample_inference(
-                        model,
-                        self.sample_inference_text,
-                        speaker_id,
-                    )
 
-    def sample_inference(self, model, transcription=None, speaker_id=None):
+    def sample_inference(self, model, transcription=None, speaker_id=None, step=None):
         if self.rank is not None and self.rank != 0:
             return
+        if step is None:
+            step = self.global_step
         # Generate an audio sample
         with torch.no_grad():
             if transcription is None:
@@ -271,25 +382,25 @@ class Tacotron2Trainer(TTSTrainer):
             model.train()
             try:
                 audio = self.sample(mel[0])
-                self.log(f"SampleInference/{speaker_id}", self.global_step, audio=audio)
+                self.log(f"SampleInference/{speaker_id}", step, audio=audio)
             except Exception as e:
                 print(f"Exception raised while doing sample inference: {e}")
                 print("Mel shape: ", mel[0].shape)
             self.log(
                 f"Attention/{speaker_id}/sample_inference",
-                self.global_step,
+                step,
                 image=save_figure_to_numpy(
                     plot_attention(attn[0].data.cpu().transpose(0, 1))
                 ),
             )
             self.log(
                 f"MelPredicted/{speaker_id}/sample_inference",
-                self.global_step,
+                step,
                 image=save_figure_to_numpy(plot_spectrogram(mel[0].data.cpu())),
             )
             self.log(
                 f"Gate/{speaker_id}/sample_inference",
-                self.global_step,
+                step,
                 image=save_figure_to_numpy(
                     plot_gate_outputs(gate_outputs=gate[0].data.cpu())
                 ),
@@ -303,85 +414,28 @@ class Tacotron2Trainer(TTSTrainer):
         mean_loss,
         mean_mel_loss,
         mean_gate_loss,
-        mel_loss_val,
-        gate_loss_val,
-        speakers_val,
+        speaker_means,
     ):
         self.log("Loss/val", self.global_step, scalar=mean_loss)
         self.log("MelLoss/val", self.global_step, scalar=mean_mel_loss)
         self.log("GateLoss/val", self.global_step, scalar=mean_gate_loss)
-
-        val_levels = speakers_val
-        val_levels_unique = torch.unique(val_levels)
-        for l in val_levels_unique:
-            mlv = mel_loss_val[torch.where(val_levels == l)[0]].mean()
-            self.log(
-                f"MelLoss/val/speaker{l.item()}",
-                self.global_step,
-                scalar=mlv,
-            )
-            glv = gate_loss_val[torch.where(val_levels == l)[0]].mean()
-            self.log(
-                f"GateLoss/val/speaker{l.item()}",
-                self.global_step,
-                scalar=glv,
-            )
-            self.log(
-                f"Loss/val/speaker{l.item()}",
-                self.global_step,
-                scalar=mlv + glv,
-            )
+        self.log_speaker_losses("val", speaker_means)
         # Generate the sample from a random item from the last y_pred batch.
         mel_target, gate_target = y
         _, mel_out_postnet, gate_outputs, alignments, *_ = y_pred
-        alignment_metrics = get_alignment_metrics(alignments)
-        alignment_diagonalness = alignment_metrics["diagonalness"]
-        alignment_max = alignment_metrics["max"]
-
         sample_idx = randint(0, mel_out_postnet.size(0) - 1)
-        audio = self.sample(mel=mel_out_postnet[sample_idx])
-
-        self.log(
-            "AlignmentDiagonalness/val", self.global_step, scalar=alignment_diagonalness
-        )
-        self.log("AlignmentMax/val", self.global_step, scalar=alignment_max)
-        self.log("AudioSample/val", self.global_step, audio=audio)
-        self.log(
-            "MelPredicted/val",
-            self.global_step,
-            image=save_figure_to_numpy(
-                plot_spectrogram(mel_out_postnet[sample_idx].data.cpu())
-            ),
-        )
-        self.log(
-            "MelTarget/val",
-            self.global_step,
-            image=save_figure_to_numpy(
-                plot_spectrogram(mel_target[sample_idx].data.cpu())
-            ),
-        )
-        self.log(
-            "Gate/val",
-            self.global_step,
-            image=save_figure_to_numpy(
-                plot_gate_outputs(
-                    gate_targets=gate_target[sample_idx].data.cpu(),
-                    gate_outputs=gate_outputs[sample_idx].data.cpu(),
-                )
-            ),
-        )
-        input_length = X[1][sample_idx].item()
-        output_length = X[4][sample_idx].item()
-        self.log(
-            "Attention/val",
+        self.log_async(
+            self.log_sample,
+            "val",
             self.global_step,
-            image=save_figure_to_numpy(
-                plot_attention(
-                    alignments[sample_idx].data.cpu().transpose(0, 1),
-                    encoder_length=input_length,
-                    decoder_length=output_length,
-                )
-            ),
+            mel_out_postnet=mel_out_postnet[sample_idx].detach().cpu(),
+            mel_target=mel_target[sample_idx].detach().cpu(),
+            gate_outputs=gate_outputs[sample_idx].detach().cpu(),
+            gate_target=gate_target[sample_idx].detach().cpu(),
+            alignments=alignments.detach().cpu(),
+            sample_idx=sample_idx,
+            input_length=X[1][sample_idx].item(),
+            output_length=X[4][sample_idx].item(),
         )
 
     def initialize_loader(self, include_f0: bool = False, n_frames_per_step: int = 1):
@@ -398,23 +452,42 @@ class Tacotron2Trainer(TTSTrainer):
         collate_fn = TextMelCollate(
             n_frames_per_step=n_frames_per_step, include_f0=include_f0
         )
-        sampler = None
         if self.distributed_run:
             self.init_distributed()
             sampler = DistributedSampler(train_set, rank=self.rank)
-        train_loader = DataLoader(
+        else:
+            # NOTE: a seeded generator lets begin_epoch replay an epoch's order.
+            sampler = RandomSampler(
+                train_set, generator=torch.Generator().manual_seed(self.seed)
+            )
+        # NOTE: a DynamicBatchSampler lets adjust_frames_per_step change the batch
+        # size without rebuilding the loader.
+        train_loader = self.build_loader(
             train_set,
-            batch_size=self.batch_size,
-            shuffle=(sampler is None),
-            sampler=sampler,
+            batch_sampler=DynamicBatchSampler(sampler, self.batch_size),
             collate_fn=collate_fn,
         )
         return train_set, val_set, train_loader, sampler, collate_fn
 
+    def val_loader(self, val_set, collate_fn):
+        """Build the validation loader on first use and reuse it afterwards."""
+        if self._val_loader is None:
+            sampler = DistributedSampler(val_set) if self.distributed_run else None
+            self._val_loader = self.build_loader(
+                val_set,
+                sampler=sampler,
+                shuffle=False,
+                batch_size=self.batch_size,
+                collate_fn=collate_fn,
+            )
+        return self._val_loader
+
     def train(self):
         train_start_time = time.perf_counter()
         print("start train", train_start_time)
-        train_set, val_set, train_loader, sampler, collate_fn = self.initialize_loader()
+        train_set, val_set, train_loader, sampler, collate_fn = self.initialize_loader(
+            n_frames_per_step=self.n_frames_per_step_current
+        )
         criterion = Tacotron2Loss(
             pos_weight=self.pos_weight
         )  # keep higher than 5 to make clips not stretch on
@@ -422,8 +495,7 @@ class Tacotron2Trainer(TTSTrainer):
         model = Tacotron2(self.hparams)
         if self.device == "cuda" and self.cudnn_enabled:
             model = model.cuda()
-        if self.distributed_run:
-            model = DDP(model, device_ids=[self.rank])
+        model = self.wrap_ddp(model)
         optimizer = torch.optim.Adam(
             model.parameters(),
             lr=self.learning_rate,
@@ -440,29 +512,31 @@ class Tacotron2Trainer(TTSTrainer):
             else:
                 model, optimizer, start_epoch = self.warm_start(model, optimizer)
 
+        scaler = None
         if self.fp16_run:
             scaler = GradScaler()
+            self.restore_state("scaler", scaler)
 
+        self.adjust_frames_per_step(model, train_loader, collate_fn)
         start_time, previous_start_time = time.perf_counter(), time.perf_counter()
         for epoch in range(start_epoch, self.epochs):
-            #             train_loader, sampler, collate_fn = self.adjust_frames_per_step(
-            #                 model, train_loader, sampler, collate_fn
-            #             )
-            if self.distributed_run:
-                sampler.set_epoch(epoch)
-            for batch_idx, batch in enumerate(train_loader):
-                previous_start_time = start_time
-                start_time = time.perf_counter()
-                self.global_step += 1
-                model.zero_grad()
-                if self.distributed_run:
-                    X, y = model.module.parse_batch(batch)
-                else:
-                    X, y = model.parse_batch(batch)
-                if self.fp16_run:
-                    with autocast():
+            self.begin_epoch(epoch, train_loader.batch_sampler)
+            self.step_timer.reset()
+            for batch_idx, batch in enumerate(self.step_timer.iterate(train_loader)):
+                if self.micro_step % self.accumulation_steps == 0:
+                    previous_start_time = start_time
+                    start_time = time.perf_counter()
+                self.adjust_frames_per_step(model, train_loader, collate_fn)
+                with self.step_timer.phase("to_device"):
+                    if self.distributed_run:
+                        X, y = model.module.parse_batch(batch)
+                    else:
+                        X, y = model.parse_batch(batch)
+                with self.accumulate(model) as optimizer_step:
+                    with self.step_timer.phase("forward"), autocast(
+                        enabled=self.fp16_run
+                    ):
                         y_pred = model(X)
-
                         (
                             mel_loss,
                             gate_loss,
@@ -471,72 +545,57 @@ class Tacotron2Trainer(TTSTrainer):
                         ) = criterion(y_pred, y)
                         loss = mel_loss + gate_loss
                         loss_batch = mel_loss_batch + gate_loss_batch
-                else:
-                    y_pred = model(X)
-                    mel_loss, gate_loss, mel_loss_batch, gate_loss_batch = criterion(
-                        y_pred, y
-                    )
-                    loss = mel_loss + gate_loss
-                    loss_batch = mel_loss_batch + gate_loss_batch
+                    with self.step_timer.phase("backward"):
+                        if self.fp16_run:
+                            scaler.scale(loss / self.accumulation_steps).backward()
+                        else:
+                            (loss / self.accumulation_steps).backward()
+                self.add_micro_batch_losses(
+                    X, loss, mel_loss, gate_loss, mel_loss_batch, gate_loss_batch
+                )
+                self.count_samples(batch[4].size(0), batch[4].sum().item())
+                if not optimizer_step:
+                    continue
 
-                if self.distributed_run:
-                    reduced_mel_loss = reduce_tensor(mel_loss, self.world_size).item()
-                    reduced_gate_loss = reduce_tensor(gate_loss, self.world_size).item()
-                    reduced_gate_loss_batch = reduce_tensor(
-                        gate_loss_batch, self.world_size
-                    )
-                    reduced_mel_loss_batch = reduce_tensor(
-                        mel_loss_batch, self.world_size
-                    )
-                else:
-                    reduced_mel_loss = mel_loss.item()
-                    reduced_gate_loss = gate_loss.item()
-                    reduced_gate_loss_batch = gate_loss_batch.detach()
-                    reduced_mel_loss_batch = mel_loss_batch.detach()
-
-                reduced_loss = reduced_mel_loss + reduced_gate_loss
-                if self.fp16_run:
-                    scaler.scale(loss).backward()
-                    scaler.unscale_(optimizer)
-                    grad_norm = torch.nn.utils.clip_grad_norm(
-                        model.parameters(), self.grad_clip_thresh
-                    )
-                    scaler.step(optimizer)
-                    scaler.update()
-                else:
-                    loss.backward()
+                self.global_step += 1
+                with self.step_timer.phase("optimizer"):
+                    if self.fp16_run:
+                        scaler.unscale_(optimizer)
                     grad_norm = torch.nn.utils.clip_grad_norm(
                         model.parameters(), self.grad_clip_thresh
                     )
-                    optimizer.step()
+                    if self.fp16_run:
+                        scaler.step(optimizer)
+                        scaler.update()
+                    else:
+                        optimizer.step()
+                    model.zero_grad()
                 step_duration_seconds = time.perf_counter() - start_time
-                log_start = time.time()
-                self.log_training(
-                    model,
-                    X,
-                    y_pred,
-                    y,
-                    reduced_loss,
-                    reduced_mel_loss,
-                    reduced_gate_loss,
-                    reduced_mel_loss_batch,
-                    reduced_gate_loss_batch,
-                    grad_norm,
-                    step_duration_seconds,
-                )
-                log_stop = time.time()
-                log_str = f"epoch: {epoch}/{self.epochs} | batch: {batch_idx}/{len(train_loader)} | loss: {reduced_mel_loss:.2f} | mel: {reduced_loss:.2f} | gate: {reduced_gate_loss:.3f} | t: {start_time - previous_start_time:.2f}s | w: {(time.perf_counter() - train_start_time)/(60*60):.2f}h"
-                if self.distributed_run:
-                    log_str += f" | rank: {self.rank}"
-                print(log_str)
+                with self.step_timer.phase("log"):
+                    means = self.log_training(
+                        model, X, y_pred, y, grad_norm, step_duration_seconds
+                    )
+                self.log_step_timing(self.global_step)
+                if (
+                    self.steps_per_checkpoint
+                    and self.global_step % self.steps_per_checkpoint == 0
+                ):
+                    self.save_train_checkpoint(
+                        f"{self.checkpoint_name}", model, optimizer, scaler, epoch
+                    )
+                if means is not None:
+                    log_str = f"epoch: {epoch}/{self.epochs} | batch: {batch_idx}/{len(train_loader)} | loss: {means['loss']:.2f} | mel: {means['mel_loss']:.2f} | gate: {means['gate_loss']:.3f} | t: {start_time - previous_start_time:.2f}s | w: {(time.perf_counter() - train_start_time)/(60*60):.2f}h"
+                    if self.distributed_run:
+                        log_str += f" | rank: {self.rank}"
+                    print(log_str)
             if epoch % self.epochs_per_checkpoint == 0:
-                self.save_checkpoint(
+                self.save_train_checkpoint(
                     f"{self.checkpoint_name}",
-                    model=model,
-                    optimizer=optimizer,
-                    iteration=epoch,
-                    learning_rate=self.learning_rate,
-                    global_step=self.global_step,
+                    model,
+                    optimizer,
+                    scaler,
+                    epoch,
+                    end_of_epoch=True,
                 )
 
             # There's no need to validate in debug mode since we're not really training.
@@ -549,6 +608,30 @@ class Tacotron2Trainer(TTSTrainer):
                     collate_fn=collate_fn,
                     criterion=criterion,
                 )
+        self.flush_logs()
+
+    def save_train_checkpoint(
+        self, checkpoint_name, model, optimizer, scaler, epoch, end_of_epoch=False
+    ):
+        """Save a checkpoint that training can resume from exactly, either part
+        way through epoch or, if end_of_epoch, at the start of the next one."""
+        if end_of_epoch:
+            train_state = self.train_state(epoch + 1, 0)
+        else:
+            train_state = self.train_state(epoch, self.epoch_samples)
+        kwargs = {}
+        if scaler is not None:
+            kwargs["scaler"] = scaler
+        self.save_checkpoint(
+            checkpoint_name,
+            model=model,
+            optimizer=optimizer,
+            iteration=epoch,
+            learning_rate=self.learning_rate,
+            global_step=self.global_step,
+            train_state=train_state,
+            **kwargs,
+        )
 
     def validate(self, **kwargs):
         val_start_time = time.perf_counter()
@@ -557,84 +640,41 @@ class Tacotron2Trainer(TTSTrainer):
         val_set = kwargs["val_set"]
         collate_fn = kwargs["collate_fn"]
         criterion = kwargs["criterion"]
-        sampler = DistributedSampler(val_set) if self.distributed_run else None
-        (
-            total_loss,
-            total_mel_loss,
-            total_gate_loss,
-            total_mel_loss_val,
-            total_gate_loss_val,
-        ) = (0, 0, 0, 0, 0)
-        total_steps = 0
+        val_metrics = MetricAccumulator(self.n_speakers)
         model.eval()
-        speakers_val = []
-        total_mel_loss_val = []
-        total_gate_loss_val = []
         with torch.no_grad():
-            val_loader = DataLoader(
-                val_set,
-                sampler=sampler,
-                shuffle=False,
-                batch_size=self.batch_size,
-                collate_fn=collate_fn,
-            )
-            for batch in val_loader:
-                total_steps += 1
+            for batch in self.val_loader(val_set, collate_fn):
                 if self.distributed_run:
                     X, y = model.module.parse_batch(batch)
-                    speakers_val.append(X[5])
                 else:
                     X, y = model.parse_batch(batch)
-                    speakers_val.append(X[5])
                 y_pred = model(X)
                 mel_loss, gate_loss, mel_loss_batch, gate_loss_batch = criterion(
                     y_pred, y
                 )
-                if self.distributed_run:
-                    reduced_mel_loss = reduce_tensor(mel_loss, self.world_size).item()
-                    reduced_gate_loss = reduce_tensor(gate_loss, self.world_size).item()
-                    reduced_val_loss = reduced_mel_loss + reduced_gate_loss
-                    reduced_gate_loss_val = reduce_tensor(
-                        gate_loss_batch, self.world_size
-                    )
-                    reduced_mel_loss_val = reduce_tensor(
-                        mel_loss_batch, self.world_size
-                    )
+                val_metrics.add(
+                    loss=mel_loss + gate_loss, mel_loss=mel_loss, gate_loss=gate_loss
+                )
+                val_metrics.add_per_speaker(
+                    X[5], mel_loss=mel_loss_batch, gate_loss=gate_loss_batch
+                )
 
-                else:
-                    reduced_mel_loss = mel_loss.item()
-                    reduced_gate_loss = gate_loss.item()
-                    reduced_mel_loss_val = mel_loss_batch.detach()
-                    reduced_gate_loss_val = gate_loss_batch.detach()
-
-                total_mel_loss_val.append(reduced_mel_loss_val)
-                total_gate_loss_val.append(reduced_gate_loss_val)
-                reduced_val_loss = reduced_mel_loss + reduced_gate_loss
-                total_mel_loss += reduced_mel_loss
-                total_gate_loss += reduced_gate_loss
-                total_loss += reduced_val_loss
-
-            mean_mel_loss = total_mel_loss / total_steps
-            mean_gate_loss = total_gate_loss / total_steps
-            mean_loss = total_loss / total_steps
-            total_mel_loss_val = torch.hstack(total_mel_loss_val)
-            total_gate_loss_val = torch.hstack(total_gate_loss_val)
-            speakers_val = torch.hstack(speakers_val)
+            means, speaker_means = val_metrics.flush(
+                self.world_size if self.distributed_run else None
+            )
             self.log_validation(
                 X,
                 y_pred,
                 y,
-                mean_loss,
-                mean_mel_loss,
-                mean_gate_loss,
-                total_mel_loss_val,
-                total_gate_loss_val,
-                speakers_val,
+                means["loss"],
+                means["mel_loss"],
+                means["gate_loss"],
+                speaker_means,
             )
 
         model.train()
 
-        val_log_str = f"Validation loss: {mean_loss:.2f} | mel: {mel_loss:.2f} | gate: {mean_gate_loss:.3f} | t: {time.perf_counter() - val_start_time:.2f}s"
+        val_log_str = f"Validation loss: {means['loss']:.2f} | mel: {means['mel_loss']:.2f} | gate: {means['gate_loss']:.3f} | t: {time.perf_counter() - val_start_time:.2f}s"
         print(val_log_str)
 
     @property
@@ -3,6 +3,7 @@
 __all__ = ['feature_loss', 'discriminator_loss', 'generator_loss', 'kl_loss', 'VITSTrainer']
 
 # Cell
+from contextlib import contextmanager
 import json
 import os
 from pathlib import Path
@@ -104,6 +105,21 @@ def kl_loss(z_p, logs_q, m_p, logs_p, z_mask):
 # Cell
 
 
+@contextmanager
+def _frozen(model):
+    """Run model without computing gradients for its parameters, or syncing them
+    across ranks if it is wrapped in DDP."""
+    model.requires_grad_(False)
+    try:
+        if hasattr(model, "no_sync"):
+            with model.no_sync():
+                yield
+        else:
+            yield
+    finally:
+        model.requires_grad_(True)
+
+
 class VITSTrainer(TTSTrainer):
     REQUIRED_HPARAMS = [
         "betas",
@@ -126,25 +142,10 @@ class VITSTrainer(TTSTrainer):
                 raise Exception(f"VITSTrainer missing a required param: {param}")
         self.mel_stft = MelSTFT(
             device=self.device,
-            rank=self.rank,
+            rank=self.local_rank,
             padding=(self.filter_length - self.hop_length) // 2,
         )
 
-    def init_distributed(self):
-        if not self.distributed_run:
-            return
-        if self.rank is None or self.world_size is None:
-            raise Exception(
-                "Rank and wrld size must be provided when distributed training"
-            )
-        dist.init_process_group(
-            "nccl",
-            init_method="tcp://localhost:54321",
-            rank=self.rank,
-            world_size=self.world_size,
-        )
-        torch.cuda.set_device(self.rank)
-
     def _log_training(self, scalars, images):
         print("log training placeholder...")
         if self.rank != 0 or self.global_step % self.log_interval != 0:
@@ -162,46 +163,87 @@ class VITSTrainer(TTSTrainer):
         print("log validation...")
         pass
 
-    def save_checkpoint(self, checkpoint_name, model, optimizer, learning_rate, epoch):
+    def save_checkpoint(
+        self, checkpoint_name, model, optimizer, learning_rate, epoch, **kwargs
+    ):
         if self.rank != 0:
             return
         if hasattr(model, "module"):
             state_dict = model.module.state_dict()
         else:
             state_dict = model.state_dict()
-        os.makedirs(self.checkpoint_path, exist_ok=True)
-        torch.save(
-            {
-                "model": state_dict,
-                "global_step": self.global_step,
-                "optimizer": optimizer.state_dict(),
-                "learning_rate": learning_rate,
-                "epoch": epoch,
-            },
-            os.path.join(self.checkpoint_path, f"{checkpoint_name}.pt"),
+        checkpoint = {
+            "model": state_dict,
+            "global_step": self.global_step,
+            "optimizer": optimizer.state_dict(),
+            "learning_rate": learning_rate,
+            "epoch": epoch,
+        }
+        for k, v in kwargs.items():
+            checkpoint[k] = v.state_dict() if hasattr(v, "state_dict") else v
+        self.write_checkpoint(
+            checkpoint_name, checkpoint, series=checkpoint_name.rsplit("_", 1)[0]
+        )
+
+    def save_train_checkpoints(
+        self, nets, optims, schedulers, scaler, epoch, end_of_epoch=False
+    ):
+        """Save generator and discriminator checkpoints that training can resume
+        from exactly, either part way through epoch or, if end_of_epoch, at the
+        start of the next one."""
+        if end_of_epoch:
+            train_state = self.train_state(epoch + 1, 0)
+        else:
+            train_state = self.train_state(epoch, self.epoch_samples)
+        self.save_checkpoint(
+            f"{self.checkpoint_name}_G_{self.global_step}",
+            nets[0],
+            optims[0],
+            self.learning_rate,
+            epoch,
+            scheduler=schedulers[0],
+            scaler=scaler,
+            train_state=train_state,
+        )
+        self.save_checkpoint(
+            f"{self.checkpoint_name}_D_{self.global_step}",
+            nets[1],
+            optims[1],
+            self.learning_rate,
+            epoch,
+            scheduler=schedulers[1],
         )
 
     def warm_start(self, net_g, net_d, optim_g, optim_d):
         if not (self.warm_start_name_g and self.warm_start_name_d):
             return net_g, net_d, optim_g, optim_d, 0
+        train_state = None
         if self.warm_start_name_g:
             checkpoint = torch.load(self.warm_start_name_g)
             net_g.load_state_dict(checkpoint["model"])
             optim_g.load_state_dict(checkpoint["optimizer"])
+            train_state = checkpoint.get("train_state")
+            for k in ["scaler", "scheduler"]:
+                if k in checkpoint:
+                    self._resume_states[f"{k}_g"] = checkpoint[k]
         if self.warm_start_name_d:
             checkpoint = torch.load(self.warm_start_name_d)
             net_d.load_state_dict(checkpoint["model"])
             optim_d.load_state_dict(checkpoint["optimizer"])
+            if "scheduler" in checkpoint:
+                self._resume_states["scheduler_d"] = checkpoint["scheduler"]
         self.global_step = checkpoint["global_step"]
         self.learning_rate = checkpoint["learning_rate"]
         start_epoch = checkpoint["epoch"]
+        if train_state is not None:
+            start_epoch = self.restore_train_state(train_state)
         return net_g, net_d, optim_g, optim_d, start_epoch
 
     def _batch_to_device(self, *args):
         ret = []
         if self.device == "cuda":
             for arg in args:
-                arg = arg.cuda(self.rank, non_blocking=True)
+                arg = arg.cuda(self.local_rank, non_blocking=True)
                 ret.append(arg)
             return ret
         else:
@@ -263,102 +305,134 @@ class VITSTrainer(TTSTrainer):
         optim_g, optim_d = optims
         scheduler_g, scheduler_d = schedulers
         train_loader, val_loader = loaders
-        train_loader.batch_sampler.set_epoch(epoch)
+        self.begin_epoch(epoch, train_loader.batch_sampler)
         net_g.train()
         net_d.train()
         # TODO (zach): remove when you want to.
         # self._evaluate(net_g, val_loader)
-        for batch_idx, batch in enumerate(train_loader):
+        self.step_timer.reset()
+        for batch_idx, batch in enumerate(self.step_timer.iterate(train_loader)):
             print(f"global step: {self.global_step}")
             print(f"batch idx: {batch_idx}")
-            (
-                x,
-                x_lengths,
-                spec,
-                spec_lengths,
-                y,
-                y_lengths,
-                speakers,
-            ) = self._batch_to_device(*batch)
-
-            with autocast(enabled=self.fp16_run):
+            with self.step_timer.phase("to_device"):
                 (
-                    y_hat,
-                    l_length,
-                    attn,
-                    ids_slice,
-                    x_mask,
-                    z_mask,
-                    (z, z_p, m_p, logs_p, m_q, logs_q),
-                ) = net_g(x, x_lengths, spec, spec_lengths, speakers)
-                mel = self.mel_stft.spec_to_mel(spec)
-                # NOTE(zach): slight difference from the original VITS
-                # implementation due to padding differences in the spectrograms
-                y_mel = slice_segments(
-                    mel, ids_slice, self.segment_size // self.hop_length
-                )
-                y_hat_mel = self.mel_stft.mel_spectrogram(y_hat.squeeze(1))
-                y = slice_segments(y, ids_slice * self.hop_length, self.segment_size)
-
-                # Discriminator
-                y_d_hat_r, y_d_hat_g, _, _ = net_d(y, y_hat.detach())
-                with autocast(enabled=False):
-                    loss_disc, losses_disc_r, losses_disc_g = discriminator_loss(
-                        y_d_hat_r, y_d_hat_g
+                    x,
+                    x_lengths,
+                    spec,
+                    spec_lengths,
+                    y,
+                    y_lengths,
+                    speakers,
+                    *ids_slice,
+                ) = self._batch_to_device(*batch)
+            # NOTE: with load_audio_segments the loader has already chosen the
+            # segments, and y holds only their audio.
+            ids_slice = ids_slice[0] if ids_slice else None
+
+            with self.accumulate(net_g, net_d) as optimizer_step:
+                with self.step_timer.phase("forward"), autocast(enabled=self.fp16_run):
+                    (
+                        y_hat,
+                        l_length,
+                        attn,
+                        ids_slice,
+                        x_mask,
+                        z_mask,
+                        (z, z_p, m_p, logs_p, m_q, logs_q),
+                    ) = net_g(x, x_lengths, spec, spec_lengths, speakers, ids_slice)
+                    mel = self.mel_stft.spec_to_mel(spec)
+                    # NOTE(zach): slight difference from the original VITS
+                    # implementation due to padding differences in the spectrograms
+                    y_mel = slice_segments(
+                        mel, ids_slice, self.segment_size // self.hop_length
                     )
-                    loss_disc_all = loss_disc
-            optim_d.zero_grad()
-            scaler.scale(loss_disc_all).backward()
-            scaler.unscale_(optim_d)
-            scaler.step(optim_d)
-
-            with autocast(enabled=self.fp16_run):
-                # Generator
-                y_d_hat_r, y_d_hat_g, fmap_r, fmap_g = net_d(y, y_hat)
-                with autocast(enabled=False):
-                    loss_dur = torch.sum(l_length.float())
-                    loss_mel = F.l1_loss(y_mel, y_hat_mel) * self.c_mel
-                    loss_kl = kl_loss(z_p, logs_q, m_p, logs_p, z_mask) * self.c_kl
-
-                    loss_fm = feature_loss(fmap_r, fmap_g)
-                    loss_gen, losses_gen = generator_loss(y_d_hat_g)
-                    loss_gen_all = loss_gen + loss_fm + loss_mel + loss_dur + loss_kl
-            optim_g.zero_grad()
-            scaler.scale(loss_gen_all).backward()
-            scaler.unscale_(optim_g)
-            scaler.step(optim_g)
-            scaler.update()
-
-            if self.rank == 0 and self.global_step % self.log_interval == 0:
-                grad_norm_g = clip_grad_value_(net_g.parameters(), None)
-                grad_norm_d = clip_grad_value_(net_d.parameters(), None)
-                self._log_training(
-                    scalars=dict(
-                        loss_g_total=loss_gen_all,
-                        loss_d_total=loss_disc_all,
-                        gradnorm_d=grad_norm_d,
-                        gradnorm_g=grad_norm_g,
-                        loss_g_fm=loss_fm,
-                        loss_g_dur=loss_dur,
-                        loss_g_mel=loss_mel,
-                        loss_g_kl=loss_kl,
-                    ),
-                    images=dict(
-                        slice_mel_org=save_figure_to_numpy(
-                            plot_spectrogram(y_mel[0].data.cpu())
-                        ),
-                        slice_mel_gen=save_figure_to_numpy(
-                            plot_spectrogram(y_hat_mel[0].data.cpu())
-                        ),
-                        all_mel=save_figure_to_numpy(
-                            plot_spectrogram(mel[0].data.cpu())
+                    y_hat_mel = self.mel_stft.mel_spectrogram(y_hat.squeeze(1))
+                    if not self.load_audio_segments:
+                        y = slice_segments(
+                            y, ids_slice * self.hop_length, self.segment_size
+                        )
+
+                with self.step_timer.phase("discriminator"):
+                    with autocast(enabled=self.fp16_run):
+                        y_d_hat_r, y_d_hat_g, _, _ = net_d(y, y_hat.detach())
+                        with autocast(enabled=False):
+                            (
+                                loss_disc,
+                                losses_disc_r,
+                                losses_disc_g,
+                            ) = discriminator_loss(y_d_hat_r, y_d_hat_g)
+                            loss_disc_all = loss_disc
+                    scaler.scale(loss_disc_all / self.accumulation_steps).backward()
+                    if optimizer_step:
+                        scaler.unscale_(optim_d)
+                        scaler.step(optim_d)
+
+                # NOTE: the discriminator's parameters are frozen for the generator
+                # loss, so its backward pass doesn't add to their gradients.
+                with self.step_timer.phase("generator_loss"), autocast(
+                    enabled=self.fp16_run
+                ), _frozen(net_d):
+                    y_d_hat_r, y_d_hat_g, fmap_r, fmap_g = net_d(y, y_hat)
+                    with autocast(enabled=False):
+                        loss_dur = torch.sum(l_length.float())
+                        loss_mel = F.l1_loss(y_mel, y_hat_mel) * self.c_mel
+                        loss_kl = kl_loss(z_p, logs_q, m_p, logs_p, z_mask) * self.c_kl
+
+                        loss_fm = feature_loss(fmap_r, fmap_g)
+                        loss_gen, losses_gen = generator_loss(y_d_hat_g)
+                        loss_gen_all = (
+                            loss_gen + loss_fm + loss_mel + loss_dur + loss_kl
+                        )
+                with self.step_timer.phase("backward"):
+                    scaler.scale(loss_gen_all / self.accumulation_steps).backward()
+            self.count_samples(batch[3].size(0), batch[3].sum().item())
+            if not optimizer_step:
+                continue
+
+            with self.step_timer.phase("optimizer"):
+                scaler.unscale_(optim_g)
+                scaler.step(optim_g)
+                scaler.update()
+
+            with self.step_timer.phase("log"):
+                if self.rank == 0 and self.global_step % self.log_interval == 0:
+                    grad_norm_g = clip_grad_value_(net_g.parameters(), None)
+                    grad_norm_d = clip_grad_value_(net_d.parameters(), None)
+                    self._log_training(
+                        scalars=dict(
+                            loss_g_total=loss_gen_all,
+                            loss_d_total=loss_disc_all,
+                            gradnorm_d=grad_norm_d,
+                            gradnorm_g=grad_norm_g,
+                            loss_g_fm=loss_fm,
+                            loss_g_dur=loss_dur,
+                            loss_g_mel=loss_mel,
+                            loss_g_kl=loss_kl,
                         ),
-                        all_attn=save_figure_to_numpy(
-                            plot_attention(attn[0, 0].data.cpu())
+                        images=dict(
+                            slice_mel_org=save_figure_to_numpy(
+                                plot_spectrogram(y_mel[0].data.cpu())
+                            ),
+                            slice_mel_gen=save_figure_to_numpy(
+                                plot_spectrogram(y_hat_mel[0].data.cpu())
+                            ),
+                            all_mel=save_figure_to_numpy(
+                                plot_spectrogram(mel[0].data.cpu())
+                            ),
+                            all_attn=save_figure_to_numpy(
+                                plot_attention(attn[0, 0].data.cpu())
+                            ),
                         ),
-                    ),
-                )
+                    )
+            optim_d.zero_grad()
+            optim_g.zero_grad()
             self.global_step += 1
+            self.log_step_timing(self.global_step)
+            if (
+                self.steps_per_checkpoint
+                and self.global_step % self.steps_per_checkpoint == 0
+            ):
+                self.save_train_checkpoints(nets, optims, schedulers, scaler, epoch)
         if self.rank == 0:
             self._evaluate(net_g, val_loader)
 
@@ -370,6 +444,7 @@ class VITSTrainer(TTSTrainer):
             self.hparams,
             debug=self.debug,
             debug_dataset_size=self.debug_dataset_size,
+            segment_size=self.segment_size if self.load_audio_segments else None,
         )
         train_sampler = DistributedBucketSampler(
             train_dataset,
@@ -380,11 +455,9 @@ class VITSTrainer(TTSTrainer):
             shuffle=True,
         )
         collate_fn = TextAudioSpeakerCollate()
-        train_loader = DataLoader(
+        train_loader = self.build_loader(
             train_dataset,
-            num_workers=0,
             shuffle=False,
-            pin_memory=True,
             collate_fn=collate_fn,
             batch_sampler=train_sampler,
         )
@@ -396,12 +469,10 @@ class VITSTrainer(TTSTrainer):
                 debug=self.debug,
                 debug_dataset_size=self.debug_dataset_size,
             )
-            val_loader = DataLoader(
+            val_loader = self.build_loader(
                 val_dataset,
-                num_workers=0,
                 shuffle=False,
                 batch_size=self.batch_size,
-                pin_memory=True,
                 drop_last=False,
                 collate_fn=collate_fn,
             )
@@ -416,8 +487,8 @@ class VITSTrainer(TTSTrainer):
         )
         net_d = MultiPeriodDiscriminator(self.use_spectral_norm)
         if self.device == "cuda":
-            net_g = net_g.cuda(self.rank)
-            net_d = net_d.cuda(self.rank)
+            net_g = net_g.cuda(self.local_rank)
+            net_d = net_d.cuda(self.local_rank)
 
         optim_g = torch.optim.AdamW(
             net_g.parameters(),
@@ -436,9 +507,8 @@ class VITSTrainer(TTSTrainer):
             optim_d,
         )
 
-        if self.distributed_run:
-            net_g = DDP(net_g, device_ids=[self.rank])
-            net_d = DDP(net_d, device_ids=[self.rank])
+        net_g = self.wrap_ddp(net_g)
+        net_d = self.wrap_ddp(net_d)
 
         scheduler_g = ExponentialLR(
             optim_g, gamma=self.lr_decay, last_epoch=start_epoch - 1
@@ -447,6 +517,9 @@ class VITSTrainer(TTSTrainer):
             optim_d, gamma=self.lr_decay, last_epoch=start_epoch - 1
         )
         scaler = GradScaler(enabled=self.fp16_run)
+        self.restore_state("scaler_g", scaler)
+        self.restore_state("scheduler_g", scheduler_g)
+        self.restore_state("scheduler_d", scheduler_d)
 
         for epoch in range(start_epoch, self.epochs):
             self._train_and_evaluate(
@@ -458,17 +531,12 @@ class VITSTrainer(TTSTrainer):
                 [train_loader, val_loader],
             )
             if epoch % self.epochs_per_checkpoint == 0:
-                self.save_checkpoint(
-                    f"{self.checkpoint_name}_G_{self.global_step}",
-                    net_g,
-                    optim_g,
-                    self.learning_rate,
+                self.save_train_checkpoints(
+                    [net_g, net_d],
+                    [optim_g, optim_d],
+                    [scheduler_g, scheduler_d],
+                    scaler,
                     epoch,
+                    end_of_epoch=True,
                 )
-                self.save_checkpoint(
-                    f"{self.checkpoint_name}_D_{self.global_step}",
-                    net_d,
-                    optim_d,
-                    self.learning_rate,
-                    epoch,
-                )
\ No newline at end of file
+        self.flush_logs()
\ No newline at end of file
@@ -3,8 +3,8 @@
 __all__ = ['mel_to_audio', 'differenceFunction', 'cumulativeMeanNormalizedDifferenceFunction', 'getPitch',
            'compute_yin', 'convert_to_wav', 'match_target_amplitude', 'modify_leading_silence',
            'normalize_audio_segment', 'normalize_audio', 'trim_audio', 'MAX_WAV_INT16', 'load_wav_to_torch',
-           'overlay_mono', 'overlay_stereo', 'mono_to_stereo', 'stereo_to_mono', 'resample', 'get_audio_max',
-           'to_int16']
+           'load_wav_segment_to_torch', 'overlay_mono', 'overlay_stereo', 'mono_to_stereo', 'stereo_to_mono',
+           'resample', 'get_audio_max', 'to_int16']
 
 # Cell
 """
@@ -268,10 +268,24 @@ def trim_audio(path, new_path, top_db=20):
 # Cell
 
 
+import soundfile as sf
+
+
 def load_wav_to_torch(path):
     sr, data = read(path)
     return torch.FloatTensor(data.astype(np.float32)), sr
 
+
+def load_wav_segment_to_torch(path, start, length):
+    """Like load_wav_to_torch, but only read the (16 bit) samples [start, start +
+    length) of the wav file, seeking past the rest. The segment is shorter than
+    length where the file ends first."""
+    with sf.SoundFile(path) as f:
+        f.seek(min(start, f.frames))
+        data = f.read(length, dtype="int16")
+        sr = f.samplerate
+    return torch.FloatTensor(data.astype(np.float32)), sr
+
 # Cell
 
 from scipy import signal
@@ -333,5 +347,11 @@ def get_audio_max(*audios):
 
 
 def to_int16(audio, max_wav_value=32768):
+    """Scale float audio in [-1, 1] to an int16 numpy array, clipping samples out
+    of range. Tensors are converted on their device, so only the int16 samples
+    are copied to the host, into an array that shares memory with them."""
     audio = audio * max_wav_value
-    return audio.astype(np.int16)
\ No newline at end of file
+    if isinstance(audio, torch.Tensor):
+        audio = audio.clamp(-max_wav_value, max_wav_value - 1)
+        return audio.to(torch.int16).cpu().numpy()
+    return audio.clip(-max_wav_value, max_wav_value - 1).astype(np.int16)
\ No newline at end of file
@@ -199,12 +199,12 @@ def generate_path(duration, mask):
 
 
 def slice_segments(x, ids_str, segment_size=4):
-    ret = torch.zeros_like(x[:, :, :segment_size])
-    for i in range(x.size(0)):
-        idx_str = ids_str[i]
-        idx_end = idx_str + segment_size
-        ret[i] = x[i, :, idx_str:idx_end]
-    return ret
+    """Cut x[i, :, ids_str[i]:ids_str[i] + segment_size] out of every item of x
+    [b, d, t] with a single gather."""
+    index = torch.arange(segment_size, device=x.device) + ids_str.to(
+        device=x.device, dtype=torch.long
+    ).view(-1, 1, 1)
+    return x.gather(2, index.expand(-1, x.size(1), -1))
 
 
 def rand_slice_segments(x, x_lengths=None, segment_size=4):
@@ -212,7 +212,7 @@ def rand_slice_segments(x, x_lengths=None, segment_size=4):
     if x_lengths is None:
         x_lengths = t
     ids_str_max = x_lengths - segment_size
-    ids_str = (torch.rand([b]).to(device=x.device) * ids_str_max).to(dtype=torch.long)
+    ids_str = (torch.rand([b], device=x.device) * ids_str_max).to(dtype=torch.long)
     ret = slice_segments(x, ids_str, segment_size)
     return ret, ids_str
 
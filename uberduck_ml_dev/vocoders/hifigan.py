@@ -20,6 +20,8 @@ import torch.nn as nn
 from torch.nn import Conv1d, ConvTranspose1d, AvgPool1d, Conv2d
 from torch.nn.utils import weight_norm, remove_weight_norm, spectral_norm
 
+from ..utils.audio import to_int16
+
 # Cell
 
 
@@ -52,16 +54,26 @@ class HiFiGanGenerator(nn.Module):
             h = AttrDict(json.load(f))
         return h
 
-    def forward(self, mel, max_wav_value=32768):
-        return self.infer(mel, max_wav_value=max_wav_value)
+    @torch.no_grad()
+    def forward(self, mel, mel_lengths=None):
+        """Vocode a batch of mels [B, n_mels, T] into float audio [B, T * hop_length]
+        in [-1, 1], on the device of mel.
+
+        With mel_lengths, returns a list of each item's audio, trimmed to its
+        length. Use to_int16 to convert audio for writing.
+        """
+        audio = self.vocoder(mel.to(self.device)).squeeze(1).to(mel.device)
+        if mel_lengths is None:
+            return audio
+        hop_length = audio.size(1) // mel.size(2)
+        return [
+            item[: length * hop_length]
+            for item, length in zip(audio, mel_lengths.tolist())
+        ]
 
     @torch.no_grad()
     def infer(self, mel, max_wav_value=32768):
-        audio = (
-            self.vocoder.forward(mel).cpu().squeeze().clamp(-1, 1).numpy()
-            * max_wav_value
-        ).astype(np.int16)
-        return audio
+        return to_int16(self.forward(mel).squeeze(), max_wav_value)
 
 # Cell
 